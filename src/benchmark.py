@@ -0,0 +1,263 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from src.config import logging, RelationsData
+from src.data.relations import RelationsDataLoader
+from src.data.base import DataLoader, AUTO, BIPARTITE, STRATEGIES
+from src.data.edgefile import EdgeFileDataLoader
+from src.data.ingest import pyarrow_available, CSV, FEATHER, NPY, PARQUET
+from src.learn_features import optimize, write_embeddings_to_file, TRAIN, INPUT_MODES
+from src.metrics import span
+from src.query import IVFIndex, NearestNeighbors, recall, ALL
+from src.utils import create_fake_test_csv, generate_graph
+from src.walks import sample_walks, sample_walks_batch, BATCH, ENGINES, PYTHON
+
+# A stage is a regression if it is this much slower than in the previous run...
+TOLERANCE = 1.25
+# ... and slower by more than this (seconds), so small stages don't fail on noise
+MIN_SECONDS = 0.05
+
+
+def benchmark_training_input(path_corpus: str, epochs: int = 1, context_size: int = 10,
+                             dim_features: int = 128) -> Dict[str, float]:
+    """
+    Train the skip-gram model on the same corpus with each input mode (Python iterator or corpus_file)
+    :return: seconds of training per input mode
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for input_mode in INPUT_MODES:
+            start = time.time()
+            optimize(path_corpus, [], TRAIN, os.path.join(folder, "features.npy"),
+                     epochs, context_size, dim_features, input_mode=input_mode)
+            results[input_mode] = time.time() - start
+            logging.info(f"Training with input mode {input_mode}: {results[input_mode]:.2f} seconds")
+    return results
+
+
+def benchmark_queries(path_embeddings: str, k: int = 10, n_queries: int = 1000, n_lists: Optional[int] = None,
+                      nprobes: Sequence[int] = (1, 4, 16), kind: str = ALL,
+                      seed: Optional[int] = None) -> Dict[str, Dict[str, float]]:
+    """
+    Latency of exact and approximate (IVF) top k queries, and recall of the approximate ones
+    :return: seconds per query (and recall) per search method
+    """
+    neighbors = NearestNeighbors.from_file(path_embeddings)
+    rng = np.random.default_rng(seed)
+    rows = neighbors.rows(kind)
+    queries = neighbors.vectors[np.sort(rng.choice(len(neighbors.ids), min(n_queries, len(neighbors.ids)),
+                                                   replace=False))]
+
+    start = time.time()
+    exact, _ = neighbors.search(queries, k, kind)
+    results = {"exact": {"seconds_per_query": (time.time() - start) / len(queries), "recall": 1.}}
+
+    start = time.time()
+    index = IVFIndex(neighbors, n_lists or max(1, int(np.sqrt(len(rows)))), seed=seed)
+    logging.info(f"IVF index of {index.n_lists} lists built in {time.time() - start:.2f} seconds")
+    for nprobe in nprobes:
+        start = time.time()
+        approximate, _ = index.search(queries, k, kind, nprobe)
+        results[f"ivf_nprobe_{nprobe}"] = {"seconds_per_query": (time.time() - start) / len(queries),
+                                           "recall": recall(exact, approximate)}
+
+    for method, result in results.items():
+        logging.info(f"{method}: {result['seconds_per_query'] * 1000:.3f} ms per query, recall@{k} "
+                     f"{result['recall']:.3f}")
+    return results
+
+
+def benchmark_pipeline(folder: str, n_edges: int, bipartite: bool = True, strategy: str = AUTO,
+                       engine: str = PYTHON, walks_per_node: int = 2, walk_length: int = 20, epochs: int = 1,
+                       train: bool = True, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Time each stage of learn_features on a synthetic power-law graph of n_edges edges
+    (n_edges / 2 users and n_edges / 20 likes, or the same number of nodes for a general graph)
+    :param train: Also time training and exporting the embeddings
+    :return: One record (wall and CPU seconds, peak RSS in bytes, ...) per stage
+    """
+    path_csv = os.path.join(folder, f"graph_{n_edges}_{'bipartite' if bipartite else 'general'}.csv")
+    if not os.path.exists(path_csv):
+        create_fake_test_csv(path_csv, max(n_edges // 2, 1), max(n_edges // 20, 1), n_edges, exponent=2.5,
+                             bipartite=bipartite, seed=seed)
+    info = {"edges": n_edges, "bipartite": bipartite, "strategy": strategy, "engine": engine}
+    records = []
+    path_walks = os.path.join(folder, "sampled_walks.txt")
+
+    with span("load", **info) as record:
+        dataloader = RelationsDataLoader(path_csv, min_like=2)
+    records.append(record)
+
+    with span("filter", **info) as record:
+        graph = dataloader.get_graph()
+        record.update(nodes=graph.num_nodes, directed_edges=graph.num_edges)
+    records.append(record)
+
+    if engine == BATCH:
+        # Nothing to precompute
+        bipartite_walks = strategy == BIPARTITE or (strategy == AUTO and dataloader.is_bipartite())
+        with span("walk", **info) as record:
+            sample_walks_batch(path_walks, graph, 1., 1., walks_per_node, walk_length, seed=seed,
+                               bipartite=bipartite_walks)
+    else:
+        with span("precompute", **info) as record:
+            matrix_prob, graph = dataloader.get_transition_probabilites(1., 1., strategy)
+        records.append(record)
+        with span("walk", **info) as record:
+            sample_walks(path_walks, matrix_prob, graph, walks_per_node, walk_length, seed=seed)
+    # A walk of walk_length nodes takes walk_length - 1 steps
+    record["steps_per_sec"] = walks_per_node * graph.num_nodes * (walk_length - 1) / record["wall"]
+    records.append(record)
+
+    if train:
+        with span("train", **info) as record:
+            model = optimize(path_walks, [], TRAIN, None, epochs, context_size=5, dim_features=32)
+        records.append(record)
+        with span("export", **info) as record:
+            write_embeddings_to_file(model, graph.like_nodes(), os.path.join(folder, "features.npy"))
+        records.append(record)
+    return records
+
+
+def write_edge_files(folder: str, n_edges: int, seed: int = 0) -> Dict[str, str]:
+    """
+    Write the same general graph of integer ids as csv, npy and (with pyarrow) parquet and feather files
+    :return: Path of the file of each format
+    """
+    df = generate_graph(max(n_edges // 2, 1), max(n_edges // 20, 1), n_edges, bipartite=False, seed=seed)
+    df = df.astype(np.int64)
+    paths = {fmt: os.path.join(folder, f"edges_{n_edges}.{fmt}") for fmt in [CSV, NPY, PARQUET, FEATHER]}
+    df.to_csv(paths[CSV])
+    np.save(paths[NPY], df[[RelationsData.USER_ID, RelationsData.LIKE_ID]].to_numpy())
+    if not pyarrow_available():
+        logging.warning("pyarrow is not installed, parquet and feather are not benchmarked")
+        del paths[PARQUET], paths[FEATHER]
+    else:
+        df.to_parquet(paths[PARQUET], index=False)
+        df.to_feather(paths[FEATHER])
+    return paths
+
+
+def benchmark_loading(folder: str, n_edges: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Time loading the same edges (and building the graph) from each edge file format.
+    The csv ids are parsed from text, the other formats keep their int64 ids.
+    :return: One record (wall and CPU seconds, peak RSS in bytes, file size) per format
+    """
+    records = []
+    for fmt, path in write_edge_files(folder, n_edges, seed).items():
+        with span("load", edges=n_edges, format=fmt, file_bytes=os.path.getsize(path)) as record:
+            dataloader: DataLoader = RelationsDataLoader(path, min_like=1) if fmt == CSV \
+                else EdgeFileDataLoader(path, min_like=1)
+            record["nodes"] = dataloader.get_graph().num_nodes
+        del dataloader
+        records.append(record)
+        logging.info(f"{fmt}: {record['wall']:.3f} s, {record['peak_rss'] / 1024 ** 2:.0f} MB peak RSS, "
+                     f"{record['file_bytes'] / 1024 ** 2:.1f} MB file")
+    return records
+
+
+def run_suite(scales: Sequence[int] = (10 ** 4, 10 ** 5), strategies: Sequence[str] = (AUTO,),
+              engines: Sequence[str] = (PYTHON,), train: bool = True, seed: int = 0) -> Dict[str, Any]:
+    """Benchmark the pipeline on bipartite and general graphs at several scales"""
+    results: List[Dict[str, Any]] = []
+    with tempfile.TemporaryDirectory() as folder:
+        for n_edges in scales:
+            for bipartite in [True, False]:
+                for strategy in strategies:
+                    for engine in engines:
+                        results += benchmark_pipeline(folder, n_edges, bipartite, strategy, engine, train=train,
+                                                      seed=seed)
+    for record in results:
+        logging.info(f"{record['name']} {record['edges']} edges (bipartite={record['bipartite']}, "
+                     f"{record['strategy']}, {record['engine']}): {record['wall']:.3f} s, "
+                     f"{record['peak_rss'] / 1024 ** 2:.0f} MB")
+    return {
+        "environment": {"python": platform.python_version(), "numpy": np.__version__,
+                        "platform": platform.platform(), "cpus": multiprocessing.cpu_count(),
+                        "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+        "results": results,
+    }
+
+
+def _record_key(record: Dict[str, Any]) -> Tuple:
+    return record["name"], record["edges"], record["bipartite"], record["strategy"], record["engine"]
+
+
+def compare_results(previous: Dict[str, Any], current: Dict[str, Any], tolerance: float = TOLERANCE,
+                    min_seconds: float = MIN_SECONDS) -> List[str]:
+    """:return: A description of each stage that got slower than in the previous run"""
+    previous_wall = {_record_key(record): record["wall"] for record in previous["results"]}
+    regressions = []
+    for record in current["results"]:
+        before = previous_wall.get(_record_key(record))
+        if before is not None and record["wall"] > before * tolerance and record["wall"] - before > min_seconds:
+            regressions.append(f"{_record_key(record)}: {before:.3f} s -> {record['wall']:.3f} s")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the training inputs or the embedding queries')
+    parser.add_argument('--corpus', type=str, default=None,
+                        help='Corpus of walks (.txt or .npy), sampled from Fake_Big_Relation.csv if not provided')
+    parser.add_argument('--epochs', type=int, default=1, help='Number of epochs to run the model')
+    parser.add_argument('--embeddings', type=str, default=None,
+                        help='Benchmark nearest neighbor queries on these embeddings (.npy) instead of training')
+    parser.add_argument('--k', type=int, default=10, help='Number of neighbors of each query')
+    parser.add_argument('--suite', action='store_true',
+                        help='Time every stage of the pipeline on synthetic graphs instead')
+    parser.add_argument('--scales', type=int, nargs='+', default=[10 ** 4, 10 ** 5],
+                        help='Number of edges of the synthetic graphs')
+    parser.add_argument('--strategies', type=str, nargs='+', choices=STRATEGIES, default=[AUTO])
+    parser.add_argument('--engines', type=str, nargs='+', choices=ENGINES, default=[PYTHON])
+    parser.add_argument('--loading', action='store_true',
+                        help='Compare the load time and memory of the csv, parquet, feather and npy edge files')
+    parser.add_argument('--n_edges', type=int, default=10 ** 6, help='Number of edges of the loading benchmark')
+    parser.add_argument('--no_train', action='store_true', help='Skip the train and export stages')
+    parser.add_argument('--output', type=str, default='benchmark_results.json', help='JSON file of the results')
+    parser.add_argument('--compare', type=str, default=None,
+                        help='JSON results of a previous run, exit with an error if a stage got slower')
+    args = parser.parse_args()
+
+    if args.suite:
+        results = run_suite(args.scales, args.strategies, args.engines, not args.no_train)
+        with open(args.output, 'w') as f_out:
+            json.dump(results, f_out, indent=2)
+        logging.info(f"Results written to {args.output}")
+        if args.compare is not None:
+            with open(args.compare) as f_previous:
+                regressions = compare_results(json.load(f_previous), results)
+            for regression in regressions:
+                logging.warning(f"Regression {regression}")
+            if regressions:
+                sys.exit(1)
+        return
+
+    if args.loading:
+        with tempfile.TemporaryDirectory() as folder:
+            benchmark_loading(folder, args.n_edges)
+        return
+
+    if args.embeddings is not None:
+        benchmark_queries(args.embeddings, args.k)
+        return
+
+    path_corpus: Optional[str] = args.corpus
+    with tempfile.TemporaryDirectory() as folder:
+        if path_corpus is None:
+            path_corpus = os.path.join(folder, "sampled_walks.txt")
+            dataloader = RelationsDataLoader(os.path.join(RelationsData.FOLDER, "Fake_Big_Relation.csv"))
+            sample_walks_batch(path_corpus, dataloader.get_graph(), 1., 1., bipartite=dataloader.is_bipartite())
+        benchmark_training_input(path_corpus, args.epochs)
+
+
+if __name__ == "__main__":
+    main()
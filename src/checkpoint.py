@@ -0,0 +1,365 @@
+import copy
+import glob
+import json
+import os
+import queue
+import random
+import re
+import shutil
+import sys
+import threading
+import time
+import numpy as np
+from gensim.models.callbacks import CallbackAny2Vec
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+import tqdm
+
+from src.config import logging
+from src.corpus import corpus_format, create_walk_corpus, save_counts, NodeCounter, NPY
+from src.data.base import Transitions
+from src.data.graph import Graph
+from src.walks import count_walks, random_walk, seed_shard, walker_pool, walker_state
+
+# Start nodes of a work unit of resumable walk generation
+UNIT_NODES = 100000
+# Training checkpoints kept by default
+KEEP_CHECKPOINTS = 2
+
+
+class WorkUnit(NamedTuple):
+    """The walks of one round from the start nodes [first_node, last_node), sampled with the stream (seed, unit)"""
+    unit: int
+    walk_round: int
+    first_node: int
+    last_node: int
+
+
+def work_units(num_nodes: int, walks_per_node: int, unit_nodes: int = UNIT_NODES) -> List[WorkUnit]:
+    bounds = list(range(0, num_nodes, unit_nodes)) + [num_nodes]
+    return [
+        WorkUnit(walk_round * (len(bounds) - 1) + i, walk_round, bounds[i], bounds[i + 1])
+        for walk_round in range(walks_per_node) for i in range(len(bounds) - 1)
+    ]
+
+
+def dump_json_atomic(path: str, obj: Any) -> None:
+    """Write to a temporary file then rename it, readers see the old file or the new one, never a partial one"""
+    path_tmp = path + ".tmp"
+    with open(path_tmp, 'w') as f_tmp:
+        json.dump(obj, f_tmp)
+        f_tmp.flush()
+        os.fsync(f_tmp.fileno())
+    os.replace(path_tmp, path)
+
+
+def manifest_path(path_save: str) -> str:
+    return path_save + ".manifest.json"
+
+
+def units_folder(path_save: str) -> str:
+    return path_save + ".units"
+
+
+def unit_path(path_save: str, unit: int) -> str:
+    return os.path.join(units_folder(path_save), f"unit{unit}.txt")
+
+
+def unit_counts_path(path_save: str, unit: int) -> str:
+    return os.path.join(units_folder(path_save), f"unit{unit}.counts.npy")
+
+
+class Manifest:
+    """
+    Parameters of a walk generation job and the work units already committed.
+    It only exists while the job is unfinished: a restart with the same parameters resumes the job.
+    """
+
+    def __init__(self, path_save: str, params: Dict[str, Any], completed: Optional[Set[int]] = None):
+        self.path = manifest_path(path_save)
+        self.params = params
+        self.completed = completed or set()
+
+    @classmethod
+    def resume(cls, path_save: str, params: Dict[str, Any]) -> Optional["Manifest"]:
+        """:return: The manifest of the unfinished job of path_save with the same parameters (any seed if None)"""
+        if not os.path.exists(manifest_path(path_save)):
+            return None
+        with open(manifest_path(path_save)) as f_manifest:
+            saved = json.load(f_manifest)
+        if params["seed"] is None:
+            params = {**params, "seed": saved["params"]["seed"]}
+        if saved["params"] != params:
+            logging.info(f"The unfinished walks of {path_save} have other parameters, starting over")
+            return None
+        if corpus_format(path_save) == NPY and not os.path.exists(path_save):
+            return None
+        return cls(path_save, params, set(saved["completed"]))
+
+    def save(self) -> None:
+        dump_json_atomic(self.path, {"params": self.params, "completed": sorted(self.completed)})
+
+    def complete(self, unit: int) -> None:
+        self.completed.add(unit)
+        self.save()
+
+    def remove(self) -> None:
+        os.remove(self.path)
+
+
+def _walk_unit(path_save: str, matrix_prob: Transitions, graph: Graph, unit: WorkUnit, walk_length: int,
+               seed: int) -> int:
+    """
+    Sample the walks of a unit and commit them: rows of the binary corpus (rewritten if the unit is run again),
+    or a text file renamed once complete. The node counts of the unit are committed the same way
+    """
+    seed_shard(seed, unit.unit)
+    walks = [random_walk(matrix_prob, node, walk_length) for node in range(unit.first_node, unit.last_node)]
+    if corpus_format(path_save) == NPY:
+        corpus = np.load(path_save, mmap_mode='r+')
+        first_walk = unit.walk_round * graph.num_nodes + unit.first_node
+        corpus[first_walk:first_walk + len(walks)] = walks
+        corpus.flush()
+    else:
+        path_unit = unit_path(path_save, unit.unit)
+        with open(path_unit + ".tmp", 'w', encoding='utf-8') as f_tmp:
+            for walk in walks:
+                f_tmp.write(" ".join(graph.decode(walk)) + '\n')
+        os.replace(path_unit + ".tmp", path_unit)
+
+    counter = NodeCounter(graph.num_nodes)
+    counter.add_walks(np.array(walks, dtype=np.int64))
+    path_counts = unit_counts_path(path_save, unit.unit)
+    with open(path_counts + ".tmp", 'wb') as f_tmp:
+        np.save(f_tmp, counter.counts)
+    os.replace(path_counts + ".tmp", path_counts)
+    return unit.unit
+
+
+def _star_walk_unit(args) -> int:
+    return _walk_unit(args[0], *walker_state(), *args[1:])
+
+
+def sample_walks_resumable(path_save: str, matrix_prob: Transitions, graph: Graph,
+                           walks_per_node: int = 10, walk_length: int = 80, workers: int = 1,
+                           seed: Optional[int] = None, unit_nodes: int = UNIT_NODES, **params):
+    """
+    Same corpus as sample_walks, sampled in work units committed one by one to a manifest next to path_save,
+    so that an interrupted job restarted with the same parameters only samples the missing units.
+    The walks of a unit only depend on (seed, unit), they are the same for any number of workers and restarts.
+    :param workers: Number of processes sampling units at the same time (forked, as in sample_walks)
+    :param unit_nodes: Number of start nodes of a unit, each unit is one round from a range of start nodes
+    :param params: Other parameters of the walks (e.g. p and q), a job with different ones is not resumed
+    """
+    params = {"num_nodes": graph.num_nodes, "num_edges": graph.num_edges, "walks_per_node": walks_per_node,
+              "walk_length": walk_length, "unit_nodes": unit_nodes, "seed": seed, **params}
+    manifest = Manifest.resume(path_save, params)
+    if manifest is None:
+        params["seed"] = seed if seed is not None else random.randrange(2 ** 32)
+        manifest = Manifest(path_save, params)
+        if corpus_format(path_save) == NPY:
+            create_walk_corpus(path_save, graph.nodes, walks_per_node * graph.num_nodes, walk_length).flush()
+        shutil.rmtree(units_folder(path_save), ignore_errors=True)
+        os.makedirs(units_folder(path_save))
+        manifest.save()
+    seed = manifest.params["seed"]
+
+    units = work_units(graph.num_nodes, walks_per_node, unit_nodes)
+    pending = [unit for unit in units if unit.unit not in manifest.completed]
+    logging.info(f"{len(units) - len(pending)} of {len(units)} work units already done, sampling {len(pending)}")
+    count_walks(sum(unit.last_node - unit.first_node for unit in pending), walk_length)
+
+    progress = tqdm.tqdm(total=len(pending), desc="Random walk (units)")
+    if workers > 1 and len(pending) > 1:
+        with walker_pool(matrix_prob, graph, min(workers, len(pending))) as pool:
+            tasks = [(path_save, unit, walk_length, seed) for unit in pending]
+            # Only this process writes the manifest
+            for done in pool.imap_unordered(_star_walk_unit, tasks):
+                manifest.complete(done)
+                progress.update()
+    else:
+        for unit in pending:
+            manifest.complete(_walk_unit(path_save, matrix_prob, graph, unit, walk_length, seed))
+            progress.update()
+    progress.close()
+
+    if corpus_format(path_save) != NPY:
+        logging.info(f"Merging {len(units)} work units into {path_save}")
+        with open(path_save + ".tmp", 'wb') as f_out:
+            for unit in units:
+                with open(unit_path(path_save, unit.unit), 'rb') as f_unit:
+                    shutil.copyfileobj(f_unit, f_out)
+        os.replace(path_save + ".tmp", path_save)
+    counts = sum(np.load(unit_counts_path(path_save, unit.unit)) for unit in units)
+    save_counts(path_save, graph.nodes, counts, walks_per_node * graph.num_nodes)
+    shutil.rmtree(units_folder(path_save))
+    manifest.remove()
+
+
+def snapshot_model(model):
+    """
+    Copy of a skip-gram model that the training can't modify. save() removes and restores attributes of the
+    objects it writes (cum_table, vectors_norm), so the sub-objects holding them are copied whole:
+    the vectors, the vocabulary and the output weights
+    """
+    snapshot = copy.copy(model)
+    snapshot.callbacks = ()
+    snapshot.wv = copy.deepcopy(model.wv)
+    # The vocabulary and the output weights are sub-objects with gensim 3, attributes of the model with gensim 4
+    for name in ["vocabulary", "trainables"]:
+        if hasattr(model, name):
+            setattr(snapshot, name, copy.deepcopy(getattr(model, name)))
+    for name in ["syn1neg", "syn1", "cum_table"]:
+        # Own attributes only, the model of gensim 3 forwards them to its sub-objects
+        if isinstance(vars(snapshot).get(name), np.ndarray):
+            setattr(snapshot, name, vars(snapshot)[name].copy())
+    return snapshot
+
+
+def remove_checkpoint(path: str) -> None:
+    """Remove a saved model and the arrays saved beside it (<path>.<attribute>.npy)"""
+    for name in [path] + glob.glob(glob.escape(path) + ".*.npy"):
+        if os.path.exists(name):
+            os.remove(name)
+
+
+class TrainingCheckpointer(CallbackAny2Vec):
+    """
+    Save restart points of the training every every_epochs epochs and/or every_minutes minutes
+    (checked at the end of each epoch, the only points where the state is consistent).
+    The callback only snapshots the model, a background thread pickles the snapshot to a temporary file
+    renamed once complete, so the workers don't wait for the serialization. The last keep checkpoints are kept.
+    A checkpoint due while the previous one is still being written is skipped.
+    Checkpoints are numbered by the epochs done since the first training of the folder, and each training
+    records its first and last epochs (run.json), marked complete when it ends, to tell an interrupted run apart.
+    """
+
+    def __init__(self, folder: str, every_epochs: Optional[int] = None, every_minutes: Optional[float] = None,
+                 keep: int = KEEP_CHECKPOINTS, epoch: int = 0):
+        """:param epoch: Epochs already done, when the training resumes from a checkpoint"""
+        self.folder = folder
+        self.every_epochs = every_epochs
+        self.every_minutes = every_minutes
+        self.keep = keep
+        self.epoch = epoch
+        self.start = epoch
+        self.target: Optional[int] = None
+        self.last_save = time.time()
+        self._queue: "queue.Queue[Optional[Tuple[int, Any]]]" = queue.Queue(maxsize=1)
+        self._writing = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, epoch: int) -> str:
+        return os.path.join(self.folder, f"checkpoint_epoch{epoch}.model")
+
+    def checkpoints(self) -> List[Tuple[int, str]]:
+        """:return: (epoch, path) of the complete checkpoints, oldest first"""
+        found = []
+        for name in os.listdir(self.folder):
+            match = re.fullmatch(r"checkpoint_epoch(\d+)\.model", name)
+            if match:
+                found.append((int(match.group(1)), os.path.join(self.folder, name)))
+        return sorted(found)
+
+    def latest(self) -> Optional[Tuple[int, str]]:
+        checkpoints = self.checkpoints()
+        return checkpoints[-1] if checkpoints else None
+
+    def run_path(self) -> str:
+        return os.path.join(self.folder, "run.json")
+
+    def begin(self, epochs: int, epoch: Optional[int] = None) -> None:
+        """
+        Record a training of epochs epochs, before it starts
+        :param epoch: Epochs already done by the model, the epoch of the newest checkpoint if None
+        (so the new checkpoints are numbered, and kept, after the older ones)
+        """
+        if epoch is None:
+            latest = self.latest()
+            epoch = latest[0] if latest is not None else 0
+        self.epoch = self.start = epoch
+        self.target = epoch + epochs
+        self._save_run(complete=False)
+
+    def _save_run(self, complete: bool) -> None:
+        dump_json_atomic(self.run_path(), {"start": self.start, "target": self.target, "complete": complete})
+
+    def interrupted(self) -> Optional[Tuple[Tuple[int, str], int]]:
+        """
+        :return: The newest checkpoint of the last training and the epochs it had left,
+        None if that training completed or wrote no checkpoint
+        """
+        if not os.path.exists(self.run_path()):
+            return None
+        with open(self.run_path()) as f_run:
+            run = json.load(f_run)
+        latest = self.latest()
+        if run["complete"] or latest is None or latest[0] <= run["start"]:
+            return None
+        return latest, run["target"] - latest[0]
+
+    def due(self) -> bool:
+        if self.every_epochs is not None and self.epoch % self.every_epochs == 0:
+            return True
+        return self.every_minutes is not None and time.time() - self.last_save >= 60 * self.every_minutes
+
+    def on_train_begin(self, model):
+        self._thread = threading.Thread(target=self._write, name="checkpointer", daemon=True)
+        self._thread.start()
+
+    def on_epoch_end(self, model):
+        self.epoch += 1
+        if not self.due():
+            return
+        if self._writing.is_set():
+            logging.warning(f"Checkpoint of epoch {self.epoch} skipped, the previous one is still being written")
+            return
+        self._writing.set()
+        self.last_save = time.time()
+        self._queue.put((self.epoch, snapshot_model(model)))
+
+    def on_train_end(self, model):
+        """Wait for the last checkpoint, and mark the training complete"""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self.target is not None:
+            self._save_run(complete=True)
+
+    def _write(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            epoch, snapshot = item
+            path = self.path(epoch)
+            try:
+                start = time.time()
+                # No array is stored in a separate .npy file, whatever its size (sep_limit applies to the
+                # sub-objects too), so that renaming the pickle commits the whole checkpoint
+                snapshot.save(path + ".tmp", separately=[], sep_limit=sys.maxsize, pickle_protocol=4)
+                os.replace(path + ".tmp", path)
+                logging.info(f"Checkpoint of epoch {epoch} written to {path} in {time.time() - start:.1f} s")
+                for _, old in self.checkpoints()[:-self.keep]:
+                    remove_checkpoint(old)
+            except Exception:
+                # A failed checkpoint must not stop the training
+                logging.exception(f"Checkpoint of epoch {epoch} failed")
+                remove_checkpoint(path + ".tmp")
+            finally:
+                del snapshot
+                self._writing.clear()
+
+    def __getstate__(self):
+        # The callbacks are saved with the model, the thread and its queue can't be
+        state = self.__dict__.copy()
+        for name in ["_queue", "_writing", "_thread"]:
+            state.pop(name)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._queue = queue.Queue(maxsize=1)
+        self._writing = threading.Event()
+        self._thread = None
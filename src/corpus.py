@@ -0,0 +1,154 @@
+import json
+import os
+import numpy as np
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional
+
+from src.utils import MySentences
+
+# Formats of the walk corpus: one walk per line of ids, or a uint32 matrix of node codes plus a vocabulary file
+TXT = "txt"
+NPY = "npy"
+CORPUS_FORMATS = [TXT, NPY]
+
+# Number of walks decoded at once when reading a binary corpus
+CHUNK_SIZE = 1024
+
+
+def corpus_format(path: str) -> str:
+    return NPY if path.endswith("." + NPY) else TXT
+
+
+def vocab_path(path_corpus: str) -> str:
+    return os.path.splitext(path_corpus)[0] + ".vocab.txt"
+
+
+def write_vocab(path_corpus: str, nodes: np.ndarray) -> None:
+    """Sidecar of a binary corpus: original id of code i on line i"""
+    with open(vocab_path(path_corpus), 'w', encoding='utf-8') as f_vocab:
+        for node in nodes.tolist():
+            f_vocab.write(node + '\n')
+
+
+def read_vocab(path_corpus: str) -> np.ndarray:
+    with open(vocab_path(path_corpus), encoding='utf-8') as f_vocab:
+        return np.array([line.rstrip('\n') for line in f_vocab], dtype=object)
+
+
+def counts_path(path_corpus: str) -> str:
+    # Keyed on the whole file name: walks.txt and walks.npy are different corpora
+    return path_corpus + ".counts.json"
+
+
+def file_version(path: str) -> List[int]:
+    """Size and modification time of a file, a corpus sampled again gets a new version even with the same size"""
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class NodeCounts(NamedTuple):
+    """What the skip-gram model would otherwise count by reading the whole corpus"""
+    counts: Dict[str, int]
+    walks: int
+    words: int
+
+
+def save_counts(path_corpus: str, nodes: np.ndarray, counts: np.ndarray, n_walks: int) -> None:
+    """
+    Sidecar of a corpus (of any format): occurrences of each node in its walks, counted while sampling them.
+    The version of the corpus (see file_version) is saved too, counts of another version of the corpus are ignored
+    :param counts: Occurrences of each node code
+    """
+    present = np.flatnonzero(counts)
+    with open(counts_path(path_corpus), 'w', encoding='utf-8') as f_counts:
+        json.dump({"version": file_version(path_corpus), "walks": n_walks, "words": int(counts.sum()),
+                   "counts": dict(zip(nodes[present].tolist(), counts[present].tolist()))}, f_counts)
+
+
+def load_counts(path_corpus: str) -> Optional[NodeCounts]:
+    """:return: The node counts of the corpus, None if they weren't saved or are stale"""
+    if not os.path.exists(counts_path(path_corpus)):
+        return None
+    with open(counts_path(path_corpus), encoding='utf-8') as f_counts:
+        saved = json.load(f_counts)
+    if saved.get("version") != file_version(path_corpus):
+        return None
+    return NodeCounts(saved["counts"], saved["walks"], saved["words"])
+
+
+def remove_counts(path_corpus: str) -> None:
+    if os.path.exists(counts_path(path_corpus)):
+        os.remove(counts_path(path_corpus))
+
+
+class NodeCounter:
+    """Occurrences of each node code in walks, counted with numpy by batches of walks"""
+
+    def __init__(self, num_nodes: int):
+        self.counts = np.zeros(num_nodes, dtype=np.int64)
+        self._pending: List[List[int]] = []
+
+    def add(self, walk: List[int]) -> None:
+        self._pending.append(walk)
+        if len(self._pending) == CHUNK_SIZE:
+            self.flush()
+
+    def add_walks(self, walks: np.ndarray) -> None:
+        self.counts += np.bincount(walks.ravel(), minlength=len(self.counts))
+
+    def flush(self) -> np.ndarray:
+        if self._pending:
+            self.add_walks(np.array(self._pending))
+            self._pending = []
+        return self.counts
+
+
+def create_walk_corpus(path_save: str, nodes: np.ndarray, n_walks: int, walk_length: int) -> np.memmap:
+    """Allocate a binary corpus on disk, to be filled row by row"""
+    write_vocab(path_save, nodes)
+    return np.lib.format.open_memmap(path_save, mode='w+', dtype=np.uint32, shape=(n_walks, walk_length))
+
+
+class WalkCorpus:
+    """
+    Memory-mapped binary corpus of walks. Like MySentences it can be iterated many times,
+    but the tokens come from looking up the vocabulary instead of parsing text.
+    """
+
+    def __init__(self, path_corpus: str):
+        self.walks = np.load(path_corpus, mmap_mode='r')
+        self.nodes = read_vocab(path_corpus)
+
+    def __iter__(self) -> Iterator[List[str]]:
+        for first_walk in range(0, len(self.walks), CHUNK_SIZE):
+            for walk in self.nodes[self.walks[first_walk:first_walk + CHUNK_SIZE]]:
+                yield walk.tolist()
+
+    def __len__(self) -> int:
+        return len(self.walks)
+
+
+def corpus_to_text(path_corpus: str) -> str:
+    """
+    LineSentence version of a corpus (one walk per line, ids separated by spaces), e.g. for gensim's corpus_file.
+    A binary corpus is converted to <corpus>.txt, reused as long as it is newer than the corpus
+    :return: path of the text corpus, path_corpus itself if it is already a text file
+    """
+    if corpus_format(path_corpus) == TXT:
+        return path_corpus
+    path_txt = path_corpus + "." + TXT
+    sources = max(os.path.getmtime(path_corpus), os.path.getmtime(vocab_path(path_corpus)))
+    if os.path.exists(path_txt) and os.path.getmtime(path_txt) >= sources:
+        return path_txt
+    # Renamed once complete, so an interrupted conversion is never reused
+    with open(path_txt + ".tmp", 'w', encoding='utf-8') as f_txt:
+        for walk in WalkCorpus(path_corpus):
+            f_txt.write(" ".join(walk) + '\n')
+    os.replace(path_txt + ".tmp", path_txt)
+    return path_txt
+
+
+def load_sentences(path_corpus: str) -> Iterable[List[str]]:
+    """Memory-friendly iterator over the walks of a corpus of any format"""
+    if corpus_format(path_corpus) == NPY:
+        return WalkCorpus(path_corpus)
+    return MySentences(path_corpus)
@@ -0,0 +1,175 @@
+import random
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+import tqdm
+
+from src.data.graph import buffer_view, Graph
+
+
+def alias_setup(weights: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vose's alias method: O(n) construction of the tables used for O(1) sampling
+    :param weights: Non-negative (unnormalized) weights
+    :return: prob (float32) and alias (int32) tables
+    """
+    n = len(weights)
+    scaled = np.asarray(weights, dtype=np.float64) * n / np.sum(weights)
+    prob = np.ones(n, dtype=np.float32)
+    alias = np.arange(n, dtype=np.int32)
+
+    small = [i for i in range(n) if scaled[i] < 1.]
+    large = [i for i in range(n) if scaled[i] >= 1.]
+    while small and large:
+        s, g = small.pop(), large.pop()
+        prob[s] = scaled[s]
+        alias[s] = g
+        scaled[g] = (scaled[g] + scaled[s]) - 1.
+        if scaled[g] < 1.:
+            small.append(g)
+        else:
+            large.append(g)
+    # Whatever remains has probability 1 up to rounding errors
+    return prob, alias
+
+
+class AliasSampler:
+    """
+    Frozen sampler over a fixed set of keys, backed by alias tables.
+    It's a drop-in replacement for the WeightedDict values of Dict_Prob (sample / keys / len / in)
+    but samples in O(1) and only stores flat arrays, which can be views into bigger buffers.
+    Arrays are held as memoryviews: indexing them is several times faster than indexing numpy arrays.
+    """
+    __slots__ = ("nodes", "prob", "alias")
+
+    def __init__(self, nodes: memoryview, prob: memoryview, alias: memoryview):
+        """
+        :param nodes: Keys that can be sampled
+        :param prob: Probability to keep the i-th key instead of its alias
+        :param alias: Index of the alias of the i-th key
+        """
+        self.nodes = nodes
+        self.prob = prob
+        self.alias = alias
+
+    @classmethod
+    def from_weights(cls, nodes: np.ndarray, weights: np.ndarray) -> "AliasSampler":
+        prob, alias = alias_setup(weights)
+        return cls(buffer_view(nodes), buffer_view(prob), buffer_view(alias))
+
+    def sample(self) -> int:
+        i = int(random.random() * len(self.prob))
+        if random.random() >= self.prob[i]:
+            i = self.alias[i]
+        return self.nodes[i]
+
+    def probabilities(self) -> np.ndarray:
+        """Exact distribution encoded by the tables (for testing)"""
+        prob = np.asarray(self.prob)
+        dist = prob.astype(np.float64)
+        np.add.at(dist, np.asarray(self.alias), 1. - prob)
+        return dist / len(prob)
+
+    def keys(self) -> List[int]:
+        return self.nodes.tolist()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, key):
+        return key in self.nodes
+
+
+def alias_offsets(graph: Graph) -> np.ndarray:
+    """The table of edge e = (previous, start) covers all neighbors of start: it's prob[offsets[e]:offsets[e + 1]]"""
+    offsets = np.zeros(graph.num_edges + 1, dtype=np.int64)
+    np.cumsum(graph.degrees()[graph.indices], out=offsets[1:])
+    return offsets
+
+
+def alias_tables(graph: Graph, p: float, q: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Alias tables of all (previous, start) pairs, concatenated in the order of the edges of the graph
+    :return: prob (float32) and alias (int32) flat arrays
+    """
+    offsets = alias_offsets(graph)
+    prob = np.empty(offsets[-1], dtype=np.float32)
+    alias = np.empty(offsets[-1], dtype=np.int32)
+    for previous in tqdm.trange(graph.num_nodes, desc="Precomputing alias tables"):
+        for e in range(graph.indptr[previous], graph.indptr[previous + 1]):
+            weights = transition_weights(graph, previous, graph.indices[e], p, q)
+            prob[offsets[e]:offsets[e + 1]], alias[offsets[e]:offsets[e + 1]] = alias_setup(weights)
+    return prob, alias
+
+
+def transition_weights(graph: Graph, previous: int, start: int, p: float, q: float) -> np.ndarray:
+    """Unnormalized probabilities of the neighbors of start, coming from previous"""
+    neighbors = graph.neighbors(start)
+    # 1/p to get back, 1 if previous node and start share the neighbor, 1/q otherwise
+    weights = np.where(np.isin(neighbors, graph.neighbors(previous), assume_unique=True), 1., 1. / q)
+    weights[neighbors == previous] = 1. / p
+    return weights
+
+
+def hub_neighbors(graph: Graph, max_degree: int, seed: Optional[int] = None) -> Dict[int, np.ndarray]:
+    """
+    :return: A uniform sample (sorted) of max_degree neighbors of each node that has more neighbors.
+    With a seed, the sample of a node only depends on the seed and its neighbors, so it stays the same
+    when edges are added elsewhere in the graph
+    """
+    return {
+        node: np.sort(np.random.default_rng(None if seed is None else [seed, node]).choice(
+            graph.neighbors(node), max_degree, replace=False))
+        for node in np.flatnonzero(graph.degrees() > max_degree).tolist()
+    }
+
+
+def capped_weights(graph: Graph, previous: int, start: int, p: float, q: float,
+                   sample: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Approximate transitions of a hub start coming from previous: previous and a sample of the other neighbors.
+    The weights of the sample are scaled by (degree - 1) / len(sample) so they stand for all the other neighbors,
+    which keeps the probability to go back and the ratio of 1 and 1/q steps close to the exact ones.
+    :return: The nodes of the table and their unnormalized probabilities
+    """
+    others = sample[sample != previous]
+    scale = (graph.indptr[start + 1] - graph.indptr[start] - 1) / max(len(others), 1)
+    weights = np.where(np.isin(others, graph.neighbors(previous), assume_unique=True), 1., 1. / q) * scale
+    return np.concatenate([[previous], others]).astype(np.int32), np.concatenate([[1. / p], weights])
+
+
+def alias_row(graph: Graph, previous: int, p: float, q: float,
+              hubs: Optional[Dict[int, np.ndarray]] = None) -> Dict[int, AliasSampler]:
+    """
+    Samplers of all the walks coming from previous, each one with its own small tables
+    :param hubs: Sampled neighbors of the nodes whose tables are capped (see hub_neighbors)
+    """
+    row = {}
+    for start in graph.neighbors(previous).tolist():
+        if hubs is not None and start in hubs:
+            row[start] = AliasSampler.from_weights(*capped_weights(graph, previous, start, p, q, hubs[start]))
+        else:
+            row[start] = AliasSampler.from_weights(graph.neighbors(start),
+                                                   transition_weights(graph, previous, start, p, q))
+    return row
+
+
+def alias_samplers(graph: Graph, prob: np.ndarray, alias: np.ndarray) -> Dict[int, Dict[int, AliasSampler]]:
+    """Samplers of all (previous, start) pairs, they only hold views of the flat tables"""
+    offsets = alias_offsets(graph)
+    buf_prob, buf_alias, buf_nodes = buffer_view(prob), buffer_view(alias), buffer_view(graph.indices)
+    dct: Dict[int, Dict[int, AliasSampler]] = {}
+    for previous in range(graph.num_nodes):
+        dct[previous] = {}
+        for e in range(graph.indptr[previous], graph.indptr[previous + 1]):
+            start = int(graph.indices[e])
+            dct[previous][start] = AliasSampler(
+                buf_nodes[graph.indptr[start]:graph.indptr[start + 1]],
+                buf_prob[offsets[e]:offsets[e + 1]], buf_alias[offsets[e]:offsets[e + 1]]
+            )
+    return dct
+
+
+def alias_transitions(graph: Graph, p: float, q: float) -> Dict[int, Dict[int, AliasSampler]]:
+    """Same transitions as DataLoader._neighbors_neighbors but with alias samplers"""
+    prob, alias = alias_tables(graph, p, q)
+    return alias_samplers(graph, prob, alias)
@@ -1,89 +1,240 @@
+import numpy as np
 import pandas as pd
-from typing import Dict, List, Tuple
+from typing import Any, Callable, Dict, List, Mapping, Optional, Tuple, Union
 from abc import ABC
 import tqdm
 
+from src.data.graph import Graph
+from src.data.ingest import drop_missing, EdgeList, Interner
+from src.data.alias import AliasSampler, alias_row, alias_samplers, alias_tables, capped_weights, hub_neighbors
+from src.data.cache import TransitionCache, graph_arrays, graph_from_arrays
+from src.data.transitions import BipartiteTransitions, LazyTransitions
 from src.data.weighted_dict import WeightedDict
 from src.config import logging
+from src.metrics import metrics
 
-# Dictionnary of transition probabilities
-Dict_Prob = Dict[str, Dict[str, WeightedDict]]
+# Dictionnary of transition probabilities, keyed by node codes of the Graph
+Dict_Prob = Dict[int, Dict[int, Union[WeightedDict, AliasSampler]]]
+# Dict_Prob or any structure with the same access pattern: transitions[previous][start].sample()
+Transitions = Mapping[int, Mapping[int, Any]]
+
+# Strategies to precompute the transition probabilities
+FULL = "full"
+ALIAS = "alias"
+LAZY = "lazy"
+BIPARTITE = "bipartite"
+# bipartite if the graph is bipartite, full otherwise
+AUTO = "auto"
+STRATEGIES = [AUTO, FULL, ALIAS, LAZY, BIPARTITE]
 
 
 class DataLoader(ABC):
+    # dtype the ids were read with, it changes their string representation
+    dtype: Optional[Any] = None
 
     def __init__(
             self,
-            df: pd.DataFrame,
+            df: Optional[pd.DataFrame],
             col1: str,
             col2: str,
-            min_like: int = 1
+            min_like: int = 1,
+            bipartite: Optional[bool] = None,
+            path_input: Optional[str] = None,
+            edges: Optional[Union[EdgeList, Callable[[], EdgeList]]] = None
     ):
+        """
+        :param df: Dataframe of the edges, or None if they are given already interned as edges
+        :param bipartite: Whether no id appears in both columns, detected from the data if None
+        :param path_input: File the dataframe was read from, needed to cache the preprocessing
+        :param edges: Edges read with read_edges, instead of df, or a function reading them.
+        The file is then only read when the edges are needed, not when the graph is in the cache
+        """
         self.USER_ID = col1
         self.LIKE_ID = col2
         self.min_like = min_like
+        self.bipartite = bipartite
+        self.path_input = path_input
+        self._df: Optional[pd.DataFrame] = None
 
-        self.df = df
-        self.df[self.USER_ID] = self.df[self.USER_ID].astype(str)
-        self.df[self.LIKE_ID] = self.df[self.LIKE_ID].astype(str)
-        if len(self.df) == 0:
-            raise ValueError(f"Dataframe provided is empty")
+        if edges is None:
+            if df is None or len(df) == 0:
+                raise ValueError("Dataframe provided is empty")
+            # Ids are interned once: the dataframe only holds int32 codes into self.vocab
+            users, likes, vocab = self._intern_ids(df[self.USER_ID], df[self.LIKE_ID])
+            self._set_edges(EdgeList(users, likes, vocab, np.bincount(likes, minlength=len(vocab))))
+        elif isinstance(edges, EdgeList):
+            self._set_edges(edges)
+        else:
+            self._read_edges = edges
+
+    def _set_edges(self, edges: EdgeList) -> None:
+        if len(edges.users) == 0:
+            raise ValueError("Edge list provided is empty")
+        users, likes, self._vocab, self._like_degrees = edges
+        self._df = pd.DataFrame({self.USER_ID: users, self.LIKE_ID: likes})
+
+    def _load(self) -> pd.DataFrame:
+        if self._df is None:
+            self._set_edges(self._read_edges())
+        return self._df
 
-    def get_df_likes(self):
-        return self.df.groupby(self.LIKE_ID)[self.USER_ID].apply(list)
+    @property
+    def df(self) -> pd.DataFrame:
+        """Codes of the users and of the likes of every row, the edges are read on first use"""
+        return self._load()
 
-    def get_df_users(self):
-        return self.df.groupby(self.USER_ID)[self.LIKE_ID].apply(list)
+    @df.setter
+    def df(self, df: pd.DataFrame) -> None:
+        self._df = df
+
+    @property
+    def vocab(self) -> np.ndarray:
+        """Original id of each code"""
+        self._load()
+        return self._vocab
+
+    @property
+    def like_degrees(self) -> np.ndarray:
+        """Number of rows of each code in the like column, before any filtering"""
+        self._load()
+        return self._like_degrees
+
+    @staticmethod
+    def _intern_ids(users: pd.Series, likes: pd.Series) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Map the ids of both columns to int32 codes into a shared vocabulary of strings.
+        Only the unique ids are converted to strings.
+        """
+        users, likes = drop_missing(users, likes)
+        interner = Interner()
+        codes = interner.intern(pd.concat([users, likes], ignore_index=True))
+        return codes[:len(users)], codes[len(users):], interner.vocab()
+
+    def get_df_likes(self) -> pd.Series:
+        """Users of each like (codes), same as groupby(like).apply(list)"""
+        return self._group(self.LIKE_ID, self.USER_ID)
+
+    def get_df_users(self) -> pd.Series:
+        """Likes of each user (codes), same as groupby(user).apply(list)"""
+        return self._group(self.USER_ID, self.LIKE_ID)
+
+    def _group(self, key: str, value: str) -> pd.Series:
+        keys, values = self.df[key].values, self.df[value].values
+        # A stable sort keeps the order of the rows inside each group
+        order = np.argsort(keys, kind='stable')
+        groups, starts = np.unique(keys[order], return_index=True)
+        lists = [group.tolist() for group in np.split(values[order], starts[1:])]
+        return pd.Series(lists, index=pd.Index(groups, name=key), name=value, dtype=object)
 
     def list_like_nodes(self) -> List[str]:
-        return list(self.df[self.LIKE_ID].unique())
+        return self.vocab[self.df[self.LIKE_ID].unique()].tolist()
 
     def list_all_nodes(self) -> List[str]:
-        users = self.df[self.USER_ID].unique()
-        likes = self.df[self.LIKE_ID].unique()
-        return list(set(users).union(set(likes)))
+        codes = np.union1d(self.df[self.USER_ID].values, self.df[self.LIKE_ID].values)
+        return self.vocab[codes].tolist()
+
+    def is_bipartite(self) -> bool:
+        if self.bipartite is None:
+            self.bipartite = len(np.intersect1d(self.df[self.USER_ID].values, self.df[self.LIKE_ID].values)) == 0
+            logging.info(f"Detected bipartite graph = {self.bipartite}")
+        return self.bipartite
+
+    def _cache_key(self, cache: Optional[TransitionCache], **params) -> Optional[str]:
+        if cache is None or self.path_input is None:
+            return None
+        return cache.key(self.path_input, user_id=self.USER_ID, like_id=self.LIKE_ID, min_like=self.min_like,
+                         dtype=self.dtype, **params)
+
+    def get_graph(self, cache: Optional[TransitionCache] = None) -> Graph:
+        """
+        Graph of the edges left after dropping the likes with less than min_like connections
+        :param cache: Where to look for the graph before building it (and save it after)
+        """
+        key = self._cache_key(cache)
+        if cache is not None and key is not None:
+            arrays = cache.load(key)
+            if arrays is not None:
+                if self.bipartite is None and "bipartite" in arrays:
+                    self.bipartite = bool(arrays["bipartite"])
+                return graph_from_arrays(arrays)
+
+        if self.min_like > 1:
+            self._filter_df_min_connections(is_users=False)
+        graph = Graph.from_edges(self.df[self.USER_ID].values, self.df[self.LIKE_ID].values, self.vocab)
+
+        if cache is not None and key is not None:
+            # The edges aren't read on a hit, the bipartite check is saved with the graph
+            cache.save(key, {**graph_arrays(graph), "bipartite": np.array(self.is_bipartite())})
+        return graph
+
+    def _alias_tables(
+            self, graph: Graph, p: float, q: float, cache: Optional[TransitionCache]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        key = self._cache_key(cache, p=p, q=q, strategy=ALIAS)
+        if cache is not None and key is not None:
+            arrays = cache.load(key)
+            if arrays is not None:
+                return arrays["prob"], arrays["alias"]
+
+        prob, alias = alias_tables(graph, p, q)
+
+        if cache is not None and key is not None:
+            cache.save(key, {"prob": prob, "alias": alias})
+        return prob, alias
 
     @staticmethod
     def _neighbors_neighbors(
-            df_start: pd.DataFrame, df_neighbors: pd.DataFrame, p: float, q: float
-    ) -> Dict_Prob:
-        dct: Dict_Prob = {}
-        df_start = df_start.apply(lambda x: set(x))
-        for previous, possible_starts in tqdm.tqdm(df_start.items(), desc="Precomputing neighbors'neighbors",
-                                                   total=len(df_start)):
-            dct[previous] = {}
-            for start in possible_starts:
-                # Probability to get back to itself
-                dct[previous][start] = WeightedDict()
-                dct[previous][start][previous] = 1 / p
-                for neighbor in df_neighbors[start]:
-                    # Second neighbors
-                    if neighbor != previous:
-                        if neighbor in possible_starts:
-                            # Previous node and start share the same neighbor !
-                            dct[previous][start][neighbor] = 1
-                        else:
-                            # there is a distance of 2 between previous and neighbor
-                            dct[previous][start][neighbor] = 1 / q
+            graph: Graph, p: float, q: float, hubs: Optional[Dict[int, np.ndarray]] = None
+    ) -> Dict[int, Dict[int, WeightedDict]]:
+        dct: Dict[int, Dict[int, WeightedDict]] = {}
+        for previous in tqdm.trange(graph.num_nodes, desc="Precomputing neighbors'neighbors"):
+            dct[previous] = DataLoader._neighbors_row(graph, previous, p, q, hubs)
         return dct
 
+    @staticmethod
+    def _neighbors_row(
+            graph: Graph, previous: int, p: float, q: float, hubs: Optional[Dict[int, np.ndarray]] = None
+    ) -> Dict[int, WeightedDict]:
+        """
+        Transitions of all the walks coming from previous
+        :param hubs: Sampled neighbors of the nodes whose tables are capped (see hub_neighbors)
+        """
+        possible_starts = set(graph.neighbors(previous).tolist())
+        row: Dict[int, WeightedDict] = {}
+        for start in possible_starts:
+            row[start] = WeightedDict()
+            if hubs is not None and start in hubs:
+                nodes, weights = capped_weights(graph, previous, start, p, q, hubs[start])
+                for neighbor, weight in zip(nodes.tolist(), weights.tolist()):
+                    row[start][neighbor] = weight
+                continue
+            # Probability to get back to itself
+            row[start][previous] = 1 / p
+            for neighbor in graph.neighbors(start).tolist():
+                # Second neighbors
+                if neighbor != previous:
+                    if neighbor in possible_starts:
+                        # Previous node and start share the same neighbor !
+                        row[start][neighbor] = 1
+                    else:
+                        # there is a distance of 2 between previous and neighbor
+                        row[start][neighbor] = 1 / q
+        return row
+
     def _filter_df_min_connections(self, is_users: bool):
         """
         :param is_users: If true, drop users that have less than X connections to items,
         If false drop items that have less than X connections to users
         :return:
         """
-        df_drop = self.get_df_users() if is_users else self.get_df_likes()
+        column = self.USER_ID if is_users else self.LIKE_ID
+        codes = self.df[column].values
+        # Number of connections of each id, the likes' ones were counted while reading the data
+        degrees = np.bincount(codes, minlength=len(self.vocab)) if is_users else self.like_degrees
         len_bef = len(self.df)
         logging.info(f"Dropping columns with less than {self.min_like} connections"
                      f" -> Shape before = {self.df.shape}")
-        ids_to_drop = []
-        for _id, list_connections in df_drop.iteritems():
-            if len(list_connections) < self.min_like:
-                ids_to_drop.append(_id)
-
-        column = self.USER_ID if is_users else self.LIKE_ID
-        self.df = self.df[~self.df[column].isin(ids_to_drop)]
+        self.df = self.df[degrees[codes] >= self.min_like]
         logging.info(f"Dropped a total of {len_bef - self.df.shape[0]} rows")
 
         if len(self.df) == 0:
@@ -91,22 +242,71 @@ class DataLoader(ABC):
                 f"Dataframe is now empty! Either min_like={self.min_like} is too big or input data is invalid"
             )
 
-    def get_transition_probabilites(
-            self, p: float = 1., q: float = 1.
-    ) -> Tuple[Dict_Prob, List[str]]:
-        if self.min_like > 1:
-            self._filter_df_min_connections(is_users=False)
-        # Calculate this here because we modify dataframe
-        all_nodes = self.list_all_nodes()
+    def resolve_strategy(self, strategy: str) -> str:
+        """:return: The strategy that auto stands for on this graph"""
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy {strategy}, choose from {STRATEGIES}")
+        if strategy == AUTO:
+            return BIPARTITE if self.is_bipartite() else FULL
+        return strategy
 
-        df_users = self.get_df_users()
-        df_likes = self.get_df_likes()
+    def get_edges(self) -> Tuple[np.ndarray, np.ndarray]:
+        """:return: Original ids of the users and of the likes of every row"""
+        return self.vocab[self.df[self.USER_ID].values], self.vocab[self.df[self.LIKE_ID].values]
 
-        df_total = (df_users.append(df_likes)).groupby(level=0).apply(sum)
+    def get_transition_probabilites(
+            self, p: float = 1., q: float = 1., strategy: str = AUTO, cache: Optional[TransitionCache] = None,
+            max_degree: Optional[int] = None, seed: Optional[int] = None
+    ) -> Tuple[Transitions, Graph]:
+        """
+        :param strategy: {'auto', 'full', 'alias', 'lazy', 'bipartite'} full builds a WeightedDict
+        per (previous, start) pair, alias builds frozen alias tables instead (O(1) sampling, flat arrays),
+        lazy precomputes nothing and samples each step by rejection from the adjacency only,
+        bipartite precomputes nothing and samples in O(1) but is only valid for bipartite graphs.
+        auto uses bipartite if the graph is bipartite and full otherwise
+        :param cache: Cache of the graph and of the alias tables (the WeightedDicts of full can't be cached)
+        :param max_degree: Cap the tables of full and alias: from a node with more neighbors, the walk goes back
+        or to one of max_degree neighbors sampled once (with seed), approximating the exact transitions.
+        Capped alias tables are built per node and are not cached
+        :return: The transition probabilities and the graph they were computed on,
+        which maps node codes back to the original ids
+        """
+        strategy = self.resolve_strategy(strategy)
+        graph = self.get_graph(cache)
+
+        logging.info(f"graph: {graph.num_nodes} nodes, {graph.num_edges} directed edges")
+        metrics.gauge("nodes", graph.num_nodes)
+        metrics.gauge("directed_edges", graph.num_edges)
+        if max_degree is not None and strategy in [LAZY, BIPARTITE]:
+            logging.info(f"max_degree is ignored by the {strategy} strategy, its tables are built on the fly")
+        if strategy == LAZY:
+            return LazyTransitions(graph, p, q), graph
+        if strategy == BIPARTITE:
+            return BipartiteTransitions(graph, p, q), graph
 
-        logging.info(f"df_total.shape = {df_total.shape}")
         logging.info("Getting All Nodes' neighbors and its neighbors' neighbors")
-        all_neighbors = self._neighbors_neighbors(df_total, df_total, p, q)
+        degrees = graph.degrees()
+        hubs = None
+        if max_degree is not None:
+            hubs = hub_neighbors(graph, max_degree, seed)
+            logging.info(f"Capping the tables of {len(hubs)} nodes with more than {max_degree} neighbors")
+            metrics.gauge("max_degree", max_degree)
+            metrics.gauge("capped_nodes", len(hubs))
+        # One table per directed edge (previous, start), with one entry per neighbor of start (at most max_degree + 1)
+        table_sizes = degrees if max_degree is None else np.minimum(degrees, max_degree + 1)
+        metrics.gauge("transition_tables", graph.num_edges)
+        metrics.gauge("transition_entries", int((degrees * table_sizes).sum()))
+
+        all_neighbors: Transitions
+        if strategy == ALIAS and hubs:
+            all_neighbors = {
+                previous: alias_row(graph, previous, p, q, hubs)
+                for previous in tqdm.trange(graph.num_nodes, desc="Precomputing capped alias tables")
+            }
+        elif strategy == ALIAS:
+            all_neighbors = alias_samplers(graph, *self._alias_tables(graph, p, q, cache))
+        else:
+            all_neighbors = self._neighbors_neighbors(graph, p, q, hubs)
 
-        return all_neighbors, all_nodes
+        return all_neighbors, graph
 
@@ -1,7 +1,8 @@
-import pandas as pd
 import os
+from typing import Any, Optional
 
 from src.data.base import DataLoader
+from src.data.ingest import read_edges, CHUNK_ROWS
 
 
 class BlogCatalogDataLoader(DataLoader):
@@ -11,10 +12,15 @@ class BlogCatalogDataLoader(DataLoader):
     def __init__(
             self,
             path_edge_csv: str,
-            min_like: int = 1
+            min_like: int = 1,
+            bipartite: Optional[bool] = None,
+            chunksize: int = CHUNK_ROWS,
+            dtype: Optional[Any] = None
     ):
         if not os.path.exists(path_edge_csv):
             raise ValueError(f"path_csv provided doesn't exist = {path_edge_csv}")
 
-        df = pd.read_csv(path_edge_csv, header=None, names=[self.COL1, self.COL2])
-        super().__init__(df, self.COL1, self.COL2, min_like)
+        self.dtype = dtype
+        super().__init__(None, self.COL1, self.COL2, min_like, bipartite, path_edge_csv,
+                         lambda: read_edges(path_edge_csv, self.COL1, self.COL2, chunksize, dtype,
+                                            header=None, names=[self.COL1, self.COL2]))
@@ -0,0 +1,123 @@
+import hashlib
+import os
+import re
+import shutil
+import numpy as np
+from typing import Dict, Optional, Tuple
+
+from src.config import logging
+from src.data.graph import Graph
+
+# Bump when the files of an entry change
+CACHE_VERSION = 2
+GRAPH_ARRAYS = ["nodes", "indptr", "indices", "is_like"]
+# Default maximum size of the cache in bytes
+MAX_BYTES = 10 * 1024 ** 3
+# Names of the entries (sha256 keys) and of their temporary folders, nothing else in the folder is touched
+ENTRY_NAME = re.compile(r"[0-9a-f]{64}(\.tmp\d+)?")
+
+
+def file_hash(path: str, block_size: int = 1024 ** 2) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class TransitionCache:
+    """
+    Content-addressed cache of the preprocessed graph (and of the transition tables when they are flat arrays).
+    Each entry is a folder of .npy files, loaded with mmap so a hit costs milliseconds.
+    The least recently used entries are evicted when the cache grows above max_bytes.
+    """
+
+    def __init__(self, folder: str, max_bytes: int = MAX_BYTES):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        # Hash of each input file, by (path, size, modification time): each file is hashed once per run
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+        os.makedirs(folder, exist_ok=True)
+
+    def input_hash(self, path_input: str) -> str:
+        stat = os.stat(path_input)
+        version = (os.path.realpath(path_input), stat.st_size, stat.st_mtime_ns)
+        if version not in self._hashes:
+            self._hashes[version] = file_hash(path_input)
+        return self._hashes[version]
+
+    def key(self, path_input: str, **params) -> str:
+        """Hash of the content of the input file and of the parameters of the preprocessing"""
+        description = f"v{CACHE_VERSION} {self.input_hash(path_input)} " + " ".join(
+            f"{name}={value}" for name, value in sorted(params.items())
+        )
+        return hashlib.sha256(description.encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.folder, key)
+
+    def load(self, key: str) -> Optional[Dict[str, np.ndarray]]:
+        """:return: The arrays of the entry (memory-mapped), None if it's not in the cache"""
+        path = self._path(key)
+        if not os.path.isdir(path):
+            return None
+        # Mark the entry as recently used
+        os.utime(path)
+        arrays = {
+            os.path.splitext(name)[0]: np.load(os.path.join(path, name), mmap_mode='r')
+            for name in os.listdir(path)
+        }
+        logging.info(f"Loaded {sorted(arrays)} from cache {path}")
+        return arrays
+
+    def save(self, key: str, arrays: Dict[str, np.ndarray]) -> None:
+        # Written to a temporary folder then renamed, so an entry is either complete or missing
+        path = self._path(key)
+        path_tmp = f"{path}.tmp{os.getpid()}"
+        os.makedirs(path_tmp, exist_ok=True)
+        for name, array in arrays.items():
+            np.save(os.path.join(path_tmp, name + ".npy"), array)
+        if os.path.isdir(path):
+            shutil.rmtree(path_tmp)
+        else:
+            os.rename(path_tmp, path)
+            logging.info(f"Saved {sorted(arrays)} to cache {path}")
+        self.evict()
+
+    def entries(self):
+        """:return: (last use, size in bytes, path) of every complete entry, not the other files of the folder"""
+        entries = []
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            match = ENTRY_NAME.fullmatch(name)
+            # A temporary entry may still be being written
+            if match and match.group(1) is None and os.path.isdir(path):
+                size = sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+        return entries
+
+    def evict(self) -> None:
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        while entries and total > self.max_bytes:
+            _, size, path = entries.pop(0)
+            logging.info(f"Evicting {path} from cache ({size} bytes)")
+            shutil.rmtree(path)
+            total -= size
+
+    def clear(self) -> None:
+        """Remove the entries, and the temporary folders left by interrupted saves"""
+        for name in os.listdir(self.folder):
+            path = os.path.join(self.folder, name)
+            if ENTRY_NAME.fullmatch(name) and os.path.isdir(path):
+                shutil.rmtree(path)
+
+
+def graph_arrays(graph: Graph) -> Dict[str, np.ndarray]:
+    # Fixed-width strings so the ids can be memory-mapped too
+    return {"nodes": graph.nodes.astype(str), "indptr": graph.indptr, "indices": graph.indices,
+            "is_like": graph.is_like}
+
+
+def graph_from_arrays(arrays: Dict[str, np.ndarray]) -> Graph:
+    return Graph(*[arrays[name] for name in GRAPH_ARRAYS])
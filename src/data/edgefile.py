@@ -0,0 +1,49 @@
+import functools
+import os
+from typing import Optional
+
+from src.config import logging, RelationsData
+from src.data.base import DataLoader
+from src.data.ingest import edge_columns, edge_format, open_npy_edges, read_columnar_edges, read_npy_edges, \
+    CHUNK_ROWS, NPY, CSV
+
+
+class EdgeFileDataLoader(DataLoader):
+    """
+    Edges of a parquet or feather file (two id columns) or of a .npy (number of edges, 2) array of integer ids.
+    The ids are read with their own type instead of being parsed from text. csv files use RelationsDataLoader
+    """
+
+    def __init__(
+            self,
+            path_input: str,
+            col_user_id: Optional[str] = None,
+            col_like_id: Optional[str] = None,
+            min_like: int = 1,
+            bipartite: Optional[bool] = None,
+            chunksize: int = CHUNK_ROWS
+    ):
+        """
+        :param col_user_id, col_like_id: Columns of the ids (parquet and feather), the user and like columns
+        of RelationsData if the file has them, its first two columns otherwise
+        """
+        if not os.path.exists(path_input):
+            raise ValueError(f"path_input provided doesn't exist = {path_input}")
+        file_format = edge_format(path_input)
+        if file_format == CSV:
+            raise ValueError(f"{path_input} is a csv file, read it with RelationsDataLoader")
+
+        if file_format == NPY:
+            open_npy_edges(path_input)
+            user_id, like_id = RelationsData.USER_ID, RelationsData.LIKE_ID
+            edges = functools.partial(read_npy_edges, path_input, chunksize)
+        else:
+            columns = edge_columns(path_input)
+            default_columns = [RelationsData.USER_ID, RelationsData.LIKE_ID]
+            if not set(default_columns) <= set(columns):
+                default_columns = columns[:2]
+            user_id = col_user_id or default_columns[0]
+            like_id = col_like_id or default_columns[1]
+            logging.info(f"Reading the users from column {user_id} and the likes from column {like_id}")
+            edges = functools.partial(read_columnar_edges, path_input, user_id, like_id, chunksize)
+        super().__init__(None, user_id, like_id, min_like, bipartite, path_input, edges)
@@ -0,0 +1,129 @@
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, cast
+
+
+def buffer_view(array: np.ndarray) -> memoryview:
+    """memoryview of an array, much faster to index one element at a time (numpy's stubs don't type it as a buffer)"""
+    return memoryview(cast(Any, array))
+
+
+class Graph:
+    """
+    Undirected graph stored in CSR layout, with a vocabulary mapping
+    the original (string) node ids to compact int32 codes.
+
+    The neighbors of node ``i`` are ``indices[indptr[i]:indptr[i + 1]]``,
+    sorted in increasing order and without duplicates.
+    """
+
+    def __init__(
+            self,
+            nodes: np.ndarray,
+            indptr: np.ndarray,
+            indices: np.ndarray,
+            is_like: np.ndarray
+    ):
+        """
+        :param nodes: Original ids of the nodes, ``nodes[code] = id``
+        :param indptr: Offsets of each node's neighbors in ``indices`` (int64)
+        :param indices: Concatenated neighbors of all nodes (int32)
+        :param is_like: True for nodes that appear in the like/item column
+        """
+        self.nodes = nodes
+        self.indptr = indptr
+        self.indices = indices
+        self.is_like = is_like
+        self._index: Optional[Dict[str, int]] = None
+        self._edge_keys: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_edges(cls, users: np.ndarray, likes: np.ndarray, vocab: np.ndarray) -> "Graph":
+        """
+        Build the graph from two columns of codes into ``vocab``.
+        Codes that don't appear in any edge are dropped and the remaining ones are renumbered.
+        """
+        used, inverse = np.unique(np.concatenate([users, likes]), return_inverse=True)
+        inverse = inverse.astype(np.int32)
+        users, likes = inverse[:len(users)], inverse[len(users):]
+        is_like = np.zeros(len(used), dtype=bool)
+        is_like[likes] = True
+        # Both directions of every edge
+        return cls._from_pairs(vocab[used], np.concatenate([users, likes]), np.concatenate([likes, users]), is_like)
+
+    @classmethod
+    def _from_pairs(cls, nodes: np.ndarray, src: np.ndarray, dst: np.ndarray, is_like: np.ndarray) -> "Graph":
+        """Graph of the directed pairs (src, dst), deduplicated and sorted by (source, target)"""
+        num_nodes = len(nodes)
+        keys = np.unique(src.astype(np.int64) * num_nodes + dst)
+        src, dst = keys // num_nodes, keys % num_nodes
+
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=num_nodes), out=indptr[1:])
+        return cls(nodes, indptr, dst.astype(np.int32), is_like)
+
+    def with_edges(self, users: Sequence[str], likes: Sequence[str]) -> Tuple["Graph", np.ndarray]:
+        """
+        Graph with more (user, like) edges. Existing nodes keep their code, new nodes are appended.
+        :return: The new graph and the codes of the nodes of the new edges
+        """
+        new_ids = [node for node in dict.fromkeys(list(users) + list(likes)) if node not in self.index]
+        nodes = np.concatenate([self.nodes.astype(object), np.array(new_ids, dtype=object)])
+        new_index = {node: self.num_nodes + i for i, node in enumerate(new_ids)}
+        codes = np.array([self.index.get(node, new_index.get(node)) for node in list(users) + list(likes)],
+                         dtype=np.int32)
+        users_codes, likes_codes = codes[:len(users)], codes[len(users):]
+
+        is_like = np.concatenate([self.is_like, np.zeros(len(new_ids), dtype=bool)])
+        is_like[likes_codes] = True
+        sources = np.repeat(np.arange(self.num_nodes, dtype=np.int32), self.degrees())
+        graph = self._from_pairs(
+            nodes,
+            np.concatenate([sources, users_codes, likes_codes]),
+            np.concatenate([self.indices, likes_codes, users_codes]),
+            is_like
+        )
+        return graph, np.unique(codes)
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.indptr) - 1
+
+    @property
+    def num_edges(self) -> int:
+        """Number of directed edges (each undirected edge is counted twice)"""
+        return len(self.indices)
+
+    def degrees(self) -> np.ndarray:
+        return np.diff(self.indptr)
+
+    def neighbors(self, node: int) -> np.ndarray:
+        return self.indices[self.indptr[node]:self.indptr[node + 1]]
+
+    def edge_keys(self) -> np.ndarray:
+        """Sorted ``source * num_nodes + target`` of all directed edges, built on first use"""
+        if self._edge_keys is None:
+            sources = np.repeat(np.arange(self.num_nodes, dtype=np.int64), self.degrees())
+            self._edge_keys = sources * self.num_nodes + self.indices
+        return self._edge_keys
+
+    def has_edges(self, sources: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        edge_keys = self.edge_keys()
+        keys = sources.astype(np.int64) * self.num_nodes + targets
+        positions = np.minimum(np.searchsorted(edge_keys, keys), len(edge_keys) - 1)
+        return edge_keys[positions] == keys
+
+    @property
+    def index(self) -> Dict[str, int]:
+        """Mapping from original node id to code, built on first use"""
+        if self._index is None:
+            self._index = {node: code for code, node in enumerate(self.nodes.tolist())}
+        return self._index
+
+    def encode(self, nodes: Iterable[str]) -> np.ndarray:
+        return np.array([self.index[node] for node in nodes], dtype=np.int32)
+
+    def decode(self, codes) -> List[str]:
+        return self.nodes[codes].tolist()
+
+    def like_nodes(self) -> List[str]:
+        return self.nodes[self.is_like].tolist()
@@ -0,0 +1,180 @@
+import os
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from src.config import logging
+
+# Rows of an edge file read at once
+CHUNK_ROWS = 1000000
+
+# Formats of the edge files: csv text, parquet and feather columns (with pyarrow),
+# or a .npy (number of edges, 2) array of integer (user, like) ids
+CSV = "csv"
+PARQUET = "parquet"
+FEATHER = "feather"
+NPY = "npy"
+EDGE_FORMATS = [CSV, PARQUET, FEATHER, NPY]
+EXTENSIONS = {"csv": CSV, "parquet": PARQUET, "pq": PARQUET, "feather": FEATHER, "arrow": FEATHER, "npy": NPY}
+
+
+class EdgeList(NamedTuple):
+    """Edges as int32 codes into a vocabulary of string ids"""
+    users: np.ndarray
+    likes: np.ndarray
+    vocab: np.ndarray
+    # Number of rows of each code in the like column, for min_like
+    like_degrees: np.ndarray
+
+
+class Interner:
+    """
+    Maps ids to int32 codes in order of first appearance, one batch at a time.
+    Only the unique ids of a batch are converted to strings and looked up.
+    """
+
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+
+    def intern(self, ids: pd.Series) -> np.ndarray:
+        codes, uniques = pd.factorize(ids)
+        # Different raw values can have the same string representation (e.g. 1 and "1")
+        str_codes, str_uniques = pd.factorize(np.asarray(uniques).astype(str))
+        index = self.index
+        positions = np.fromiter((index.setdefault(node, len(index)) for node in str_uniques.tolist()),
+                                dtype=np.int32, count=len(str_uniques))
+        return positions[str_codes][codes]
+
+    def vocab(self) -> np.ndarray:
+        return np.array(list(self.index), dtype=object)
+
+
+def drop_missing(users: pd.Series, likes: pd.Series):
+    missing = users.isna().values | likes.isna().values
+    if missing.any():
+        logging.warning(f"Dropping {missing.sum()} rows with missing ids")
+        users, likes = users[~missing], likes[~missing]
+    return users, likes
+
+
+def _intern_chunks(chunks: Iterable[Tuple[pd.Series, pd.Series]], source: str) -> EdgeList:
+    """Intern (users, likes) chunks, only the codes of each chunk are kept"""
+    interner = Interner()
+    users: List[np.ndarray] = []
+    likes: List[np.ndarray] = []
+    like_degrees = np.zeros(0, dtype=np.int64)
+
+    for chunk_users, chunk_likes in chunks:
+        chunk_users, chunk_likes = drop_missing(chunk_users, chunk_likes)
+        codes = interner.intern(pd.concat([chunk_users, chunk_likes], ignore_index=True))
+        users.append(codes[:len(chunk_users)])
+        likes.append(codes[len(chunk_users):])
+
+        counts = np.bincount(likes[-1], minlength=len(interner.index))
+        counts[:len(like_degrees)] += like_degrees
+        like_degrees = counts
+
+    users_codes = np.concatenate(users) if users else np.zeros(0, dtype=np.int32)
+    likes_codes = np.concatenate(likes) if likes else np.zeros(0, dtype=np.int32)
+    vocab = interner.vocab()
+    logging.info(f"Read {len(users_codes)} edges between {len(vocab)} ids from {source}")
+    return EdgeList(users_codes, likes_codes, vocab, np.pad(like_degrees, (0, len(vocab) - len(like_degrees))))
+
+
+def read_edges(path_csv: str, user_col: Any, like_col: Any, chunksize: int = CHUNK_ROWS,
+               dtype: Optional[Any] = None, **read_csv_kwargs) -> EdgeList:
+    """
+    Read the two id columns of a csv file in chunks: each chunk is interned and only its codes are kept,
+    so the memory is 8 bytes per edge plus the vocabulary instead of the whole dataframe of strings.
+    :param dtype: dtype of both id columns (or dict column -> dtype), ids are read as strings if None
+    which keeps them the same across chunks (a chunk with a missing value would be read as floats)
+    :param read_csv_kwargs: Other arguments of pd.read_csv, e.g. header and names
+    """
+    if dtype is None:
+        dtype = str
+    dtypes = dtype if isinstance(dtype, dict) else {user_col: dtype, like_col: dtype}
+    reader = pd.read_csv(path_csv, usecols=[user_col, like_col], dtype=dtypes, chunksize=chunksize,
+                         **read_csv_kwargs)
+    return _intern_chunks(((chunk[user_col], chunk[like_col]) for chunk in reader), path_csv)
+
+
+def edge_format(path: str) -> str:
+    """:return: Format of an edge file, from its extension"""
+    extension = os.path.splitext(path)[1].lstrip(".").lower()
+    return EXTENSIONS.get(extension, CSV)
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow.compute
+        import pyarrow.feather
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Reading parquet and feather edge files needs pyarrow: pip install pyarrow")
+    return pyarrow
+
+
+def pyarrow_available() -> bool:
+    try:
+        _import_pyarrow()
+    except ImportError:
+        return False
+    return True
+
+
+def edge_columns(path: str) -> List[str]:
+    """:return: Names of the columns of a parquet or feather file, from its schema only"""
+    pyarrow = _import_pyarrow()
+    if edge_format(path) == PARQUET:
+        return pyarrow.parquet.ParquetFile(path).schema_arrow.names
+    # Feather (version 2) is the Arrow IPC file format
+    return pyarrow.ipc.open_file(path).schema.names
+
+
+def read_columnar_edges(path: str, user_col: str, like_col: str, chunksize: int = CHUNK_ROWS) -> EdgeList:
+    """
+    Read the two id columns of a parquet or feather file by batches of rows. Only these columns are read,
+    and the ids keep their type (e.g. int64): only the unique ids are converted to strings.
+    """
+    missing = {user_col, like_col} - set(edge_columns(path))
+    if missing:
+        raise ValueError(f"Columns {sorted(missing)} are not in {path}")
+    pyarrow = _import_pyarrow()
+    if edge_format(path) == PARQUET:
+        batches = pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunksize, columns=[user_col, like_col])
+    else:
+        # Memory-mapped, and sliced in chunks of rows instead of the (small) record batches of the file
+        table = pyarrow.feather.read_table(path, columns=[user_col, like_col], memory_map=True)
+        batches = (table.slice(first, chunksize) for first in range(0, table.num_rows, chunksize))
+    return _intern_chunks((_batch_ids(pyarrow, batch, user_col, like_col) for batch in batches), path)
+
+
+def _batch_ids(pyarrow, batch, user_col: str, like_col: str) -> Tuple[pd.Series, pd.Series]:
+    """
+    Ids of a batch of rows, without its rows with a missing id. They are dropped by Arrow: with a null,
+    pandas would convert the whole batch of int ids to floats (and "1" to "1.0" in the vocabulary)
+    """
+    rows = batch.num_rows
+    batch = pyarrow.compute.drop_null(batch)
+    if batch.num_rows < rows:
+        logging.warning(f"Dropping {rows - batch.num_rows} rows with missing ids")
+    return batch.column(user_col).to_pandas(), batch.column(like_col).to_pandas()
+
+
+def open_npy_edges(path: str) -> np.ndarray:
+    """:return: The (number of edges, 2) array of (user, like) ids, memory-mapped (only its header is read)"""
+    pairs = np.load(path, mmap_mode='r')
+    if pairs.ndim != 2 or pairs.shape[1] != 2:
+        raise ValueError(f"Expected a (number of edges, 2) array of ids in {path}, got shape {pairs.shape}")
+    return pairs
+
+
+def read_npy_edges(path: str, chunksize: int = CHUNK_ROWS) -> EdgeList:
+    """
+    Read a (number of edges, 2) array of (user, like) integer ids, memory-mapped and interned by chunks
+    """
+    pairs = open_npy_edges(path)
+    chunks = ((pd.Series(pairs[first:first + chunksize, 0]), pd.Series(pairs[first:first + chunksize, 1]))
+              for first in range(0, len(pairs), chunksize))
+    return _intern_chunks(chunks, path)
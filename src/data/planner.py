@@ -0,0 +1,97 @@
+import numpy as np
+from typing import List, NamedTuple, Optional
+
+from src.config import logging
+from src.data.base import ALIAS, BIPARTITE, FULL, LAZY
+from src.data.graph import Graph
+
+# Bytes of the transitions, measured with tracemalloc on generated graphs:
+# a WeightedDict (red-black tree) entry of full
+FULL_ENTRY_BYTES = 330
+# prob and alias entries of the flat alias tables, and the AliasSampler of each table
+ALIAS_ENTRY_BYTES = 8
+ALIAS_TABLE_BYTES = 650
+# capped alias tables are built one by one, each with its own small arrays
+CAPPED_ENTRY_BYTES = 16
+CAPPED_TABLE_BYTES = 1600
+# dict of the row of each previous node
+ROW_BYTES = 270
+# string id of a node in the graph
+NODE_ID_BYTES = 64
+
+# Cap used to estimate the degree-capped strategies when no max_degree is given
+PLAN_MAX_DEGREE = 100
+
+
+class Estimate(NamedTuple):
+    """Memory needed to walk on a graph with a strategy (with capped tables if max_degree is not None)"""
+    strategy: str
+    max_degree: Optional[int]
+    entries: int
+    bytes: int
+
+    @property
+    def name(self) -> str:
+        return self.strategy if self.max_degree is None else f"{self.strategy} (max_degree={self.max_degree})"
+
+
+def graph_bytes(graph: Graph) -> int:
+    return graph.indptr.nbytes + graph.indices.nbytes + graph.is_like.nbytes + NODE_ID_BYTES * graph.num_nodes
+
+
+def table_entries(graph: Graph, max_degree: Optional[int] = None) -> int:
+    """Σ deg², the entries of the tables of all the (previous, start) pairs, at most max_degree + 1 per table"""
+    degrees = graph.degrees().astype(np.int64)
+    sizes = degrees if max_degree is None else np.minimum(degrees, max_degree + 1)
+    return int((degrees * sizes).sum())
+
+
+def estimate_memory(graph: Graph, bipartite: bool = False, max_degree: Optional[int] = None) -> List[Estimate]:
+    """
+    Estimate the memory of each strategy from the degree distribution only, before any table is built.
+    Each estimate includes the graph.
+    :param bipartite: The bipartite strategy is only valid for bipartite graphs
+    :param max_degree: Cap of the degree-capped estimates (PLAN_MAX_DEGREE if None)
+    :return: The estimates from the fastest strategy to the slowest: O(1) steps without table (bipartite),
+    O(1) steps on exact tables (alias), O(log deg) steps (full), the same on capped tables, rejection sampling (lazy)
+    """
+    base = graph_bytes(graph)
+    cap = max_degree or PLAN_MAX_DEGREE
+    tables, rows = graph.num_edges, graph.num_nodes * ROW_BYTES
+    exact, capped = table_entries(graph), table_entries(graph, cap)
+
+    estimates = [Estimate(BIPARTITE, None, 0, base)] if bipartite else []
+    estimates += [
+        Estimate(ALIAS, None, exact, base + rows + ALIAS_ENTRY_BYTES * exact + ALIAS_TABLE_BYTES * tables),
+        Estimate(FULL, None, exact, base + rows + FULL_ENTRY_BYTES * exact),
+        Estimate(ALIAS, cap, capped, base + rows + CAPPED_ENTRY_BYTES * capped + CAPPED_TABLE_BYTES * tables),
+        Estimate(FULL, cap, capped, base + rows + FULL_ENTRY_BYTES * capped),
+        Estimate(LAZY, None, 0, base),
+    ]
+    return estimates
+
+
+def plan_strategy(estimates: List[Estimate], budget: int, capped: bool = False) -> Estimate:
+    """
+    :param budget: Bytes available for the graph and the transitions
+    :param capped: Allow the degree-capped strategies, which approximate the transitions of the hubs
+    :return: The fastest strategy that fits in the budget, lazy if none does
+    """
+    for estimate in estimates:
+        if (capped or estimate.max_degree is None) and estimate.bytes <= budget:
+            return estimate
+    logging.warning(f"Even the graph alone ({estimates[-1].bytes / 1024 ** 3:.2f} GB) doesn't fit "
+                    f"in the memory budget of {budget / 1024 ** 3:.2f} GB")
+    return estimates[-1]
+
+
+def format_plan(graph: Graph, estimates: List[Estimate], budget: Optional[int] = None) -> str:
+    lines = [f"Memory plan: {graph.num_nodes} nodes, {graph.num_edges} directed edges, "
+             f"max degree {int(graph.degrees().max(initial=0))}",
+             f"{'strategy':<30}{'table entries':>16}{'memory (GB)':>14}" + ("  fits" if budget is not None else "")]
+    for estimate in estimates:
+        line = f"{estimate.name:<30}{estimate.entries:>16}{estimate.bytes / 1024 ** 3:>14.3f}"
+        if budget is not None:
+            line += "  yes" if estimate.bytes <= budget else "  no"
+        lines.append(line)
+    return "\n".join(lines)
@@ -1,8 +1,9 @@
 import pandas as pd
 import os
-from typing import Optional
+from typing import Any, Optional
 from src.config import logging
 from src.data.base import DataLoader
+from src.data.ingest import read_edges, CHUNK_ROWS
 
 
 class RelationsDataLoader(DataLoader):
@@ -11,22 +12,31 @@ class RelationsDataLoader(DataLoader):
             path_csv: str,
             col_user_id: Optional[str] = None,
             col_like_id: Optional[str] = None,
-            min_like: int = 1
+            min_like: int = 1,
+            bipartite: Optional[bool] = None,
+            chunksize: int = CHUNK_ROWS,
+            dtype: Optional[Any] = None
     ):
+        """
+        :param chunksize: Number of rows read at once, only the codes of the ids are kept between chunks
+        :param dtype: dtype of the id columns, strings by default
+        """
         if not os.path.exists(path_csv):
             raise ValueError(f"path_csv provided doesn't exist = {path_csv}")
 
-        df = pd.read_csv(path_csv)
+        columns = pd.read_csv(path_csv, nrows=0).columns.tolist()
 
         if col_user_id is None:
-            user_id = df.columns.tolist()[1]
+            user_id = columns[1]
             logging.info(f"col_user_id is not provided so we use 2nd column of .csv file = {user_id} as users")
         else:
             user_id = col_user_id
         if col_like_id is None:
-            like_id = df.columns.tolist()[2]
+            like_id = columns[2]
             logging.info(f"col_like_id is not provided so we use 3rd column of .csv file = {like_id} as likes")
         else:
             like_id = col_like_id
 
-        super().__init__(df, user_id, like_id, min_like)
+        self.dtype = dtype
+        super().__init__(None, user_id, like_id, min_like, bipartite, path_csv,
+                         lambda: read_edges(path_csv, user_id, like_id, chunksize, dtype))
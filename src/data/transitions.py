@@ -0,0 +1,129 @@
+import random
+from bisect import bisect_left
+from collections.abc import Mapping
+from typing import Iterator, List
+
+from src.data.graph import buffer_view, Graph
+
+
+class LazyTransitions(Mapping):
+    """
+    Second-order transitions of node2vec drawn on the fly by rejection sampling (as in KnightKing):
+    only the first-order adjacency of the graph is stored, no table is precomputed.
+
+    It exposes the access pattern of Dict_Prob, ``transitions[previous][start].sample()``,
+    so it can be used in place of the precomputed dictionnary.
+    """
+
+    def __init__(self, graph: Graph, p: float, q: float):
+        self.graph = graph
+        self.weight_back = 1 / p
+        self.weight_out = 1 / q
+        # Upper bound of the unnormalized weights (1 is the weight of a shared neighbor)
+        self.bound = max(self.weight_back, 1., self.weight_out)
+        # memoryviews are much faster to index one element at a time than numpy arrays
+        self._indptr = buffer_view(graph.indptr)
+        self._indices = buffer_view(graph.indices)
+
+    def is_neighbor(self, node: int, other: int) -> bool:
+        lo, hi = self._indptr[node], self._indptr[node + 1]
+        i = bisect_left(self._indices, other, lo, hi)
+        return i < hi and self._indices[i] == other
+
+    def weight(self, previous: int, start: int, neighbor: int) -> float:
+        """Unnormalized weight of going to neighbor when we are on start coming from previous"""
+        if neighbor == previous:
+            return self.weight_back
+        if self.is_neighbor(previous, neighbor):
+            return 1.
+        return self.weight_out
+
+    def sample(self, previous: int, start: int) -> int:
+        """
+        Propose a uniform neighbor of start and accept it with probability weight / bound,
+        which gives exactly the biased distribution of node2vec.
+        """
+        lo = self._indptr[start]
+        degree = self._indptr[start + 1] - lo
+        while True:
+            neighbor = self._indices[lo + int(random.random() * degree)]
+            if random.random() * self.bound < self.weight(previous, start, neighbor):
+                return neighbor
+
+    def __getitem__(self, previous: int) -> "_LazyRow":
+        if not 0 <= previous < self.graph.num_nodes:
+            raise KeyError(previous)
+        return _LazyRow(self, previous)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.graph.num_nodes))
+
+    def __len__(self) -> int:
+        return self.graph.num_nodes
+
+
+class _LazyRow(Mapping):
+    """Possible starts when coming from ``previous``, i.e. its neighbors"""
+
+    def __init__(self, transitions: LazyTransitions, previous: int):
+        self.transitions = transitions
+        self.previous = previous
+
+    def __getitem__(self, start: int) -> "_LazyEdge":
+        if not self.transitions.is_neighbor(self.previous, start):
+            raise KeyError(start)
+        return _LazyEdge(self.transitions, self.previous, start)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.transitions.graph.neighbors(self.previous).tolist())
+
+    def __len__(self) -> int:
+        return len(self.transitions.graph.neighbors(self.previous))
+
+
+class _LazyEdge:
+    """Distribution of the next node for the (previous, start) pair, same interface as WeightedDict"""
+    __slots__ = ("transitions", "previous", "start")
+
+    def __init__(self, transitions: LazyTransitions, previous: int, start: int):
+        self.transitions = transitions
+        self.previous = previous
+        self.start = start
+
+    def sample(self) -> int:
+        return self.transitions.sample(self.previous, self.start)
+
+    def keys(self) -> List[int]:
+        return self.transitions.graph.neighbors(self.start).tolist()
+
+    def __getitem__(self, neighbor: int) -> float:
+        return self.transitions.weight(self.previous, self.start, neighbor)
+
+    def __len__(self) -> int:
+        return len(self.transitions.graph.neighbors(self.start))
+
+    def __contains__(self, neighbor: int) -> bool:
+        return self.transitions.is_neighbor(self.start, neighbor)
+
+
+class BipartiteTransitions(LazyTransitions):
+    """
+    Transitions for bipartite graphs (e.g. users -> likes): the neighbors of start can never be neighbors
+    of previous, so the next node is either previous (weight 1/p) or any other neighbor (weight 1/q).
+    Each step is O(1) and nothing is precomputed.
+    """
+
+    def weight(self, previous: int, start: int, neighbor: int) -> float:
+        return self.weight_back if neighbor == previous else self.weight_out
+
+    def sample(self, previous: int, start: int) -> int:
+        lo = self._indptr[start]
+        degree = self._indptr[start + 1] - lo
+        weight_others = (degree - 1) * self.weight_out
+        if random.random() * (self.weight_back + weight_others) < self.weight_back:
+            return previous
+        # Uniform among the degree - 1 other neighbors: if we draw previous, take the last neighbor instead
+        neighbor = self._indices[lo + int(random.random() * (degree - 1))]
+        if neighbor == previous:
+            neighbor = self._indices[lo + degree - 1]
+        return neighbor
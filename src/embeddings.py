@@ -0,0 +1,67 @@
+import os
+import pickle
+import numpy as np
+from typing import Optional, Sequence, Tuple
+
+from src.config import logging
+from src.corpus import NPY
+
+# Formats of the embeddings: a float32 matrix plus an ids file (loaded with mmap), or the legacy pickled dict
+PKL = "pkl"
+EMBEDDING_FORMATS = [NPY, PKL]
+
+
+def embedding_format(path: str) -> str:
+    return PKL if path.endswith("." + PKL) else NPY
+
+
+def ids_path(path_embeddings: str) -> str:
+    return os.path.splitext(path_embeddings)[0] + ".ids.txt"
+
+
+def is_like_path(path_embeddings: str) -> str:
+    return os.path.splitext(path_embeddings)[0] + ".is_like.npy"
+
+
+def save_embeddings(path_save: str, ids: Sequence[str], vectors: np.ndarray,
+                    is_like: Optional[np.ndarray] = None) -> None:
+    """
+    :param ids: Original id of each row of vectors
+    :param path_save: .npy for a matrix (row i is the embedding of line i of the ids file), .pkl for a dict
+    :param is_like: Mask of the like nodes, saved next to the matrix when the users are exported too
+    """
+    logging.info(f"Writing {len(vectors)} embeddings to file {path_save}")
+    if embedding_format(path_save) == PKL:
+        with open(path_save, "wb") as f_out:
+            pickle.dump({str(node): vector for node, vector in zip(ids, vectors)}, f_out)
+        return
+
+    np.save(path_save, np.ascontiguousarray(vectors, dtype=np.float32))
+    with open(ids_path(path_save), 'w', encoding='utf-8') as f_ids:
+        f_ids.write("".join(str(node) + '\n' for node in ids))
+    if is_like is not None:
+        np.save(is_like_path(path_save), is_like)
+    elif os.path.exists(is_like_path(path_save)):
+        os.remove(is_like_path(path_save))
+
+
+def load_embeddings(path_embeddings: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    :return: The ids (object array) and the matrix of embeddings, memory-mapped (read-only) for .npy files
+    """
+    if embedding_format(path_embeddings) == PKL:
+        with open(path_embeddings, 'rb') as f:
+            embeddings = pickle.load(f)
+        ids = np.array(list(embeddings.keys()), dtype=object)
+        return ids, np.array(list(embeddings.values()), dtype=np.float32).reshape(len(ids), -1)
+
+    with open(ids_path(path_embeddings), encoding='utf-8') as f_ids:
+        ids = np.array([line.rstrip('\n') for line in f_ids], dtype=object)
+    return ids, np.load(path_embeddings, mmap_mode='r')
+
+
+def load_is_like(path_embeddings: str) -> Optional[np.ndarray]:
+    """:return: Mask of the like nodes, None if only the likes were exported"""
+    if embedding_format(path_embeddings) == PKL or not os.path.exists(is_like_path(path_embeddings)):
+        return None
+    return np.load(is_like_path(path_embeddings))
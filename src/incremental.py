@@ -0,0 +1,184 @@
+import os
+import numpy as np
+from typing import Any, Callable, Dict, Iterator, Mapping, Optional, Sequence, Tuple
+
+from src.config import logging
+from src.corpus import corpus_format, create_walk_corpus, file_version, read_vocab, remove_counts, vocab_path, \
+    CHUNK_SIZE, NPY
+from src.data.alias import alias_row
+from src.data.base import DataLoader, Transitions, ALIAS, BIPARTITE, LAZY
+from src.data.cache import graph_arrays, graph_from_arrays
+from src.data.graph import Graph
+from src.data.transitions import BipartiteTransitions, LazyTransitions
+from src.walks import batch_random_walks, random_walk, seed_shard
+
+
+def add_edges(graph: Graph, users: Sequence[str], likes: Sequence[str]) -> Tuple[Graph, np.ndarray]:
+    """
+    Add a delta of (user, like) edges to the graph. Codes of the existing nodes don't change.
+    :return: The new graph and a mask of the affected nodes: the nodes of the new edges and their neighbors.
+    The transitions of the walks coming from any other node are unchanged.
+    """
+    graph, touched = graph.with_edges(users, likes)
+    affected = np.zeros(graph.num_nodes, dtype=bool)
+    affected[touched] = True
+    # Neighbors of the touched nodes, from the new adjacency
+    affected[graph.indices[np.repeat(affected, graph.degrees())]] = True
+    logging.info(f"Delta of {len(users)} edges: {len(touched)} touched nodes, {affected.sum()} affected nodes")
+    return graph, affected
+
+
+def update_transitions(transitions: Transitions, graph: Graph, affected: np.ndarray, strategy: str,
+                       p: float, q: float, hubs: Optional[Dict[int, np.ndarray]] = None) -> Transitions:
+    """
+    Transitions on the updated graph, only the rows of the affected nodes are recomputed
+    :param transitions: Transitions of the graph before the delta, with the same codes
+    :param strategy: Strategy that built transitions (not auto)
+    :param hubs: Sampled neighbors of the capped nodes of the updated graph (see hub_neighbors), if transitions
+    were built with a max_degree
+    """
+    if strategy == LAZY:
+        return LazyTransitions(graph, p, q)
+    if strategy == BIPARTITE:
+        return BipartiteTransitions(graph, p, q)
+
+    build_row: Callable[[Graph, int, float, float, Optional[Dict[int, np.ndarray]]], Mapping[int, Any]]
+    build_row = alias_row if strategy == ALIAS else DataLoader._neighbors_row
+    # Unaffected rows are shared with the old transitions
+    updated: Dict[int, Mapping[int, Any]] = dict(transitions)
+    for previous in np.flatnonzero(affected).tolist():
+        updated[previous] = build_row(graph, previous, p, q, hubs)
+    return updated
+
+
+class RowTransitions(Mapping):
+    """
+    Transitions of full or alias whose rows are built the first time a walk comes from their node:
+    the few walks resampled by an update only reach a small part of the graph, the other rows are never built
+    """
+
+    def __init__(self, graph: Graph, strategy: str, p: float, q: float,
+                 hubs: Optional[Dict[int, np.ndarray]] = None):
+        """:param hubs: Sampled neighbors of the capped nodes (see hub_neighbors), None if the tables aren't capped"""
+        self.graph = graph
+        self.p = p
+        self.q = q
+        self.hubs = hubs
+        self._build_row = alias_row if strategy == ALIAS else DataLoader._neighbors_row
+        self._rows: Dict[int, Mapping[int, Any]] = {}
+
+    def __getitem__(self, previous: int) -> Mapping[int, Any]:
+        if previous not in self._rows:
+            if not 0 <= previous < self.graph.num_nodes:
+                raise KeyError(previous)
+            self._rows[previous] = self._build_row(self.graph, previous, self.p, self.q, self.hubs)
+        return self._rows[previous]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(self.graph.num_nodes))
+
+    def __len__(self) -> int:
+        return self.graph.num_nodes
+
+
+def walk_transitions(graph: Graph, strategy: str, p: float, q: float,
+                     hubs: Optional[Dict[int, np.ndarray]] = None) -> Transitions:
+    """Transitions of strategy (not auto) on the updated graph, without precomputing the tables of every node"""
+    if strategy == LAZY:
+        return LazyTransitions(graph, p, q)
+    if strategy == BIPARTITE:
+        return BipartiteTransitions(graph, p, q)
+    return RowTransitions(graph, strategy, p, q, hubs)
+
+
+def resample_walks(graph: Graph, starts: np.ndarray, walks_per_node: int, walk_length: int,
+                   transitions: Optional[Transitions] = None, p: float = 1., q: float = 1.,
+                   bipartite: bool = False, seed: Optional[int] = None) -> np.ndarray:
+    """
+    walks_per_node walks from each start node, with the transitions if given and the batch engine otherwise
+    :return: int32 matrix of codes, one walk per row
+    """
+    if transitions is None:
+        rng = np.random.default_rng(seed)
+        return np.concatenate([
+            batch_random_walks(graph, starts, p, q, walk_length, rng, bipartite) for _ in range(walks_per_node)
+        ]).reshape(-1, walk_length)
+
+    if seed is not None:
+        seed_shard(seed, 0)
+    walks = [random_walk(transitions, node, walk_length) for _ in range(walks_per_node) for node in starts.tolist()]
+    return np.array(walks, dtype=np.int32).reshape(-1, walk_length)
+
+
+def update_corpus(path_corpus: str, graph: Graph, affected: np.ndarray, walks: np.ndarray) -> None:
+    """
+    Replace the walks starting from an affected node by the new walks, in place.
+    The other walks are kept as they are, even if they cross an affected node further on
+    (the usual approximation of incremental node2vec, they are replaced by the next full run).
+    The node counts of the corpus are removed, the training counts the tokens of the updated corpus itself,
+    and the updated graph is saved next to it (see load_graph) for the next update.
+    :param walks: New walks (codes of the updated graph), appended at the end of the corpus
+    """
+    path_tmp = path_corpus + ".tmp"
+    if corpus_format(path_corpus) == NPY:
+        old = np.load(path_corpus, mmap_mode='r')
+        # The corpus may come from another build of the graph (an earlier delta, a refreshed edge file):
+        # its codes are mapped to the updated graph through its own vocabulary
+        old_codes = np.array([graph.index.get(node, -1) for node in read_vocab(path_corpus).tolist()], dtype=np.int64)
+        if (old_codes < 0).any():
+            raise ValueError(f"{(old_codes < 0).sum()} nodes of {path_corpus} are not in the updated graph, "
+                             f"sample the whole corpus again")
+        keep = np.flatnonzero(~affected[old_codes[old[:, 0]]])
+        path_tmp = os.path.splitext(path_corpus)[0] + ".tmp." + NPY
+        corpus = create_walk_corpus(path_tmp, graph.nodes.astype(object), len(keep) + len(walks), old.shape[1])
+        for first in range(0, len(keep), CHUNK_SIZE):
+            chunk = old_codes[old[keep[first:first + CHUNK_SIZE]]]
+            corpus[first:first + len(chunk)] = chunk
+        corpus[len(keep):] = walks
+        corpus.flush()
+        replaced = len(old) - len(keep)
+        del corpus, old
+    else:
+        affected_ids = set(graph.nodes[affected].tolist())
+        replaced = 0
+        with open(path_corpus, encoding='utf-8') as f_in, open(path_tmp, 'w', encoding='utf-8') as f_out:
+            for line in f_in:
+                if line.split(" ", 1)[0].rstrip('\n') in affected_ids:
+                    replaced += 1
+                    continue
+                f_out.write(line)
+            for walk in graph.nodes[walks]:
+                f_out.write(" ".join(walk) + '\n')
+    os.replace(path_tmp, path_corpus)
+    if corpus_format(path_corpus) == NPY:
+        # Last: the vocabulary of the updated graph only adds nodes after the codes of the old one
+        os.replace(vocab_path(path_tmp), vocab_path(path_corpus))
+    remove_counts(path_corpus)
+    save_graph(path_corpus, graph)
+    logging.info(f"Replaced {replaced} walks of {path_corpus} by {len(walks)} new walks")
+
+
+def graph_path(path_corpus: str) -> str:
+    return path_corpus + ".graph.npz"
+
+
+def save_graph(path_corpus: str, graph: Graph) -> None:
+    """
+    Save the graph a corpus was updated with, with the version of the corpus (see file_version):
+    the next update adds its edges to this graph, the edge file doesn't have the edges of the earlier updates
+    """
+    path_tmp = path_corpus + ".graph.tmp.npz"
+    np.savez(path_tmp, version=np.array(file_version(path_corpus)), **graph_arrays(graph))
+    os.replace(path_tmp, graph_path(path_corpus))
+
+
+def load_graph(path_corpus: str) -> Optional[Graph]:
+    """:return: The graph of the last update of the corpus, None if it wasn't updated since it was sampled"""
+    if not os.path.exists(graph_path(path_corpus)):
+        return None
+    with np.load(graph_path(path_corpus)) as arrays:
+        if arrays["version"].tolist() != file_version(path_corpus):
+            return None
+        graph = graph_from_arrays(dict(arrays))
+    logging.info(f"Updating the graph of the last update of {path_corpus}: {graph.num_nodes} nodes")
+    return graph
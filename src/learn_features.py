@@ -1,18 +1,25 @@
-import pickle
 import argparse
 import multiprocessing
-import random
 import gensim
 import os
-from typing import Dict, List
-import tqdm
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
 
+from src.checkpoint import sample_walks_resumable, TrainingCheckpointer, KEEP_CHECKPOINTS, UNIT_NODES
 from src.config import logging, RelationsData, BlogCatalogData
-from src.utils import MySentences
-from src.data.base import DataLoader
+from src.corpus import corpus_to_text, load_counts, load_sentences, CORPUS_FORMATS, TXT
+from src.embeddings import save_embeddings, EMBEDDING_FORMATS, NPY
+from src.metrics import metrics, PROFILERS
+from src.incremental import add_edges, load_graph, resample_walks, update_corpus, walk_transitions
+from src.walks import sample_walks, sample_walks_batch, WalkStream, PYTHON, BATCH, ENGINES
+from src.data.alias import hub_neighbors
+from src.data.base import DataLoader, AUTO, BIPARTITE, LAZY, STRATEGIES
+from src.data.cache import TransitionCache
+from src.data.planner import estimate_memory, format_plan, plan_strategy, table_entries
+from src.data.ingest import edge_format, CHUNK_ROWS, CSV, EDGE_FORMATS
+from src.data.edgefile import EdgeFileDataLoader
 from src.data.relations import RelationsDataLoader
 from src.data.blogcatalog import BlogCatalogDataLoader
-from src.data.weighted_dict import WeightedDict
 
 
 ID = "id"
@@ -20,101 +27,237 @@ TRAIN = "train"
 RESUME = "resume"
 ALL = "all"
 PREPROCESS = "preprocess"
+# Add a delta of edges to the graph, resample the walks it affects and resume training
+INCREMENTAL = "incremental"
 
+# How the corpus is given to gensim: a Python iterator over sentences,
+# or the path of a LineSentence file that each worker reads on its own (scales better with the number of cores)
+ITERATOR = "iterator"
+CORPUS_FILE = "corpus_file"
+INPUT_MODES = [ITERATOR, CORPUS_FILE]
 
-def random_walk(matrix_prob: Dict[str, Dict[str, WeightedDict]], previous_node: str, length: int):
-    try:
-        # Actually using the start node as the previous node and randomly sampling a start node
-        possible_starts = matrix_prob[previous_node].keys()
-        start_node = random.sample(possible_starts, 1)[0]
-
-        walk = [previous_node, start_node]
-        for _ in range(length - 2):
-            # draw a sample
-            walk.append(matrix_prob[walk[-2]][walk[-1]].sample())
-
-    except KeyError as err:
-        raise KeyError(err)
-
-    return walk
 
-
-def sample_walks(path_save: str, matrix_prob: Dict, all_nodes: List[str],
-                 walks_per_node: int = 10, walk_length: int = 80):
-    with open(path_save, 'w', encoding='utf-8') as f_txt:
-        for _ in tqdm.tqdm(range(walks_per_node), desc="Random walk"):
-            for node in all_nodes:
-                f_txt.write(" ".join(random_walk(matrix_prob, node, walk_length)) + '\n')
-
-
-def optimize(path_sentences: str, like_nodes: List[str], mode: str, path_save: str,
-             epochs: int = 10, context_size: int = 10, dim_features: int = 128, path_model: str = None):
+def optimize(path_sentences: Union[str, Iterable[List[str]]], like_nodes: List[str], mode: str,
+             path_save: Optional[str], epochs: int = 10, context_size: int = 10, dim_features: int = 128,
+             path_model: str = None,
+             input_mode: str = ITERATOR, update_vocab: bool = False, all_nodes: bool = False,
+             workers: Optional[int] = None, checkpointer: Optional[TrainingCheckpointer] = None):
     """
-    :param path_sentences: Input of .txt file to sentences (one sentence per line)
+    :param path_sentences: Corpus of sentences, .txt file (one sentence per line) or binary .npy corpus,
+    or directly a restartable iterable of sentences (e.g. WalkStream)
     :param epochs: number of epochs to run model
-    :param path_save: where to save the embeddings
+    :param path_save: where to save the embeddings, not saved if None
     :param like_nodes: List of all like/item ids
     :param context_size: Also called window size
     :param dim_features:
     :param mode: {'train' or 'resume'} resume to resume training
-    :param path_model: path model if we are resuming training
-    :return:
+    :param path_model: path model if we are resuming training, the trained model is saved there if given
+    :param input_mode: {'iterator' or 'corpus_file'} corpus_file needs a corpus on disk,
+    binary corpora are converted to text first
+    :param update_vocab: When resuming, add the new nodes of the corpus to the vocabulary first
+    :param all_nodes: Save the embeddings of the users too, not only of the likes
+    :param workers: Number of training threads, the number of cores if None
+    :param checkpointer: Saves checkpoints in the background while training. When resuming, an interrupted
+    training restarts from its newest checkpoint for the epochs it had left, otherwise the model of path_model
+    (the newest checkpoint if None) is trained for epochs more epochs
+    :return: The trained model
     """
-    cores = multiprocessing.cpu_count()
-
-    # save model each epoch
-    # epoch_logger = EpochSaver('word2vec')
+    cores = workers or multiprocessing.cpu_count()
+    callbacks = [checkpointer] if checkpointer is not None else []
 
     n_negative_samples = 10
     # minimum term frequency (to define the vocabulary)
     min_count = 2
 
-    # a memory-friendly iterator
-    sentences = MySentences(path_sentences)
-
-    if mode in [TRAIN, ALL]:
-        logging.info('Starting Training of Word2Vec Model')
-        model = gensim.models.Word2Vec(sentences, min_count=min_count, sg=1, size=dim_features,
-                                       iter=epochs, workers=cores, negative=n_negative_samples,
-                                       window=context_size)
-    elif mode == RESUME:
-        logging.info('Resuming Training of Word2Vec Model')
-        model = gensim.models.Word2Vec.load(path_model)
-        # Start at the learning rate that we previously stopped
-        model.train(sentences, total_examples=model.corpus_count, epochs=epochs,
-                    start_alpha=model.min_alpha_yet_reached)
+    corpus: Dict[str, Any]
+    if input_mode == CORPUS_FILE:
+        if not isinstance(path_sentences, str):
+            raise ValueError("corpus_file input mode needs a corpus on disk")
+        # gensim splits the file in one chunk per worker
+        corpus = {"corpus_file": corpus_to_text(path_sentences)}
+    elif input_mode == ITERATOR:
+        # a memory-friendly iterator
+        sentences = load_sentences(path_sentences) if isinstance(path_sentences, str) else path_sentences
+        corpus = {"sentences": sentences}
     else:
-        raise ValueError('Specify valid value for mode (%s)' % mode)
-
-    write_embeddings_to_file(model, like_nodes, path_save)
+        raise ValueError('Specify valid value for input_mode (%s)' % input_mode)
 
+    if mode not in [TRAIN, ALL, RESUME]:
+        raise ValueError('Specify valid value for mode (%s)' % mode)
 
-def write_embeddings_to_file(model: gensim.models.Word2Vec, like_nodes: List[str], path_save: str) -> None:
-    logging.info('Writting embeddings to file %s' % path_save)
-    embeddings = {}
-    for v in list(model.wv.vocab):
-        # we only keep likes' nodes embeddings
-        if v in like_nodes:
-            vec = model.wv.__getitem__(v)
-            embeddings[str(v)] = vec
-
-    with open(path_save, "wb") as f_out:
-        pickle.dump(embeddings, f_out)
+    with metrics.span("train", mode=mode, epochs=epochs):
+        counts = load_counts(path_sentences) if isinstance(path_sentences, str) else None
+        if mode in [TRAIN, ALL] and checkpointer is not None:
+            checkpointer.begin(epochs)
+        if mode in [TRAIN, ALL] and counts is not None:
+            logging.info('Starting Training of Word2Vec Model, vocabulary from the node counts of the walks')
+            model = gensim.models.Word2Vec(min_count=min_count, sg=1, size=dim_features, iter=epochs,
+                                           workers=cores, negative=n_negative_samples, window=context_size,
+                                           callbacks=callbacks)
+            # No pass over the corpus to count the tokens, the walks were counted while being sampled
+            model.build_vocab_from_freq(counts.counts, corpus_count=counts.walks)
+            model.corpus_total_words = counts.words
+            model.train(**corpus, total_examples=model.corpus_count, total_words=model.corpus_total_words,
+                        epochs=epochs, callbacks=callbacks)
+        elif mode in [TRAIN, ALL]:
+            logging.info('Starting Training of Word2Vec Model')
+            model = gensim.models.Word2Vec(**corpus, min_count=min_count, sg=1, size=dim_features,
+                                           iter=epochs, workers=cores, negative=n_negative_samples,
+                                           window=context_size, callbacks=callbacks)
+        else:
+            path_resume, epochs_left = path_model, epochs
+            if checkpointer is not None:
+                interrupted = checkpointer.interrupted()
+                latest = checkpointer.latest()
+                if interrupted is not None:
+                    # The epochs left finish the learning rate schedule of the interrupted run
+                    (epoch, path_resume), epochs_left = interrupted
+                    if path_model is not None:
+                        logging.warning(f"The training of {path_resume} was interrupted, it is resumed "
+                                        f"instead of {path_model}")
+                    checkpointer.begin(epochs_left, epoch)
+                else:
+                    if path_model is None and latest is not None:
+                        path_resume = latest[1]
+                    checkpointer.begin(epochs)
+            if path_resume is None:
+                folder = f" in {checkpointer.folder}" if checkpointer is not None else ""
+                raise ValueError(f"Nothing to resume: no checkpoint{folder} and no model")
+            logging.info(f'Resuming Training of Word2Vec Model from {path_resume}')
+            model = gensim.models.Word2Vec.load(path_resume)
+            if update_vocab:
+                model.build_vocab(**corpus, update=True)
+            # Start at the learning rate that we previously stopped
+            model.train(**corpus, total_examples=model.corpus_count, total_words=model.corpus_total_words,
+                        epochs=epochs_left, start_alpha=model.min_alpha_yet_reached, callbacks=callbacks)
+    metrics.gauge("vocabulary", len(model.wv.vocab))
+
+    with metrics.span("export"):
+        if path_model is not None:
+            model.save(path_model)
+        if path_save is not None:
+            write_embeddings_to_file(model, like_nodes, path_save, all_nodes)
+    return model
+
+
+def write_embeddings_to_file(model: gensim.models.Word2Vec, like_nodes: List[str], path_save: str,
+                             all_nodes: bool = False) -> None:
+    """
+    Embeddings of the like nodes, as a .npy matrix plus ids file or as a pickled dict (legacy) for .pkl
+    :param all_nodes: Keep the users too, with a mask of the like nodes (.npy only)
+    """
+    words = model.wv.index2word
+    like_set = set(like_nodes)
+    is_like = np.fromiter((word in like_set for word in words), dtype=bool, count=len(words))
+    if all_nodes:
+        save_embeddings(path_save, words, model.wv.vectors, is_like)
+        return
+    # we only keep likes' nodes embeddings
+    save_embeddings(path_save, np.array(words, dtype=object)[is_like], model.wv.vectors[is_like])
 
 
 def preparing_samples(
         dataloader: DataLoader, p: float, q: float, walk_length: int,
-        walks_per_node: int, context_size: int, path_save_sentences: str
+        walks_per_node: int, context_size: int, path_save_sentences: str, strategy: str = AUTO,
+        workers: int = 1, seed: Optional[int] = None, engine: str = PYTHON,
+        cache: Optional[TransitionCache] = None, max_degree: Optional[int] = None,
+        unit_nodes: Optional[int] = None
 ):
-    logging.info("Precomputing transition probabilities...")
-    matrix_prob, list_nodes = dataloader.get_transition_probabilites(p, q)
-
+    """
+    :param unit_nodes: Sample the walks in resumable work units of unit_nodes start nodes (python engine),
+    an interrupted run restarted with the same parameters only samples the missing units
+    """
+    if context_size >= walk_length:
+        raise ValueError("Context size can't be greater or equal to walk length !")
+    if unit_nodes is not None and engine != PYTHON:
+        raise ValueError(f"Resumable walks need the {PYTHON} engine, not {engine}")
+
+    if engine == BATCH:
+        # The vectorized engine only needs the adjacency
+        with metrics.span("graph"):
+            graph = dataloader.get_graph(cache)
+            bipartite = strategy == BIPARTITE or (strategy == AUTO and dataloader.is_bipartite())
+        logging.info("Sampling walks to create our dataset")
+        with metrics.span("walk", engine=engine) as record:
+            sample_walks_batch(path_save_sentences, graph, p, q, walks_per_node, walk_length,
+                               seed=seed, bipartite=bipartite)
+    else:
+        logging.info("Precomputing transition probabilities...")
+        with metrics.span("precompute", strategy=strategy):
+            matrix_prob, graph = dataloader.get_transition_probabilites(p, q, strategy, cache, max_degree, seed)
+
+        logging.info("Sampling walks to create our dataset")
+        with metrics.span("walk", engine=engine, workers=workers) as record:
+            if unit_nodes is not None:
+                sample_walks_resumable(path_save_sentences, matrix_prob, graph, walks_per_node, walk_length,
+                                       workers, seed, unit_nodes, p=p, q=q, strategy=strategy, max_degree=max_degree)
+            else:
+                sample_walks(path_save_sentences, matrix_prob, graph, walks_per_node, walk_length, workers, seed)
+
+    walk_rates(record, walks_per_node * graph.num_nodes, walk_length)
+    return graph.like_nodes()
+
+
+def walk_rates(record: Dict[str, Any], n_walks: int, walk_length: int) -> None:
+    """Add the throughput of a walk span to its record"""
+    record["walks_per_sec"] = n_walks / record["wall"]
+    record["steps_per_sec"] = n_walks * (walk_length - 1) / record["wall"]
+
+
+def updating_samples(
+        dataloader: DataLoader, delta: DataLoader, p: float, q: float, walk_length: int,
+        walks_per_node: int, path_save_sentences: str, strategy: str = AUTO,
+        seed: Optional[int] = None, engine: str = PYTHON, cache: Optional[TransitionCache] = None,
+        max_degree: Optional[int] = None
+) -> List[str]:
+    """
+    Update the walks of path_save_sentences (sampled from dataloader, or already updated) with the edges of delta:
+    only the walks of the nodes of the new edges and of their neighbors are resampled, and only the transitions
+    they reach are built
+    """
+    strategy = dataloader.resolve_strategy(strategy)
+    with metrics.span("graph"):
+        # Later updates add their edges to the graph of the last one
+        graph = load_graph(path_save_sentences)
+        if graph is None:
+            graph = dataloader.get_graph(cache)
+
+    with metrics.span("update"):
+        users, likes = delta.get_edges()
+        graph, affected = add_edges(graph, users.tolist(), likes.tolist())
+        matrix_prob = None
+        if engine != BATCH:
+            # The same hub samples as the first build, for the nodes whose neighbors didn't change
+            hubs = None
+            if max_degree is not None and strategy not in [LAZY, BIPARTITE]:
+                hubs = hub_neighbors(graph, max_degree, seed)
+            matrix_prob = walk_transitions(graph, strategy, p, q, hubs)
+    metrics.gauge("affected_nodes", int(affected.sum()))
+
+    logging.info("Resampling the walks of the affected nodes")
+    with metrics.span("walk", engine=engine) as record:
+        walks = resample_walks(graph, np.flatnonzero(affected).astype(np.int32), walks_per_node, walk_length,
+                               matrix_prob, p, q, strategy == BIPARTITE, seed)
+        update_corpus(path_save_sentences, graph, affected, walks)
+    walk_rates(record, len(walks), walk_length)
+    return graph.like_nodes()
+
+
+def preparing_stream(
+        dataloader: DataLoader, p: float, q: float, walk_length: int,
+        walks_per_node: int, context_size: int, strategy: str = AUTO, seed: Optional[int] = None,
+        cache: Optional[TransitionCache] = None
+) -> Tuple[WalkStream, List[str]]:
+    """Same walks as preparing_samples with the batch engine, but sampled while training instead of saved"""
     if context_size >= walk_length:
         raise ValueError("Context size can't be greater or equal to walk length !")
 
-    logging.info("Sampling walks to create our dataset")
-    sample_walks(path_save_sentences, matrix_prob, list_nodes, walks_per_node, walk_length)
-    return dataloader.list_like_nodes()
+    with metrics.span("graph"):
+        graph = dataloader.get_graph(cache)
+        bipartite = strategy == BIPARTITE or (strategy == AUTO and dataloader.is_bipartite())
+    # Walks are sampled during the train span
+    stream = WalkStream(graph, p, q, walks_per_node, walk_length, seed=seed, bipartite=bipartite)
+    return stream, graph.like_nodes()
 
 
 def parse():
@@ -122,9 +265,26 @@ def parse():
     parser.add_argument(
         "--type",
         type=str,
-        help='Either "Relation" or "BlogCatalog" dataset',
+        help='Either "Relation" or "BlogCatalog" dataset, or the format of the --input edge file: '
+             '"parquet", "feather" or "npy" (pairs of int ids)',
         default="Relation"
     )
+    parser.add_argument(
+        "--input",
+        help="Path of the edge file (default is the file of the dataset in tests/data)",
+        default=None,
+    )
+    parser.add_argument(
+        "--chunksize",
+        help="Number of rows of the edge file read at once",
+        type=int,
+        default=CHUNK_ROWS,
+    )
+    parser.add_argument(
+        "--id_dtype",
+        help="dtype of the id columns, e.g. int64 to parse numeric ids faster (default is str)",
+        default=None,
+    )
     parser.add_argument(
         "--save",
         help="Path of the folder to save the user features (default is same folder as data)",
@@ -156,7 +316,8 @@ def parse():
     )
     parser.add_argument(
         "--mode",
-        help="{preprocess, train, resume, all}",
+        help="{preprocess, train, resume, all, incremental}, incremental adds the edges of --delta "
+             "to the walks of a previous run and resumes the training of --model",
         type=str,
         default=ALL,
     )
@@ -184,6 +345,162 @@ def parse():
         type=int,
         default=2,
     )
+    parser.add_argument(
+        "--strategy",
+        help="How to compute transition probabilities {auto, full, alias, lazy, bipartite}, "
+             "auto uses bipartite if no id is both a user and a like and full otherwise",
+        type=str,
+        choices=STRATEGIES,
+        default=AUTO,
+    )
+    parser.add_argument(
+        "--max_degree",
+        help="Cap the transition tables of the full and alias strategies: walks leaving a node with more "
+             "neighbors only step to a fixed sample of max_degree of them. Check the F1 of the embeddings "
+             "(multilabel_blogCatalog) against an uncapped run before using it",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--resumable",
+        help="Sample the walks in work units recorded in a manifest next to the corpus, "
+             "so that an interrupted preprocessing restarted with the same parameters resumes where it stopped",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--unit_nodes",
+        help="Number of start nodes of a work unit of --resumable",
+        type=int,
+        default=UNIT_NODES,
+    )
+    parser.add_argument(
+        "--memory_budget",
+        help="Memory (GB) available for the graph and the transitions: the auto strategy becomes the fastest "
+             "strategy that fits, estimated from the degrees before building any table",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--dry_run",
+        help="Only load the graph and log the memory estimate of each strategy",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of processes to sample the random walks (default is the number of cores)",
+        type=int,
+        default=multiprocessing.cpu_count(),
+    )
+    parser.add_argument(
+        "--engine",
+        help="Walk engine {python, batch}, batch advances all walkers in lockstep with numpy",
+        type=str,
+        choices=ENGINES,
+        default=PYTHON,
+    )
+    parser.add_argument(
+        "--corpus_format",
+        help="Format of the sampled walks {txt, npy}, npy is a binary memory-mapped matrix of node codes",
+        type=str,
+        choices=CORPUS_FORMATS,
+        default=TXT,
+    )
+    parser.add_argument(
+        "--input_mode",
+        help="How the walks are read by the skip-gram model {iterator, corpus_file}, "
+             "corpus_file lets every worker read its own part of the file",
+        type=str,
+        choices=INPUT_MODES,
+        default=ITERATOR,
+    )
+    parser.add_argument(
+        "--embedding_format",
+        help="Format of the embeddings {npy, pkl}, npy is a float32 matrix plus an ids file (loaded with mmap), "
+             "pkl is the legacy pickled dict",
+        type=str,
+        choices=EMBEDDING_FORMATS,
+        default=NPY,
+    )
+    parser.add_argument(
+        "--all_nodes",
+        help="Save the embeddings of the users too (npy only), e.g. to query similar users",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stream",
+        help="Sample the walks while training the skip-gram model instead of saving them to a file first",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache_dir",
+        help="Folder of the cache of preprocessed graphs and transition tables (default is cache/ in the data folder)",
+        default=None,
+    )
+    parser.add_argument(
+        "--cache_size",
+        help="Maximum size of the cache in GB, least recently used entries are evicted",
+        type=float,
+        default=10.,
+    )
+    parser.add_argument(
+        "--no_cache",
+        help="Don't read or write the cache",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--clear_cache",
+        help="Empty the cache before running",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--delta",
+        help="CSV file of new edges (same columns as the dataset) for the incremental mode",
+        default=None,
+    )
+    parser.add_argument(
+        "--model",
+        help="Path of the Word2Vec model, saved after training and loaded to resume it",
+        default=None,
+    )
+    parser.add_argument(
+        "--checkpoint_epochs",
+        help="Checkpoint the training every checkpoint_epochs epochs (written in the background)",
+        type=int,
+        default=None,
+    )
+    parser.add_argument(
+        "--checkpoint_minutes",
+        help="Checkpoint the training at the end of the first epoch after checkpoint_minutes minutes",
+        type=float,
+        default=None,
+    )
+    parser.add_argument(
+        "--keep_checkpoints",
+        help="Number of checkpoints kept",
+        type=int,
+        default=KEEP_CHECKPOINTS,
+    )
+    parser.add_argument(
+        "--checkpoint_dir",
+        help="Folder of the checkpoints (default is next to the embeddings, named after the parameters "
+             "but the number of epochs), "
+             "the resume mode restarts from the newest one",
+        default=None,
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile the run with cprofile (stats dumped to a .prof file) or tracemalloc (top allocations), "
+             "the hot spots are added to the metrics report",
+        type=str,
+        choices=PROFILERS,
+        default=None,
+    )
+    parser.add_argument(
+        "--seed",
+        help="Seed of the random walks",
+        type=int,
+        default=None,
+    )
 
     args = parser.parse_args()
 
@@ -194,11 +511,13 @@ def main():
     args = parse()
 
     if args.type.lower() == "relation" or args.type.lower() == "relations":
-        dataloader = RelationsDataLoader(RelationsData.CSV_FILE, min_like=args.min_like)
         folder = RelationsData.FOLDER
     elif args.type.lower() == "blogcatalog":
-        dataloader = BlogCatalogDataLoader(BlogCatalogData.EDGE_CSV, min_like=args.min_like)
         folder = BlogCatalogData.FOLDER
+    elif args.type.lower() in EDGE_FORMATS and args.type.lower() != CSV:
+        if args.input is None or edge_format(args.input) != args.type.lower():
+            raise ValueError(f"--type {args.type} needs the --input {args.type.lower()} edge file")
+        folder = os.path.dirname(os.path.abspath(args.input))
     else:
         raise NotImplementedError("Other datatypes are not yet impleented")
 
@@ -206,28 +525,131 @@ def main():
         args.save = folder
 
     str_save = f"_p_{args.p}_q_{args.q}_minLike_{args.min_like}"
-    file_sampled_walks = "sampled_walks" + str_save + ".txt"
-    # Save sample sentences (random walks) to a .txt file to be memory efficient
+    file_sampled_walks = "sampled_walks" + str_save + "." + args.corpus_format
+    # Save sample sentences (random walks) to a file to be memory efficient
     path_sentences = os.path.join(args.save, file_sampled_walks)
 
+    str_save += f"_dim_{args.dim_features}_window_{args.context_size}"
+    # Without the number of epochs, so that a training resumed for a different number of epochs finds them
+    if args.checkpoint_dir is None:
+        args.checkpoint_dir = os.path.join(args.save, "checkpoints" + str_save)
+
     # add number of epochs for name file of embeddings
-    str_save += f"_dim_{args.dim_features}_window_{args.context_size}_epochs_{args.epochs}"
+    str_save += f"_epochs_{args.epochs}"
 
-    file_embeddings = "features_node2vec" + str_save + ".pkl"
+    file_embeddings = "features_node2vec" + str_save + "." + args.embedding_format
 
     args.save = os.path.join(args.save, file_embeddings)
 
-    if args.mode in [PREPROCESS, ALL]:
+    # The report of the run (and the profile) are written next to the embeddings, even if the run fails
+    metrics.reset()
+    try:
+        with metrics.profiling(args.profile, os.path.splitext(args.save)[0] + ".prof"):
+            run(args, folder, path_sentences)
+    finally:
+        metrics.write_report(os.path.splitext(args.save)[0] + ".metrics.json", **vars(args))
+
+
+def create_dataloader(folder: str, path_input: Optional[str], min_like: int, chunksize: int,
+                      dtype: Optional[str]) -> DataLoader:
+    """
+    Loader of the dataset of folder, reading path_input instead of the dataset's file if given.
+    Parquet, feather and npy edge files are read with their id types by EdgeFileDataLoader
+    """
+    if path_input is not None and edge_format(path_input) != CSV:
+        return EdgeFileDataLoader(path_input, min_like=min_like, chunksize=chunksize)
+    if folder == RelationsData.FOLDER:
+        return RelationsDataLoader(path_input or RelationsData.CSV_FILE, min_like=min_like, chunksize=chunksize,
+                                   dtype=dtype)
+    return BlogCatalogDataLoader(path_input or BlogCatalogData.EDGE_CSV, min_like=min_like, chunksize=chunksize,
+                                 dtype=dtype)
+
+
+def plan_memory(args: argparse.Namespace, dataloader: DataLoader, cache: Optional[TransitionCache]) -> None:
+    """
+    Estimate the memory of each strategy from the degrees of the graph. With a memory budget and the auto
+    strategy, use the fastest strategy that fits (the capped ones only if --max_degree is given)
+    """
+    with metrics.span("plan"):
+        graph = dataloader.get_graph(cache)
+        estimates = estimate_memory(graph, dataloader.is_bipartite(), args.max_degree)
+    budget = int(args.memory_budget * 1024 ** 3) if args.memory_budget is not None else None
+    logging.info(format_plan(graph, estimates, budget))
+    metrics.gauge("transition_entries_exact", table_entries(graph))
+    if budget is None:
+        return
+
+    plan = plan_strategy(estimates, budget, capped=args.max_degree is not None)
+    metrics.gauge("planned_bytes", plan.bytes)
+    if args.strategy == AUTO:
+        logging.info(f"Strategy planned for {args.memory_budget} GB: {plan.name}")
+        args.strategy, args.max_degree = plan.strategy, plan.max_degree
+        return
+    fits = [estimate for estimate in estimates
+            if estimate.strategy == args.strategy and estimate.max_degree == args.max_degree]
+    if fits and fits[0].bytes > budget:
+        logging.warning(f"The {fits[0].name} strategy needs about {fits[0].bytes / 1024 ** 3:.2f} GB, "
+                        f"more than the budget, {plan.name} would fit")
+
+
+def run(args: argparse.Namespace, folder: str, path_sentences: str) -> None:
+    with metrics.span("load"):
+        dataloader = create_dataloader(folder, args.input, args.min_like, args.chunksize, args.id_dtype)
+
+    cache = None
+    if not args.no_cache:
+        cache = TransitionCache(args.cache_dir or os.path.join(folder, "cache"), int(args.cache_size * 1024 ** 3))
+        if args.clear_cache:
+            cache.clear()
+
+    if args.memory_budget is not None or args.dry_run:
+        plan_memory(args, dataloader, cache)
+        if args.dry_run:
+            return
+
+    if args.max_degree is not None and (args.stream or args.engine == BATCH):
+        logging.warning("--max_degree is ignored: the batch engine and --stream sample from the adjacency, "
+                        "with the exact transitions")
+
+    sentences: Union[str, WalkStream] = path_sentences
+    if args.stream:
+        if args.mode in [PREPROCESS, INCREMENTAL]:
+            raise ValueError(f"Nothing to {args.mode} with --stream, walks are sampled during training")
+        if args.resumable:
+            raise ValueError("--resumable needs walks saved to a corpus, not --stream")
+        sentences, like_nodes = preparing_stream(
+            dataloader, args.p, args.q, args.walk_length,
+            args.walks_per_node, args.context_size, args.strategy, args.seed, cache
+        )
+    elif args.mode in [PREPROCESS, ALL]:
         like_nodes = preparing_samples(
             dataloader, args.p, args.q, args.walk_length,
-            args.walks_per_node, args.context_size, path_sentences
+            args.walks_per_node, args.context_size, path_sentences, args.strategy,
+            args.workers, args.seed, args.engine, cache, args.max_degree,
+            args.unit_nodes if args.resumable else None
+        )
+    elif args.mode == INCREMENTAL:
+        if args.delta is None or args.model is None:
+            raise ValueError("The incremental mode needs --delta and --model")
+        delta = create_dataloader(folder, args.delta, 1, args.chunksize, args.id_dtype)
+        like_nodes = updating_samples(
+            dataloader, delta, args.p, args.q, args.walk_length, args.walks_per_node,
+            path_sentences, args.strategy, args.seed, args.engine, cache, args.max_degree
         )
     else:
         like_nodes = dataloader.list_like_nodes()
 
-    if args.mode in [ALL, TRAIN, RESUME]:
+    if args.mode in [ALL, TRAIN, RESUME, INCREMENTAL]:
+        checkpointer = None
+        if args.checkpoint_epochs or args.checkpoint_minutes or args.mode == RESUME:
+            checkpointer = TrainingCheckpointer(
+                args.checkpoint_dir, args.checkpoint_epochs,
+                args.checkpoint_minutes, args.keep_checkpoints
+            )
         logging.info("Starting training of skip-gram model")
-        optimize(path_sentences, like_nodes, args.mode, args.save, args.epochs, args.context_size, args.dim_features)
+        optimize(sentences, like_nodes, RESUME if args.mode == INCREMENTAL else args.mode, args.save, args.epochs,
+                 args.context_size, args.dim_features, args.model, input_mode=args.input_mode,
+                 update_vocab=args.mode == INCREMENTAL, all_nodes=args.all_nodes, checkpointer=checkpointer)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,152 @@
+import cProfile
+import json
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from src.config import logging
+
+# Profilers of Metrics.profiling
+CPROFILE = "cprofile"
+TRACEMALLOC = "tracemalloc"
+PROFILERS = [CPROFILE, TRACEMALLOC]
+
+
+def peak_rss() -> int:
+    """Peak resident memory of the process in bytes, since the last reset_peak_rss on Linux"""
+    try:
+        with open("/proc/self/status") as f_status:
+            for line in f_status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    # kilobytes on Linux, bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+def reset_peak_rss() -> bool:
+    """Reset the peak to the current resident memory (Linux only), so the next peak is the one of a stage"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f_refs:
+            f_refs.write("5")
+        return True
+    except OSError:
+        return False
+
+
+@contextmanager
+def span(name: str, **info) -> Iterator[Dict[str, Any]]:
+    """
+    Measure a stage: the yielded record gets its wall time, CPU time (seconds) and peak RSS (bytes)
+    when the block exits. Extra information (e.g. counters) can be added to the record inside the block.
+    """
+    record: Dict[str, Any] = {"name": name, **info}
+    reset_peak_rss()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record["wall"] = time.perf_counter() - wall
+        record["cpu"] = time.process_time() - cpu
+        record["peak_rss"] = peak_rss()
+
+
+class Metrics:
+    """
+    Spans (one per stage of a run) and counters of the hot path, reported as JSON at the end of the run.
+    Spans are not meant to be nested: the peak RSS is reset when a span starts.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self) -> None:
+        self.spans: List[Dict[str, Any]] = []
+        self.counters: Dict[str, float] = {}
+        self.profile: Dict[str, Any] = {}
+        self.start = time.time()
+
+    @contextmanager
+    def span(self, name: str, **info) -> Iterator[Dict[str, Any]]:
+        with span(name, **info) as record:
+            try:
+                yield record
+            finally:
+                # Kept even if the stage fails, the times are filled when the span exits
+                self.spans.append(record)
+        logging.info(f"{name}: {record['wall']:.2f} s wall, {record['cpu']:.2f} s CPU, "
+                     f"peak RSS {record['peak_rss'] / 1024 ** 2:.0f} MB")
+
+    def count(self, name: str, value: float = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float) -> None:
+        self.counters[name] = value
+
+    @contextmanager
+    def profiling(self, profiler: Optional[str], path_profile: Optional[str] = None, top: int = 20) -> Iterator[None]:
+        """
+        :param profiler: {'cprofile', 'tracemalloc'} or None to run without profiling
+        :param path_profile: Where to dump the cProfile stats (readable with pstats or snakeviz)
+        :param top: Number of functions (cProfile) or lines (tracemalloc) kept in the report
+        """
+        if profiler is None:
+            yield
+            return
+        if profiler not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profiler}, choose from {PROFILERS}")
+
+        if profiler == CPROFILE:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                stats = pstats.Stats(profile)
+                if path_profile is not None:
+                    stats.dump_stats(path_profile)
+                functions = sorted(stats.stats.items(), key=lambda item: -item[1][3])[:top]  # type: ignore
+                self.profile[CPROFILE] = [
+                    {"function": f"{file}:{line}({name})", "calls": calls, "tottime": tottime, "cumtime": cumtime}
+                    for (file, line, name), (_, calls, tottime, cumtime, _) in functions
+                ]
+            return
+
+        tracemalloc.start()
+        try:
+            yield
+        finally:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            self.profile[TRACEMALLOC] = {
+                "peak_traced": peak,
+                "top": [{"line": str(stat.traceback), "size": stat.size, "count": stat.count}
+                        for stat in snapshot.statistics('lineno')[:top]],
+            }
+
+    def report(self, **run) -> Dict[str, Any]:
+        """:param run: Parameters of the run, added to the report"""
+        return {
+            "run": {"argv": sys.argv, "start": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.start)),
+                    "wall": time.time() - self.start, **run},
+            "spans": self.spans,
+            "counters": self.counters,
+            "profile": self.profile,
+        }
+
+    def write_report(self, path_report: str, **run) -> None:
+        with open(path_report, 'w') as f_report:
+            json.dump(self.report(**run), f_report, indent=2, default=str)
+        logging.info(f"Metrics report written to {path_report}")
+
+
+# Shared by all the stages of a run
+metrics = Metrics()
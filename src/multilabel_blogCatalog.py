@@ -1,14 +1,18 @@
 #! usr/bin/python
-import pickle
 import argparse
+import multiprocessing
+import time
 import numpy as np
 import pandas as pd
+from scipy import sparse
+from typing import Any, Dict
 from src.config import logging, BlogCatalogData
+from src.embeddings import load_embeddings
+from sklearn.base import clone
 from sklearn.model_selection import KFold
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import f1_score
 from sklearn.multiclass import OneVsRestClassifier
-from sklearn.preprocessing import MultiLabelBinarizer
 
 import warnings
 warnings.filterwarnings('ignore')
@@ -18,75 +22,105 @@ NODE = 'node'
 GROUP = 'group'
 
 
-def sparse2array_inv_binarize(y):
-    mlb = MultiLabelBinarizer(range(y.shape[1]))
-    mlb.fit(y)
-    y_ = mlb.inverse_transform(y)
-    return y_
-
-
 def compute_metrics(y_test, preds):
-    mlb = MultiLabelBinarizer(range(y_test.shape[1]))
-    mlb.fit(preds)
-    preds = mlb.transform(preds)
-    # convert y_test from sparse back and forth to get binarized version.
-    # There's probably a better way to do this
-    y_test = sparse2array_inv_binarize(y_test)
-    y_test = mlb.transform(y_test)
+    """:param y_test, preds: Binary indicator matrices (dense or sparse) of the true and predicted groups"""
     micro_f1 = f1_score(y_test, preds, average='micro')
     macro_f1 = f1_score(y_test, preds, average='macro')
     return micro_f1, macro_f1
 
 
-def create_features(features_pkl):
-    # tune features into numpy matrix
-    with open(features_pkl, 'rb') as f:
-        n2v_dic = pickle.load(f)
-    nodes = n2v_dic.keys()
-    num_nodes, num_features = len(nodes), len(n2v_dic['1'])
+def top_labels(probabilities, num_predictions):
+    """
+    Predict the num_predictions most probable groups of each node (the number of groups of the node is known)
+    code (from https://github.com/apoorvavinod/node2vec/blob/master/src/Classifier.py), vectorized
+    :return: Sparse indicator matrix of the predictions
+    """
+    ranks = np.argsort(-probabilities, axis=1, kind='stable')
+    kept = np.arange(probabilities.shape[1]) < num_predictions[:, None]
+    rows = np.repeat(np.arange(len(probabilities)), num_predictions)
+    return sparse.csr_matrix((np.ones(len(rows)), (rows, ranks[kept])), shape=probabilities.shape)
+
+
+def create_features(path_features, num_nodes=None):
+    # tune features into numpy matrix, from a .npy matrix (with its ids file) or a legacy .pkl dict
+    # num_nodes: rows of the matrix (e.g. the rows of the labels), the largest node id by default,
+    # nodes without embedding get zeros and embeddings of the nodes after num_nodes are dropped
+    ids, vectors = load_embeddings(path_features)
+    num_features = vectors.shape[1]
+    rows = ids.astype(int) - 1
+    if num_nodes is None:
+        num_nodes = rows.max() + 1 if len(rows) else 0
     logging.info("Create Feature Matrix in Numpy: %s nodes, %s features" % (num_nodes, num_features))
     features = np.zeros((num_nodes, num_features))
-    for node in nodes:
-        idx = int(node) - 1
-        features[idx] = n2v_dic[node]
+    kept = rows < num_nodes
+    if not kept.all():
+        logging.warning("Dropped the embeddings of %s nodes with an id above %s" % ((~kept).sum(), num_nodes))
+    features[rows[kept]] = vectors[kept]
     logging.info("Feature Matrix Created.")
     return features
 
 
 def create_labels(label_csv):
     label_df = pd.read_csv(label_csv, header=None, names=[NODE, GROUP])
-    num_groups = len(label_df[GROUP].unique())
-    num_nodes = len(label_df[NODE].unique())
+    nodes, groups = label_df[NODE].values - 1, label_df[GROUP].values - 1
+    num_nodes, num_groups = nodes.max() + 1, groups.max() + 1
     logging.info("Create Label Matrix in Numpy: %s nodes, %s groups" % (num_nodes, num_groups))
-    labels = np.zeros((num_nodes, num_groups))
-    for index, row in label_df.iterrows():
-        node = row[NODE]
-        group = row[GROUP]
-        labels[node - 1, group - 1] = 1
+    labels = sparse.csr_matrix((np.ones(len(label_df)), (nodes, groups)), shape=(num_nodes, num_groups))
+    # A duplicated (node, group) row is still one label
+    labels.data[:] = 1
     logging.info("Label Matrix Created.")
     return labels
 
 
-def k_fold_average(features, labels, clf, k=10):
-    test_result = []
-    kf = KFold(n_splits=k, shuffle=True)
-    for train_index, test_index in kf.split(features):
-        x_train, x_test = features[train_index], features[test_index]
-        y_train, y_test = labels[train_index], labels[test_index]
-        clf = clf.fit(x_train, y_train)
-        # code (from https://github.com/apoorvavinod/node2vec/blob/master/src/Classifier.py)
-        y_test_ = sparse2array_inv_binarize(y_test)
-        num_predictions = [len(item) for item in y_test_]
-        probabilities = clf.predict_proba(x_test)
-        sorted_indices_probs = probabilities.argsort()
-        y_pred = [
-            sorted_indices[-num:].tolist() for (sorted_indices, num) in zip(sorted_indices_probs, num_predictions)
-        ]
-        mi, ma = compute_metrics(y_test, y_pred)
-        logging.info("Macro F1: %s" % ma)
-        logging.info("Micro F1: %s" % mi)
-        test_result.append(ma)
-        return sum(test_result) / len(test_result)
+# Features and labels of the folds, inherited by the forked workers instead of pickled for each fold
+_FOLD_STATE: Dict[str, Any] = {}
+
+
+def evaluate_fold(fold, clf, train_index, test_index):
+    """:return: The fold, its micro and macro F1 and the seconds it took"""
+    start = time.perf_counter()
+    features, labels = _FOLD_STATE["features"], _FOLD_STATE["labels"]
+    x_train, x_test = features[train_index], features[test_index]
+    y_train, y_test = labels[train_index], labels[test_index]
+    clf = clone(clf).fit(x_train, y_train)
+    y_pred = top_labels(clf.predict_proba(x_test), y_test.getnnz(axis=1))
+    mi, ma = compute_metrics(y_test, y_pred)
+    return fold, mi, ma, time.perf_counter() - start
+
+
+def _star_evaluate_fold(args):
+    return evaluate_fold(*args)
+
+
+def cross_validate(features, labels, clf, k=10, workers=1, seed=None):
+    """
+    :param labels: Sparse indicator matrix of the groups of each node
+    :param workers: Number of folds evaluated at the same time, each in its own process
+    :return: (fold, micro F1, macro F1, seconds) of each fold
+    """
+    kf = KFold(n_splits=k, shuffle=True, random_state=seed)
+    tasks = [(fold, clf, train_index, test_index)
+             for fold, (train_index, test_index) in enumerate(kf.split(features))]
+
+    _FOLD_STATE["features"], _FOLD_STATE["labels"] = features, labels
+    try:
+        if workers > 1:
+            with multiprocessing.get_context("fork").Pool(min(workers, k)) as pool:
+                results = sorted(pool.imap_unordered(_star_evaluate_fold, tasks))
+        else:
+            results = [evaluate_fold(*task) for task in tasks]
+    finally:
+        _FOLD_STATE.clear()
+    return results
+
+
+def k_fold_average(features, labels, clf, k=10, workers=1, seed=None):
+    """:return: Average macro F1 over the k folds"""
+    results = cross_validate(features, labels, clf, k, workers, seed)
+    for fold, mi, ma, seconds in results:
+        logging.info("Fold %s: Macro F1 %s, Micro F1 %s (%.2f s)" % (fold, ma, mi, seconds))
+    logging.info("%s Fold CV Micro F1 Score: %s" % (k, np.mean([mi for _, mi, _, _ in results])))
+    return np.mean([ma for _, _, ma, _ in results])
 
 
 def main():
@@ -95,17 +129,22 @@ def main():
                         help='path of trained BlogCatalog dataset node2vec feature')
     parser.add_argument('--label', type=str, default=BlogCatalogData.LABELS_FILE, help='path of label file')
     parser.add_argument('--k', type=int, default=10, help='number of fold validation')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of folds evaluated in parallel (default is all the folds the cores allow)')
+    parser.add_argument('--n_jobs', type=int, default=1,
+                        help='number of processes of the one-vs-rest classifier in each fold')
+    parser.add_argument('--seed', type=int, default=None, help='seed of the folds')
     args = parser.parse_known_args()[0]
 
-    features = create_features(args.path)
     labels = create_labels(args.label)
-    clf = OneVsRestClassifier(LogisticRegression(multi_class='ovr', solver='lbfgs'))
-    kfold_avg = k_fold_average(features, labels, clf, k=args.k)
+    # One row per labeled node, even if the last nodes have no embedding
+    features = create_features(args.path, labels.shape[0])
+    # workers * n_jobs processes at most
+    workers = args.workers or max(1, min(args.k, multiprocessing.cpu_count() // args.n_jobs))
+    clf = OneVsRestClassifier(LogisticRegression(solver='lbfgs'), n_jobs=args.n_jobs)
+    kfold_avg = k_fold_average(features, labels, clf, k=args.k, workers=workers, seed=args.seed)
     logging.info("%s Fold CV Macro F1 Score: %s " % (args.k, kfold_avg))
 
 
 if __name__ == "__main__":
     main()
-
-
-
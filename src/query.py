@@ -0,0 +1,189 @@
+import numpy as np
+from typing import List, Optional, Sequence, Tuple
+
+from src.embeddings import load_embeddings, load_is_like
+
+# Nodes a query can return
+ALL = "all"
+LIKES = "likes"
+USERS = "users"
+KINDS = [ALL, LIKES, USERS]
+
+# Rows of the embedding matrix scored at once
+BLOCK_SIZE = 65536
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """:return: Columns of the k best scores of each row, best first"""
+    k = min(k, scores.shape[1])
+    best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(best, order, axis=1)
+
+
+class NearestNeighbors:
+    """
+    Exact cosine similarity search over the embeddings.
+    The matrix is never copied (it can stay memory-mapped): it is scored block by block,
+    with the norms applied to the scores, and only the running top k of each query is kept.
+    """
+
+    def __init__(self, ids: np.ndarray, vectors: np.ndarray, is_like: Optional[np.ndarray] = None,
+                 block_size: int = BLOCK_SIZE):
+        """
+        :param ids: Original id of each row of vectors
+        :param is_like: True for the rows of like nodes, needed to restrict queries to likes or users
+        """
+        self.ids = ids
+        self.vectors = vectors
+        self.is_like = is_like
+        self.block_size = block_size
+        self.index = {node: row for row, node in enumerate(ids.tolist())}
+        norms = np.sqrt(np.einsum('ij,ij->i', vectors, vectors, dtype=np.float32))
+        # Null vectors get a score of 0
+        self.inv_norms = np.divide(1., norms, out=np.zeros_like(norms), where=norms > 0)
+
+    @classmethod
+    def from_file(cls, path_embeddings: str, block_size: int = BLOCK_SIZE) -> "NearestNeighbors":
+        ids, vectors = load_embeddings(path_embeddings)
+        return cls(ids, vectors, load_is_like(path_embeddings), block_size)
+
+    def rows(self, kind: str = ALL) -> np.ndarray:
+        """:return: Rows of the nodes of a kind"""
+        if kind == ALL:
+            return np.arange(len(self.ids))
+        if kind not in KINDS:
+            raise ValueError(f"Unknown kind {kind}, choose from {KINDS}")
+        if self.is_like is None:
+            raise ValueError("Export the embeddings of all the nodes to restrict queries to likes or users")
+        return np.flatnonzero(self.is_like if kind == LIKES else ~self.is_like)
+
+    def normalize(self, queries: np.ndarray) -> np.ndarray:
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        return queries / np.where(norms > 0, norms, 1.)
+
+    def score(self, queries: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Cosine similarity between normalized queries and some rows"""
+        return (queries @ self.vectors[rows].T) * self.inv_norms[rows]
+
+    def search(self, queries: np.ndarray, k: int = 10, kind: str = ALL,
+               rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :param queries: Query vectors, one per row
+        :param rows: Candidate rows, all the rows of kind if not given
+        :return: Rows of the k nearest neighbors of each query and their similarity, best first
+        """
+        queries = self.normalize(queries)
+        if rows is None:
+            rows = self.rows(kind)
+        best_rows = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for first in range(0, len(rows), self.block_size):
+            block = rows[first:first + self.block_size]
+            # Merge the block with the running top k
+            scores = np.concatenate([best_scores, self.score(queries, block)], axis=1)
+            candidates = np.concatenate([best_rows, np.broadcast_to(block, (len(queries), len(block)))], axis=1)
+            best = top_k(scores, k)
+            best_rows = np.take_along_axis(candidates, best, axis=1)
+            best_scores = np.take_along_axis(scores, best, axis=1)
+        return best_rows, best_scores
+
+    def most_similar(self, nodes: Sequence[str], k: int = 10, kind: str = ALL,
+                     index: Optional["IVFIndex"] = None, nprobe: int = 8) -> List[List[Tuple[str, float]]]:
+        """
+        :param nodes: Ids of the query nodes, they are not returned in their own results
+        :param index: Approximate index to search instead of the whole matrix
+        :return: (id, similarity) of the k most similar nodes of each query node
+        """
+        query_rows = np.array([self.index[node] for node in nodes], dtype=np.int64)
+        queries = self.vectors[query_rows]
+        if index is None:
+            rows, scores = self.search(queries, k + 1, kind)
+        else:
+            rows, scores = index.search(queries, k + 1, kind, nprobe)
+        results = []
+        for query_row, neighbors, similarities in zip(query_rows.tolist(), rows, scores):
+            # Without the query itself, nor the padding of a sparse probe
+            others = (neighbors != query_row) & (neighbors >= 0)
+            results.append(list(zip(self.ids[neighbors[others][:k]].tolist(), similarities[others][:k].tolist())))
+        return results
+
+
+class IVFIndex:
+    """
+    Inverted file index: the embeddings are clustered with spherical k-means, and a query only scores
+    the rows of the nprobe clusters whose centroids are the most similar to it.
+    The clusters are stored like the adjacency of the graph: rows sorted by cluster plus offsets.
+    """
+
+    def __init__(self, neighbors: NearestNeighbors, n_lists: int = 256, n_iter: int = 10,
+                 sample_size: int = 100000, seed: Optional[int] = None):
+        """
+        :param n_lists: Number of clusters, around sqrt(number of rows) is a good start
+        :param sample_size: Number of rows used to fit the centroids
+        """
+        self.neighbors = neighbors
+        rng = np.random.default_rng(seed)
+        n_rows = len(neighbors.ids)
+        sample = rng.choice(n_rows, min(sample_size, n_rows), replace=False)
+        sample.sort()
+        points = neighbors.vectors[sample] * neighbors.inv_norms[sample, None]
+        n_lists = min(n_lists, len(points))
+
+        self.centroids = points[rng.choice(len(points), n_lists, replace=False)]
+        for _ in range(n_iter):
+            assignment = np.argmax(points @ self.centroids.T, axis=1)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignment, points)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            # Empty clusters keep their centroid
+            self.centroids = np.where(norms > 0, sums / np.where(norms > 0, norms, 1.), self.centroids)
+
+        assignment = np.concatenate([
+            np.argmax(neighbors.score(self.centroids, np.arange(first, min(first + neighbors.block_size, n_rows))),
+                      axis=0)
+            for first in range(0, n_rows, neighbors.block_size)
+        ])
+        self.rows = np.argsort(assignment, kind='stable')
+        self.offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=self.offsets[1:])
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def search(self, queries: np.ndarray, k: int = 10, kind: str = ALL,
+               nprobe: int = 8) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Same output as NearestNeighbors.search, approximate unless nprobe >= n_lists.
+        Queries with fewer than k candidates in their clusters are padded with row -1 and score -inf.
+        """
+        queries = self.neighbors.normalize(queries)
+        allowed = None
+        if kind != ALL:
+            allowed = np.zeros(len(self.neighbors.ids), dtype=bool)
+            allowed[self.neighbors.rows(kind)] = True
+        probes = top_k(queries @ self.centroids.T, nprobe)
+
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, lists in enumerate(probes):
+            rows = np.concatenate([self.rows[self.offsets[cluster]:self.offsets[cluster + 1]] for cluster in lists])
+            if allowed is not None:
+                rows = rows[allowed[rows]]
+            if len(rows) == 0:
+                continue
+            # Sorted rows read the (memory-mapped) matrix in order
+            rows.sort()
+            scores = self.neighbors.score(queries[i:i + 1], rows)
+            best = top_k(scores, k)[0]
+            best_rows[i, :len(best)] = rows[best]
+            best_scores[i, :len(best)] = scores[0, best]
+        return best_rows, best_scores
+
+
+def recall(exact_rows: np.ndarray, approximate_rows: np.ndarray) -> float:
+    """Fraction of the exact neighbors found by the approximate search"""
+    found = sum(len(np.intersect1d(exact, approximate)) for exact, approximate in zip(exact_rows, approximate_rows))
+    return found / exact_rows.size
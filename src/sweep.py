@@ -0,0 +1,181 @@
+import argparse
+import itertools
+import multiprocessing
+import os
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+from sklearn.multiclass import OneVsRestClassifier
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence
+
+from src.config import logging, RelationsData, BlogCatalogData
+from src.corpus import NPY
+from src.data.base import DataLoader
+from src.data.graph import Graph
+from src.data.ingest import CHUNK_ROWS
+from src.learn_features import create_dataloader, optimize, TRAIN
+from src.metrics import span
+from src.multilabel_blogCatalog import create_features, create_labels, cross_validate
+from src.walks import sample_walks_batch
+
+
+class Config(NamedTuple):
+    """Hyperparameters of one run of the sweep"""
+    p: float
+    q: float
+    dim: int
+    window: int
+
+
+def grid(ps: Sequence[float], qs: Sequence[float], dims: Sequence[int], windows: Sequence[int]) -> List[Config]:
+    return [Config(*values) for values in itertools.product(ps, qs, dims, windows)]
+
+
+def walks_path(folder: str, p: float, q: float) -> str:
+    return os.path.join(folder, f"sampled_walks_p_{p}_q_{q}.{NPY}")
+
+
+def features_path(folder: str, config: Config) -> str:
+    return os.path.join(folder, f"features_node2vec_p_{config.p}_q_{config.q}_dim_{config.dim}"
+                                f"_window_{config.window}.{NPY}")
+
+
+def parallelism(n_tasks: int, cores: int) -> Dict[str, int]:
+    """Split the core budget: tasks run at the same time, each one with threads cores"""
+    tasks = max(1, min(n_tasks, cores))
+    return {"tasks": tasks, "threads": max(1, cores // tasks)}
+
+
+# Shared by the forked workers of the sweep (the graph is never pickled)
+_SWEEP_STATE: Dict[str, Any] = {}
+
+
+def _sample(p: float, q: float) -> Dict[str, Any]:
+    state = _SWEEP_STATE
+    with span("walk") as record:
+        sample_walks_batch(walks_path(state["folder"], p, q), state["graph"], p, q, state["walks_per_node"],
+                           state["walk_length"], seed=state["seed"], bipartite=state["bipartite"])
+    return {"p": p, "q": q, "walk_seconds": record["wall"]}
+
+
+def _train(config: Config) -> Dict[str, Any]:
+    state = _SWEEP_STATE
+    record: Dict[str, Any] = config._asdict()
+    path_features = features_path(state["folder"], config)
+    with span("train") as train:
+        optimize(walks_path(state["folder"], config.p, config.q), state["like_nodes"], TRAIN, path_features,
+                 state["epochs"], config.window, config.dim, all_nodes=True, workers=state["threads"])
+    record["train_seconds"] = train["wall"]
+
+    labels = state["labels"]
+    if labels is not None:
+        with span("evaluate") as evaluate:
+            # Workers of a pool can't fork, the folds are evaluated one after the other
+            folds = cross_validate(create_features(path_features, labels.shape[0]), labels,
+                                   OneVsRestClassifier(LogisticRegression(solver='lbfgs')), state["k"],
+                                   workers=1, seed=state["seed"])
+        record["micro_f1"] = np.mean([micro for _, micro, _, _ in folds])
+        record["macro_f1"] = np.mean([macro for _, _, macro, _ in folds])
+        record["evaluate_seconds"] = evaluate["wall"]
+    record["path"] = path_features
+    return record
+
+
+def _run(function, tasks: List[Any], n_parallel: int) -> List[Dict[str, Any]]:
+    if n_parallel == 1:
+        return [function(*task) for task in tasks]
+    with multiprocessing.get_context("fork").Pool(n_parallel) as pool:
+        return pool.starmap(function, tasks)
+
+
+def sweep(graph: Graph, configs: Sequence[Config], folder: str, walk_length: int = 80, walks_per_node: int = 10,
+          epochs: int = 10, bipartite: bool = False, labels=None, k: int = 10, cores: Optional[int] = None,
+          seed: Optional[int] = None, train: bool = True) -> pd.DataFrame:
+    """
+    Walks and embeddings of each configuration of the grid, on a graph loaded and indexed once.
+    The walks of a (p, q) pair are sampled once with the batch engine, which only needs the shared adjacency
+    (no transition table), and are reused by all the (dim, window) of the pair.
+    Independent walks, then independent trainings, run at the same time without using more than cores cores.
+    :param labels: Sparse indicator matrix of the groups of the nodes (see create_labels), to score each run
+    with k fold cross validation. The nodes must be the integers 1 to n (BlogCatalog)
+    :param train: Only sample the walks if False
+    :return: Table with one row per configuration (or per (p, q) pair without training): its times and scores
+    """
+    cores = cores or multiprocessing.cpu_count()
+    pairs = sorted({(config.p, config.q) for config in configs})
+    _SWEEP_STATE.update(graph=graph, like_nodes=graph.like_nodes(), folder=folder, walk_length=walk_length,
+                        walks_per_node=walks_per_node, epochs=epochs, bipartite=bipartite, labels=labels, k=k,
+                        seed=seed)
+    try:
+        # The batch engine is single-threaded
+        walks = parallelism(len(pairs), cores)
+        logging.info(f"Sampling the walks of {len(pairs)} (p, q) pairs, {walks['tasks']} at a time")
+        walk_records = _run(_sample, pairs, walks["tasks"])
+        if not train:
+            return pd.DataFrame(walk_records)
+
+        trainings = parallelism(len(configs), cores)
+        _SWEEP_STATE["threads"] = trainings["threads"]
+        logging.info(f"Training {len(configs)} configurations, {trainings['tasks']} at a time "
+                     f"with {trainings['threads']} threads each")
+        records = _run(_train, [(config,) for config in configs], trainings["tasks"])
+    finally:
+        _SWEEP_STATE.clear()
+
+    walk_seconds = {(record["p"], record["q"]): record["walk_seconds"] for record in walk_records}
+    results = pd.DataFrame(records)
+    results.insert(4, "walk_seconds", [walk_seconds[(config.p, config.q)] for config in configs])
+    if "macro_f1" in results:
+        results = results.sort_values("macro_f1", ascending=False, kind="stable")
+    return results
+
+
+def run_sweep(dataloader: DataLoader, configs: Sequence[Config], folder: str, path_labels: Optional[str] = None,
+              **kwargs) -> pd.DataFrame:
+    graph = dataloader.get_graph()
+    labels = create_labels(path_labels) if path_labels is not None else None
+    return sweep(graph, configs, folder, bipartite=dataloader.is_bipartite(), labels=labels, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grid search of the node2vec hyperparameters")
+    parser.add_argument("--type", type=str, default="BlogCatalog", help='Either "Relation" or "BlogCatalog" dataset')
+    parser.add_argument("--input", type=str, default=None, help="Edge file to read instead of the dataset's one")
+    parser.add_argument("--min_like", type=int, default=2)
+    parser.add_argument("--p", type=float, nargs="+", default=[0.25, 1., 4.])
+    parser.add_argument("--q", type=float, nargs="+", default=[0.25, 1., 4.])
+    parser.add_argument("--dim_features", type=int, nargs="+", default=[128])
+    parser.add_argument("--context_size", type=int, nargs="+", default=[10])
+    parser.add_argument("--walk_length", type=int, default=80)
+    parser.add_argument("--walks_per_node", type=int, default=10)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--label", type=str, default=None,
+                        help="Labels to score each run with (default is the BlogCatalog groups for BlogCatalog)")
+    parser.add_argument("--k", type=int, default=10, help="Number of folds of the cross validation")
+    parser.add_argument("--cores", type=int, default=multiprocessing.cpu_count(),
+                        help="Budget of cores shared by the runs of the sweep")
+    parser.add_argument("--save", type=str, default=None, help="Folder of the walks and embeddings of the runs")
+    parser.add_argument("--output", type=str, default="sweep_results.csv", help="Table of the results")
+    parser.add_argument("--no_train", action="store_true", help="Only sample the walks")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    if args.type.lower() in ["relation", "relations"]:
+        folder = RelationsData.FOLDER
+    elif args.type.lower() == "blogcatalog":
+        folder = BlogCatalogData.FOLDER
+        args.label = args.label or BlogCatalogData.LABELS_FILE
+    else:
+        raise NotImplementedError("Other datatypes are not yet impleented")
+
+    dataloader = create_dataloader(folder, args.input, args.min_like, CHUNK_ROWS, None)
+    configs = grid(args.p, args.q, args.dim_features, args.context_size)
+    results = run_sweep(dataloader, configs, args.save or folder, args.label, walk_length=args.walk_length,
+                        walks_per_node=args.walks_per_node, epochs=args.epochs, k=args.k, cores=args.cores,
+                        seed=args.seed, train=not args.no_train)
+    results.to_csv(args.output, index=False)
+    logging.info(f"Results of {len(results)} runs written to {args.output}\n{results.to_string(index=False)}")
+
+
+if __name__ == "__main__":
+    main()
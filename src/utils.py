@@ -1,6 +1,4 @@
-from typing import Dict
-from gensim.test.utils import get_tmpfile
-from gensim.models.callbacks import CallbackAny2Vec
+from typing import Dict, Optional
 import pandas as pd
 import os
 import numpy as np
@@ -42,32 +40,44 @@ class MySentences(object):
             yield line.split()
 
 
-class EpochSaver(CallbackAny2Vec):
-    """Callback to save model after each epoch."""
-
-    def __init__(self, path_prefix):
-        self.path_prefix = path_prefix
-        self.epoch = 0
-
-    def on_epoch_end(self, model):
-        output_path = get_tmpfile('{}_epoch{}.model'.format(self.path_prefix, self.epoch))
-        model.save(output_path)
-        self.epoch += 1
+def generate_graph(n_users: int, n_likes: int, n_edges: int, exponent: Optional[float] = 2.5,
+                   bipartite: bool = True, seed: Optional[int] = None) -> pd.DataFrame:
+    """
+    Random edge list for tests and benchmarks
+    :param exponent: Exponent of the power law of the degrees (2 to 3 for most real graphs),
+    None for uniformly random endpoints
+    :param bipartite: Users and likes have different ids if True, otherwise both columns
+    are drawn from the same n_users + n_likes nodes (without self loops)
+    :return: Dataframe with the user and like columns of RelationsData
+    """
+    rng = np.random.default_rng(seed)
+
+    def endpoints(n_nodes: int, size: int) -> np.ndarray:
+        if exponent is None:
+            return rng.integers(0, n_nodes, size=size)
+        # Zipf-like popularity: sampling proportionally to rank^(-1/(exponent-1)) gives degrees P(k) ~ k^-exponent
+        weights = np.arange(1, n_nodes + 1) ** (-1. / (exponent - 1.))
+        # Ranks are shuffled so the hubs are spread over the ids
+        return rng.permutation(n_nodes)[rng.choice(n_nodes, size=size, p=weights / weights.sum())]
+
+    if bipartite:
+        users = endpoints(n_users, n_edges).astype(str)
+        likes = np.char.add("pageid_", endpoints(n_likes, n_edges).astype(str))
+    else:
+        users, likes = endpoints(n_users + n_likes, n_edges), endpoints(n_users + n_likes, n_edges)
+        users, likes = users[users != likes].astype(str), likes[users != likes].astype(str)
+    return pd.DataFrame({RelationsData.USER_ID: users, RelationsData.LIKE_ID: likes})
 
 
-def create_fake_test_csv():
+def create_fake_test_csv(path_csv: str = os.path.join(RelationsData.FOLDER, "Fake_Big_Relation.csv"),
+                         n_users: int = 10 ** 4, n_likes: int = 10 ** 3, n_edges: int = 10 ** 4,
+                         exponent: Optional[float] = None, bipartite: bool = True, seed: Optional[int] = None):
     """
     For testing purpose/benchmarking speed
     Create dummy csv file with arbitrary number of users/pages
     to benchmark performance
     """
-    user_ids = np.random.randint(0, 10 ** 4, size=10 ** 4)
-    page_ids = np.random.randint(0, 10 ** 3, size=10 ** 4)
-    page_ids = np.array(["pageid_" + str(_id) for _id in page_ids])
-    data = np.stack((user_ids, page_ids), axis=1)
-    pd.DataFrame(
-        data, columns=[RelationsData.USER_ID, RelationsData.LIKE_ID]
-    ).to_csv('../tests/data/Relation/Fake_Big_Relation.csv')
+    generate_graph(n_users, n_likes, n_edges, exponent, bipartite, seed).to_csv(path_csv)
 
 
 if __name__ == "__main__":
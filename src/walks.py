@@ -0,0 +1,335 @@
+import contextlib
+import multiprocessing
+import multiprocessing.pool
+import os
+import queue
+import random
+import shutil
+import threading
+import numpy as np
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import tqdm
+
+from src.config import logging
+from src.corpus import corpus_format, create_walk_corpus, save_counts, NodeCounter, NPY
+from src.data.base import Transitions
+from src.data.graph import Graph
+from src.metrics import metrics
+
+# Walk engines: one walker at a time on the transitions, or all walkers in lockstep with numpy
+PYTHON = "python"
+BATCH = "batch"
+ENGINES = [PYTHON, BATCH]
+
+# Shared with the workers through fork (copy-on-write) instead of being pickled, see walker_pool
+_WORKER_STATE: Dict[str, Any] = {}
+
+
+@contextlib.contextmanager
+def walker_pool(matrix_prob: Transitions, graph: Graph, workers: int) -> Iterator[multiprocessing.pool.Pool]:
+    """
+    Pool of workers forked while the transitions and the graph are shared with them (see walker_state),
+    so they are never pickled: the CSR arrays stay shared, Python objects are copied on write
+    """
+    _WORKER_STATE["matrix_prob"], _WORKER_STATE["graph"] = matrix_prob, graph
+    try:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            yield pool
+    finally:
+        _WORKER_STATE.clear()
+
+
+def walker_state() -> Tuple[Transitions, Graph]:
+    """:return: The transitions and the graph of the walker_pool, in one of its workers"""
+    return _WORKER_STATE["matrix_prob"], _WORKER_STATE["graph"]
+
+
+def random_walk(matrix_prob: Transitions, previous_node: int, length: int) -> List[int]:
+    try:
+        # Actually using the start node as the previous node and randomly sampling a start node
+        possible_starts = list(matrix_prob[previous_node].keys())
+        start_node = random.choice(possible_starts)
+
+        walk = [previous_node, start_node]
+        for _ in range(length - 2):
+            # draw a sample
+            walk.append(matrix_prob[walk[-2]][walk[-1]].sample())
+
+    except KeyError as err:
+        raise KeyError(err)
+
+    return walk
+
+
+def seed_shard(seed: int, shard: int) -> None:
+    """Seed the global random generator with an independent stream for each (seed, shard)"""
+    state = np.random.SeedSequence([seed, shard]).generate_state(4)
+    random.seed(int.from_bytes(state.tobytes(), "little"))
+
+
+def _walk_nodes(path_save: str, matrix_prob: Transitions, graph: Graph, first_node: int, last_node: int,
+                walks_per_node: int, walk_length: int, path_txt: str, progress: bool = False) -> np.ndarray:
+    """
+    Sample the walks starting from nodes [first_node, last_node).
+    A binary corpus at path_save is filled in place (the walk of round r from node n is row r * num_nodes + n),
+    otherwise the walks are written to the text file path_txt.
+    :return: Occurrences of each node in the walks
+    """
+    rounds = tqdm.trange(walks_per_node, desc="Random walk") if progress else range(walks_per_node)
+    counter = NodeCounter(graph.num_nodes)
+    if corpus_format(path_save) == NPY:
+        corpus = np.load(path_save, mmap_mode='r+')
+        for walk_round in rounds:
+            for node in range(first_node, last_node):
+                walk = random_walk(matrix_prob, node, walk_length)
+                corpus[walk_round * graph.num_nodes + node] = walk
+                counter.add(walk)
+        corpus.flush()
+        return counter.flush()
+
+    with open(path_txt, 'w', encoding='utf-8') as f_txt:
+        for _ in rounds:
+            for node in range(first_node, last_node):
+                walk = random_walk(matrix_prob, node, walk_length)
+                # Walks are sampled on node codes, original ids are only written to the file
+                f_txt.write(" ".join(graph.decode(walk)) + '\n')
+                counter.add(walk)
+    return counter.flush()
+
+
+def _walk_shard(shard: int, path_save: str, first_node: int, last_node: int,
+                walks_per_node: int, walk_length: int, seed: int) -> np.ndarray:
+    matrix_prob, graph = walker_state()
+    seed_shard(seed, shard)
+    return _walk_nodes(path_save, matrix_prob, graph, first_node, last_node, walks_per_node, walk_length,
+                       shard_path(path_save, shard))
+
+
+def shard_path(path_save: str, shard: int) -> str:
+    return f"{path_save}.shard{shard}"
+
+
+def sample_walks(path_save: str, matrix_prob: Transitions, graph: Graph,
+                 walks_per_node: int = 10, walk_length: int = 80,
+                 workers: int = 1, seed: Optional[int] = None):
+    """
+    Sample walks_per_node walks from every node and write them to path_save,
+    one walk per line, or as a binary corpus if path_save ends with .npy
+    :param workers: Number of processes. With more than one, the start nodes are split in one shard per worker,
+    each shard uses its own random stream (derived from seed) and is written to its own file before being merged
+    :param seed: Makes the walks reproducible for a given number of workers
+    The occurrences of each node in the walks are saved next to the corpus (see save_counts)
+    """
+    if corpus_format(path_save) == NPY:
+        create_walk_corpus(path_save, graph.nodes, walks_per_node * graph.num_nodes, walk_length)
+    count_walks(walks_per_node * graph.num_nodes, walk_length)
+
+    if workers > 1:
+        counts = _sample_walks_parallel(path_save, matrix_prob, graph, walks_per_node, walk_length, workers, seed)
+    else:
+        if seed is not None:
+            seed_shard(seed, 0)
+        counts = _walk_nodes(path_save, matrix_prob, graph, 0, graph.num_nodes, walks_per_node, walk_length,
+                             path_save, progress=True)
+    save_counts(path_save, graph.nodes, counts, walks_per_node * graph.num_nodes)
+
+
+def count_walks(n_walks: int, walk_length: int) -> None:
+    metrics.count("walks", n_walks)
+    # Each step samples one transition
+    metrics.count("steps", n_walks * (walk_length - 1))
+
+
+def _sample_walks_parallel(path_save: str, matrix_prob: Transitions, graph: Graph,
+                           walks_per_node: int, walk_length: int, workers: int, seed: Optional[int]) -> np.ndarray:
+    """
+    Workers are forked so they read the graph and transitions of the parent without pickling them
+    (the CSR arrays stay shared, Python objects are copied on write).
+    Binary corpora are filled in place by the workers, text shards are concatenated at the end.
+    :return: Occurrences of each node in the walks of all the shards
+    """
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    bounds = np.linspace(0, graph.num_nodes, workers + 1).astype(int)
+    tasks = [
+        (shard, path_save, bounds[shard], bounds[shard + 1], walks_per_node, walk_length, seed)
+        for shard in range(workers)
+    ]
+
+    counts = np.zeros(graph.num_nodes, dtype=np.int64)
+    with walker_pool(matrix_prob, graph, workers) as pool:
+        for shard_counts in tqdm.tqdm(pool.imap_unordered(_star_walk_shard, tasks), total=workers,
+                                      desc="Random walk"):
+            counts += shard_counts
+
+    if corpus_format(path_save) == NPY:
+        return counts
+    logging.info(f"Merging {workers} shards into {path_save}")
+    with open(path_save, 'wb') as f_out:
+        for shard in range(workers):
+            with open(shard_path(path_save, shard), 'rb') as f_shard:
+                shutil.copyfileobj(f_shard, f_out)
+            os.remove(shard_path(path_save, shard))
+    return counts
+
+
+def _star_walk_shard(args) -> np.ndarray:
+    return _walk_shard(*args)
+
+
+def batch_random_walks(graph: Graph, starts: np.ndarray, p: float, q: float, walk_length: int,
+                       rng: np.random.Generator, bipartite: bool = False) -> np.ndarray:
+    """
+    Walk from all the start nodes in lockstep: each iteration takes one step for the whole batch with numpy.
+    Biased steps use rejection sampling (a uniform neighbor is accepted with probability weight / bound),
+    except for bipartite graphs where "go back" or "uniform other neighbor" is drawn directly.
+    :return: int32 matrix of shape (len(starts), walk_length)
+    """
+    indptr, indices = graph.indptr, graph.indices
+    degrees = graph.degrees()
+    walks = np.empty((len(starts), walk_length), dtype=np.int32)
+    walks[:, 0] = starts
+    if walk_length == 1:
+        return walks
+    # The first step is uniform
+    walks[:, 1] = indices[indptr[starts] + (rng.random(len(starts)) * degrees[starts]).astype(np.int64)]
+
+    weight_back, weight_out = 1 / p, 1 / q
+    # The return edge is folded out of the rejection area so a small p doesn't lower the acceptance rate
+    bound = max(1., weight_out)
+    weight_folded = max(weight_back - bound, 0.)
+
+    for step in range(2, walk_length):
+        previous, current = walks[:, step - 2], walks[:, step - 1]
+        lo, degree = indptr[current], degrees[current]
+
+        if bipartite:
+            go_back = rng.random(len(current)) * (weight_back + (degree - 1) * weight_out) < weight_back
+            others = np.maximum(degree - 1, 1)
+            candidates = indices[lo + (rng.random(len(current)) * others).astype(np.int64)]
+            # Uniform among the other neighbors: if we draw previous, take the last neighbor instead
+            candidates = np.where(candidates == previous, indices[lo + degree - 1], candidates)
+            walks[:, step] = np.where(go_back, previous, candidates)
+            continue
+
+        pending = np.arange(len(current))
+        while len(pending) > 0:
+            prev, lo_pending, deg = previous[pending], lo[pending], degree[pending]
+            # Uniform over an area of deg * bound, plus the folded part of the return edge
+            area = rng.random(len(pending)) * (deg * bound + weight_folded)
+            in_folded = area >= deg * bound
+            candidates = indices[lo_pending + np.minimum(area // bound, deg - 1).astype(np.int64)]
+
+            weights = np.where(graph.has_edges(prev, candidates), 1., weight_out)
+            weights[candidates == prev] = min(weight_back, bound)
+
+            accept = in_folded | (rng.random(len(pending)) * bound < weights)
+            candidates[in_folded] = prev[in_folded]
+            walks[pending[accept], step] = candidates[accept]
+            pending = pending[~accept]
+    return walks
+
+
+def iter_batch_walks(graph: Graph, p: float, q: float, walks_per_node: int = 10, walk_length: int = 80,
+                     batch_size: int = 10000, seed: Optional[int] = None,
+                     bipartite: bool = False) -> Iterator[np.ndarray]:
+    """Yield the walks of sample_walks as int32 matrices of at most batch_size walks"""
+    rng = np.random.default_rng(seed)
+    for _ in range(walks_per_node):
+        for first_node in range(0, graph.num_nodes, batch_size):
+            starts = np.arange(first_node, min(first_node + batch_size, graph.num_nodes), dtype=np.int32)
+            yield batch_random_walks(graph, starts, p, q, walk_length, rng, bipartite)
+
+
+def sample_walks_batch(path_save: str, graph: Graph, p: float, q: float,
+                       walks_per_node: int = 10, walk_length: int = 80,
+                       batch_size: int = 10000, seed: Optional[int] = None, bipartite: bool = False):
+    """Same output as sample_walks, with the vectorized engine"""
+    n_batches = walks_per_node * -(-graph.num_nodes // batch_size)
+    count_walks(walks_per_node * graph.num_nodes, walk_length)
+    batches = tqdm.tqdm(iter_batch_walks(graph, p, q, walks_per_node, walk_length, batch_size, seed, bipartite),
+                        total=n_batches, desc="Random walk (batch)")
+    counter = NodeCounter(graph.num_nodes)
+    if corpus_format(path_save) == NPY:
+        corpus = create_walk_corpus(path_save, graph.nodes, walks_per_node * graph.num_nodes, walk_length)
+        first_walk = 0
+        for walks in batches:
+            corpus[first_walk:first_walk + len(walks)] = walks
+            first_walk += len(walks)
+            counter.add_walks(walks)
+        corpus.flush()
+    else:
+        with open(path_save, 'w', encoding='utf-8') as f_txt:
+            for walks in batches:
+                for walk in graph.nodes[walks]:
+                    f_txt.write(" ".join(walk) + '\n')
+                counter.add_walks(walks)
+    save_counts(path_save, graph.nodes, counter.counts, walks_per_node * graph.num_nodes)
+
+
+class WalkStream:
+    """
+    Restartable iterable of walks sampled on the fly with the batch engine, to feed Word2Vec without a corpus file.
+    While the consumer reads (and trains on) a batch, a producer thread samples the next ones
+    into a bounded queue, so walking overlaps with training and memory stays bounded.
+    Each pass over the stream samples new walks (pass i is reproducible with a seed).
+    """
+
+    def __init__(self, graph: Graph, p: float, q: float, walks_per_node: int = 10, walk_length: int = 80,
+                 batch_size: int = 10000, seed: Optional[int] = None, bipartite: bool = False,
+                 queue_size: int = 8):
+        self.graph = graph
+        self.p = p
+        self.q = q
+        self.walks_per_node = walks_per_node
+        self.walk_length = walk_length
+        self.batch_size = batch_size
+        self.seed = random.randrange(2 ** 32) if seed is None else seed
+        self.bipartite = bipartite
+        self.queue_size = queue_size
+        self.passes = 0
+
+    def __len__(self) -> int:
+        return self.walks_per_node * self.graph.num_nodes
+
+    def __iter__(self) -> Iterator[List[str]]:
+        batches: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        stop = threading.Event()
+        seed = int(np.random.SeedSequence([self.seed, self.passes]).generate_state(1)[0])
+        self.passes += 1
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for walks in iter_batch_walks(self.graph, self.p, self.q, self.walks_per_node, self.walk_length,
+                                              self.batch_size, seed, self.bipartite):
+                    if not put(self.graph.nodes[walks]):
+                        return
+                put(None)
+            except Exception as err:
+                put(err)
+
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            while True:
+                tokens = batches.get()
+                if tokens is None:
+                    break
+                if isinstance(tokens, Exception):
+                    raise tokens
+                count_walks(len(tokens), self.walk_length)
+                for walk in tokens:
+                    yield walk.tolist()
+        finally:
+            # Also stops the producer if the consumer doesn't read the whole pass
+            stop.set()
+            producer.join()
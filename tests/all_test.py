@@ -1,11 +1,54 @@
 import unittest
+import json
 import os
 import time
+import tempfile
+import tracemalloc
+import multiprocessing
+from collections import Counter
+import gensim
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+from sklearn.multiclass import OneVsRestClassifier
 
-from src.learn_features import random_walk, preparing_samples
+from src.learn_features import create_dataloader, optimize, preparing_samples, updating_samples, CORPUS_FILE, \
+    ITERATOR, RESUME, TRAIN
+from src.embeddings import load_embeddings, save_embeddings, EMBEDDING_FORMATS
+from src.multilabel_blogCatalog import create_features, create_labels, k_fold_average, top_labels
+from src.sweep import grid, parallelism, sweep, walks_path
+from src.checkpoint import manifest_path, sample_walks_resumable, snapshot_model, work_units, TrainingCheckpointer
+from src.query import IVFIndex, NearestNeighbors, recall, LIKES, USERS
+from src.benchmark import benchmark_queries, compare_results, run_suite, write_edge_files
+from src.metrics import metrics, CPROFILE, TRACEMALLOC
+from src.incremental import add_edges, load_graph, resample_walks, update_corpus, update_transitions, \
+    walk_transitions
+from src.walks import random_walk, sample_walks, batch_random_walks, sample_walks_batch, WalkStream, BATCH
 from src.config import RelationsData, logging
-from src.utils import prob_distribution_from_dict
+from src.utils import generate_graph, prob_distribution_from_dict
 from src.data.relations import RelationsDataLoader
+from src.data.edgefile import EdgeFileDataLoader
+from src.data.ingest import pyarrow_available, CSV, FEATHER, NPY, PARQUET
+from src.corpus import WalkCorpus, corpus_to_text, counts_path, load_counts, load_sentences, remove_counts, \
+    vocab_path, write_vocab
+from src.data.alias import AliasSampler, alias_row, capped_weights, hub_neighbors
+from src.data.cache import TransitionCache
+from src.data.transitions import BipartiteTransitions
+from src.data.base import DataLoader, ALIAS, BIPARTITE, LAZY, FULL
+from src.data.planner import estimate_memory, format_plan, graph_bytes, plan_strategy, Estimate
+from src.data.weighted_dict import WeightedDict
+
+# The training uses the gensim 3.8 API of requirements.txt (size, iter, wv.vocab)
+GENSIM_3 = int(gensim.__version__.split(".")[0]) < 4
+
+
+class SynchronousCheckpointer(TrainingCheckpointer):
+    """Waits for each checkpoint at the end of its epoch, so that none is skipped"""
+
+    def on_epoch_end(self, model):
+        super().on_epoch_end(model)
+        while self._writing.is_set():
+            time.sleep(0.01)
 
 
 class UtilsTest(unittest.TestCase):
@@ -16,9 +59,10 @@ class UtilsTest(unittest.TestCase):
             "q": 0.5,
             "p": 2
         }
-        self.dict_probs, self.all_nodes = self.dataloader.get_transition_probabilites(
-            self.PARAMETERS["p"], q=self.PARAMETERS["q"]
+        self.dict_probs, self.graph = self.dataloader.get_transition_probabilites(
+            self.PARAMETERS["p"], q=self.PARAMETERS["q"], strategy=FULL
         )
+        self.index = self.graph.index
 
     def test_neighbors(self):
 
@@ -28,12 +72,12 @@ class UtilsTest(unittest.TestCase):
                 self.assertTrue(previous in neighbors.keys())
 
         # Use our prior knowledge abour Relation.csv to make sure this make sense
-        neighbors = self.dict_probs["user1"]["page1"]
-        self.assertTrue("user2" in neighbors.keys())
-        self.assertTrue("user6" in neighbors.keys())
+        neighbors = self.dict_probs[self.index["user1"]][self.index["page1"]]
+        self.assertTrue(self.index["user2"] in neighbors.keys())
+        self.assertTrue(self.index["user6"] in neighbors.keys())
         self.assertTrue(len(neighbors) == 3)
 
-        neighbors = self.dict_probs["user2"]["page4"]
+        neighbors = self.dict_probs[self.index["user2"]][self.index["page4"]]
         self.assertTrue(len(neighbors) == 1)
 
     def test_random_walk(self):
@@ -47,13 +91,13 @@ class UtilsTest(unittest.TestCase):
         }
 
         length = 10
-        walk = random_walk(self.dict_probs, "page4", length)
+        walk = random_walk(self.dict_probs, self.index["page4"], length)
         self.assertEqual(len(walk), length)
 
         length = 3
         for i in range(10000):
-            walk = random_walk(self.dict_probs, "page4", length)
-            mc_estimate[walk[-1]] += 1
+            walk = random_walk(self.dict_probs, self.index["page4"], length)
+            mc_estimate[self.graph.nodes[walk[-1]]] += 1
 
         mc_estimate = prob_distribution_from_dict(mc_estimate)
         real_prob_distribution = {
@@ -65,9 +109,906 @@ class UtilsTest(unittest.TestCase):
         for key in mc_estimate.keys():
             self.assertAlmostEqual(mc_estimate[key], real_prob_distribution[key], places=1)
 
+    def test_alias_tables(self):
+        alias_probs, _ = self.dataloader.get_transition_probabilites(
+            self.PARAMETERS["p"], q=self.PARAMETERS["q"], strategy=ALIAS
+        )
+        for previous, possible_starts in self.dict_probs.items():
+            self.assertEqual(set(alias_probs[previous].keys()), set(possible_starts.keys()))
+            for start, neighbors in possible_starts.items():
+                sampler = alias_probs[previous][start]
+                self.assertEqual(sorted(sampler.keys()), sorted(neighbors.keys()))
+                weights = np.array([neighbors[key] for key in sampler.keys()])
+                np.testing.assert_allclose(sampler.probabilities(), weights / weights.sum(), rtol=1e-5)
+
+        walk = random_walk(alias_probs, self.index["page4"], 10)
+        self.assertEqual(len(walk), 10)
+
+    def test_degree_cap(self):
+        graph = RelationsDataLoader(self.path_big_csv, min_like=1).get_graph()
+        exact, _ = self.dataloader.get_transition_probabilites(1., 1., strategy=FULL, max_degree=1000)
+        self.assertEqual(exact.keys(), self.dict_probs.keys())
+        for previous, possible_starts in self.dict_probs.items():
+            for start, neighbors in possible_starts.items():
+                self.assertEqual(exact[previous][start].keys(), neighbors.keys())
+
+        max_degree = 5
+        hubs = hub_neighbors(graph, max_degree, seed=0)
+        self.assertTrue(hubs)
+        self.assertTrue(all(len(sample) == max_degree for sample in hubs.values()))
+        p, q = self.PARAMETERS["p"], self.PARAMETERS["q"]
+        for start in list(hubs)[:20]:
+            previous = int(graph.neighbors(start)[0])
+            row = alias_row(graph, previous, p, q, hubs)
+            sampler = row[start]
+            self.assertLessEqual(len(sampler), max_degree + 1)
+            self.assertIn(previous, sampler)
+            self.assertTrue(set(sampler.keys()) <= set(graph.neighbors(start).tolist()))
+            # With p = q = 1 the sample stands for the degree - 1 other neighbors
+            nodes, weights = capped_weights(graph, previous, start, 1., 1., hubs[start])
+            self.assertEqual(nodes[0], previous)
+            self.assertAlmostEqual(weights.sum(), graph.degrees()[start])
+            self.assertEqual(weights[0], 1.)
+            nodes, weights = capped_weights(graph, previous, start, p, q, hubs[start])
+            self.assertEqual(weights[0], 1. / p)
+            self.assertEqual(sorted(sampler.keys()), sorted(nodes.tolist()))
+            np.testing.assert_allclose(sampler.probabilities()[np.argsort(sampler.keys())],
+                                       (weights / weights.sum())[np.argsort(nodes)], rtol=1e-5)
+
+    def test_lazy_transitions(self):
+        lazy_probs, _ = self.dataloader.get_transition_probabilites(
+            self.PARAMETERS["p"], q=self.PARAMETERS["q"], strategy=LAZY
+        )
+        for previous, possible_starts in self.dict_probs.items():
+            self.assertEqual(set(lazy_probs[previous].keys()), set(possible_starts.keys()))
+            for start, neighbors in possible_starts.items():
+                lazy_neighbors = lazy_probs[previous][start]
+                self.assertEqual(sorted(lazy_neighbors.keys()), sorted(neighbors.keys()))
+                for key in neighbors.keys():
+                    self.assertAlmostEqual(lazy_neighbors[key], neighbors[key])
+
+        # Rejection sampling must give the same distribution as the precomputed tables
+        user1, page1 = self.index["user1"], self.index["page1"]
+        counts = {key: 0 for key in lazy_probs[user1][page1].keys()}
+        for _ in range(10000):
+            counts[lazy_probs[user1][page1].sample()] += 1
+        weights = {key: self.dict_probs[user1][page1][key] for key in counts}
+        real_prob_distribution = prob_distribution_from_dict(weights)
+        mc_estimate = prob_distribution_from_dict(counts)
+        for key in counts:
+            self.assertAlmostEqual(mc_estimate[key], real_prob_distribution[key], places=1)
+
+    def test_bipartite_transitions(self):
+        self.assertTrue(self.dataloader.is_bipartite())
+        bipartite_probs, _ = self.dataloader.get_transition_probabilites(
+            self.PARAMETERS["p"], q=self.PARAMETERS["q"]
+        )
+        self.assertIsInstance(bipartite_probs, BipartiteTransitions)
+
+        for previous, possible_starts in self.dict_probs.items():
+            for start, neighbors in possible_starts.items():
+                counts = {key: 0 for key in neighbors.keys()}
+                for _ in range(2000):
+                    counts[bipartite_probs[previous][start].sample()] += 1
+                real_prob_distribution = prob_distribution_from_dict({key: neighbors[key] for key in counts})
+                mc_estimate = prob_distribution_from_dict(counts)
+                for key in counts:
+                    self.assertAlmostEqual(mc_estimate[key], real_prob_distribution[key], places=1)
+
+    def test_parallel_walks(self):
+        path_save_sentences = os.path.join(RelationsData.FOLDER, "test_parallel.txt")
+        walks_per_node, walk_length = 500, 3
+        sample_walks(path_save_sentences, self.dict_probs, self.graph, walks_per_node, walk_length, workers=3, seed=0)
+        with open(path_save_sentences, encoding='utf-8') as f:
+            walks = [line.split() for line in f]
+        sample_walks(path_save_sentences, self.dict_probs, self.graph, walks_per_node, walk_length, workers=3, seed=0)
+        with open(path_save_sentences, encoding='utf-8') as f:
+            self.assertEqual(walks, [line.split() for line in f])
+        os.remove(path_save_sentences)
+        remove_counts(path_save_sentences)
+
+        # Every node starts the same number of walks, as with a single process
+        self.assertEqual(len(walks), walks_per_node * self.graph.num_nodes)
+        starts = {walk[0] for walk in walks}
+        self.assertEqual(starts, set(self.graph.nodes.tolist()))
+
+        mc_estimate = {"page4": 0, "page1": 0, "page2": 0}
+        for walk in walks:
+            if walk[0] == "page4":
+                mc_estimate[walk[-1]] += 1
+        mc_estimate = prob_distribution_from_dict(mc_estimate)
+        real_prob_distribution = prob_distribution_from_dict({
+            "page4": 1 / self.PARAMETERS["p"],
+            "page1": 1 / self.PARAMETERS["q"],
+            "page2": 1 / self.PARAMETERS["q"]
+        })
+        for key in mc_estimate.keys():
+            self.assertAlmostEqual(mc_estimate[key], real_prob_distribution[key], places=1)
+
+    def test_resumable_walks(self):
+        class Interrupted(dict):
+            """Transitions of a job killed after a number of steps"""
+            def __init__(self, transitions, steps):
+                super().__init__(transitions)
+                self.steps = steps
+
+            def __getitem__(self, key):
+                self.steps -= 1
+                if self.steps < 0:
+                    raise RuntimeError("Interrupted")
+                return super().__getitem__(key)
+
+        walks_per_node, walk_length, unit_nodes = 3, 4, 3
+        n_units = len(work_units(self.graph.num_nodes, walks_per_node, unit_nodes))
+        with tempfile.TemporaryDirectory() as folder:
+            for extension in ["txt", "npy"]:
+                path = os.path.join(folder, "walks." + extension)
+                sample_walks_resumable(path, self.dict_probs, self.graph, walks_per_node, walk_length,
+                                       seed=0, unit_nodes=unit_nodes)
+                expected = list(load_sentences(path))
+                self.assertEqual(len(expected), walks_per_node * self.graph.num_nodes)
+                self.assertFalse(os.path.exists(manifest_path(path)))
+                os.remove(path)
+
+                with self.assertRaises(RuntimeError):
+                    sample_walks_resumable(path, Interrupted(self.dict_probs, 40), self.graph, walks_per_node,
+                                           walk_length, seed=0, unit_nodes=unit_nodes)
+                with open(manifest_path(path)) as f_manifest:
+                    completed = json.load(f_manifest)["completed"]
+                self.assertTrue(0 < len(completed) < n_units)
+
+                # The restart only samples the missing units, and gets the walks of an uninterrupted job
+                metrics.reset()
+                sample_walks_resumable(path, self.dict_probs, self.graph, walks_per_node, walk_length,
+                                       workers=2, unit_nodes=unit_nodes)
+                self.assertLess(metrics.counters["walks"], len(expected))
+                self.assertEqual(list(load_sentences(path)), expected)
+                self.assertFalse(os.path.exists(manifest_path(path)))
+
+            # Only the python engine samples in work units
+            with self.assertRaises(ValueError):
+                preparing_samples(self.dataloader, 1., 1., walk_length, walks_per_node, 2,
+                                  os.path.join(folder, "walks.txt"), engine=BATCH, unit_nodes=unit_nodes)
+
+    def test_training_checkpoints(self):
+        # Built without training, with the same API in all the supported gensim versions
+        model = gensim.models.Word2Vec(min_count=1)
+        model.build_vocab([["a", "b", "c"], ["b", "c", "d"]])
+        snapshot = snapshot_model(model)
+        vectors = model.wv.vectors.copy()
+        model.wv.vectors += 1
+        np.testing.assert_array_equal(snapshot.wv.vectors, vectors)
+        # Nothing that save() modifies is shared with the training
+        self.assertIsNot(snapshot.wv, model.wv)
+        for name in ["vocabulary", "trainables"]:
+            if hasattr(model, name):
+                self.assertIsNot(getattr(snapshot, name), getattr(model, name))
+
+        with tempfile.TemporaryDirectory() as folder:
+            def train(checkpointer, epochs):
+                checkpointer.on_train_begin(model)
+                for _ in range(epochs):
+                    checkpointer.on_epoch_end(model)
+                    # Wait for each write, so no checkpoint is skipped
+                    while checkpointer._writing.is_set():
+                        time.sleep(0.01)
+
+            checkpointer = TrainingCheckpointer(folder, every_epochs=2, keep=2)
+            self.assertIsNone(checkpointer.latest())
+            checkpointer.begin(7)
+            train(checkpointer, 7)
+            checkpointer.on_train_end(model)
+            self.assertEqual([epoch for epoch, _ in checkpointer.checkpoints()], [4, 6])
+            # Complete, even if its last epoch has no checkpoint
+            self.assertIsNone(TrainingCheckpointer(folder).interrupted())
+
+            # Arrays saved beside a checkpoint are pruned with it
+            with open(checkpointer.path(4) + ".wv.vectors.npy", "w"):
+                pass
+            # A new training is numbered after the older checkpoints, which are pruned first
+            checkpointer = TrainingCheckpointer(folder, every_epochs=2, keep=2)
+            checkpointer.begin(5)
+            train(checkpointer, 4)
+            # Interrupted: the writer stops without on_train_end
+            checkpointer._queue.put(None)
+            checkpointer._thread.join()
+            self.assertEqual([epoch for epoch, _ in checkpointer.checkpoints()], [8, 10])
+            self.assertEqual(TrainingCheckpointer(folder).interrupted(), (checkpointer.latest(), 1))
+            self.assertEqual(sorted(os.listdir(folder)),
+                             ["checkpoint_epoch10.model", "checkpoint_epoch8.model", "run.json"])
+            loaded = gensim.models.Word2Vec.load(checkpointer.latest()[1])
+            np.testing.assert_array_equal(loaded.wv.vectors, model.wv.vectors)
+            # The callback is saved with the model
+            model.callbacks = (checkpointer,)
+            model.save(os.path.join(folder, "final.model"))
+
+    @unittest.skipUnless(GENSIM_3, "needs gensim 3.8")
+    def test_resume_training(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "walks.txt")
+            sample_walks(path, self.dict_probs, self.graph, 5, 6, seed=0)
+            like_nodes = self.dataloader.list_like_nodes()
+            checkpoints = os.path.join(folder, "checkpoints")
+
+            def train(mode, epochs, path_model=None):
+                checkpointer = SynchronousCheckpointer(checkpoints, every_epochs=1)
+                model = optimize(path, like_nodes, mode, None, epochs, context_size=2, dim_features=8,
+                                 path_model=path_model, workers=1, checkpointer=checkpointer)
+                return model, checkpointer
+
+            model, checkpointer = train(TRAIN, 3)
+            self.assertEqual([epoch for epoch, _ in checkpointer.checkpoints()], [2, 3])
+            self.assertIsNone(checkpointer.interrupted())
+            # The checkpoint of the last epoch is the trained model
+            loaded = gensim.models.Word2Vec.load(checkpointer.latest()[1])
+            self.assertEqual(loaded.wv.index2word, model.wv.index2word)
+            np.testing.assert_array_equal(loaded.wv.vectors, model.wv.vectors)
+            np.testing.assert_array_equal(loaded.trainables.syn1neg, model.trainables.syn1neg)
+            self.assertEqual(loaded.min_alpha_yet_reached, model.min_alpha_yet_reached)
+
+            # A training of 4 epochs from epoch 1 stopped after its checkpoint of epoch 3: 2 epochs are left
+            TrainingCheckpointer(checkpoints).begin(4, 1)
+            self.assertEqual(TrainingCheckpointer(checkpoints).interrupted(), (checkpointer.latest(), 2))
+            model, checkpointer = train(RESUME, 10)
+            self.assertEqual([epoch for epoch, _ in checkpointer.checkpoints()], [4, 5])
+            self.assertIsNone(checkpointer.interrupted())
+
+            # Nothing interrupted: the newest checkpoint is trained for more epochs, a model if given
+            model, checkpointer = train(RESUME, 1)
+            self.assertEqual([epoch for epoch, _ in checkpointer.checkpoints()], [5, 6])
+            path_model = os.path.join(folder, "word2vec.model")
+            model.save(path_model)
+            model, checkpointer = train(RESUME, 1, path_model)
+            self.assertEqual([epoch for epoch, _ in checkpointer.checkpoints()], [6, 7])
+
+            with self.assertRaises(ValueError):
+                optimize(path, like_nodes, RESUME, None, 1, checkpointer=TrainingCheckpointer(
+                    os.path.join(folder, "empty")))
+
+    @unittest.skipUnless(GENSIM_3, "needs gensim 3.8")
+    def test_training_inputs(self):
+        like_nodes = self.dataloader.list_like_nodes()
+
+        def train(corpus, input_mode=ITERATOR):
+            return optimize(corpus, like_nodes, TRAIN, None, epochs=1, context_size=2, dim_features=8,
+                            input_mode=input_mode, workers=1)
+
+        def vocabulary(model):
+            return {node: vocab.count for node, vocab in model.wv.vocab.items()}
+
+        def scan(walks):
+            # The vocabulary a pass over the corpus builds, with the min_count of optimize
+            counts = Counter(node for walk in walks for node in walk)
+            return {node: count for node, count in counts.items() if count >= 2}
+
+        with tempfile.TemporaryDirectory() as folder:
+            for extension in ["txt", "npy"]:
+                path = os.path.join(folder, f"walks.{extension}")
+                sample_walks(path, self.dict_probs, self.graph, 5, 6, seed=0)
+                walks = list(load_sentences(path))
+                # From the node counts of the walks, then from a pass over the corpus
+                for counted in [True, False]:
+                    self.assertEqual(load_counts(path) is not None, counted)
+                    for input_mode in [ITERATOR, CORPUS_FILE]:
+                        model = train(path, input_mode)
+                        self.assertEqual(vocabulary(model), scan(walks))
+                        self.assertEqual(model.corpus_count, len(walks))
+                        self.assertEqual(model.corpus_total_words, sum(len(walk) for walk in walks))
+                    remove_counts(path)
+
+            # The vocabulary of a stream comes from its first pass
+            model = train(WalkStream(self.graph, 2., 0.5, 5, 6, batch_size=7, seed=0))
+            self.assertEqual(vocabulary(model), scan(WalkStream(self.graph, 2., 0.5, 5, 6, batch_size=7, seed=0)))
+            self.assertEqual(model.corpus_count, 5 * self.graph.num_nodes)
+
+    def test_node_counts(self):
+        walks_per_node, walk_length = 5, 6
+        engines = {
+            "serial": lambda path: sample_walks(path, self.dict_probs, self.graph, walks_per_node, walk_length),
+            "parallel": lambda path: sample_walks(path, self.dict_probs, self.graph, walks_per_node, walk_length,
+                                                  workers=2),
+            "batch": lambda path: sample_walks_batch(path, self.graph, 2., 0.5, walks_per_node, walk_length),
+            "resumable": lambda path: sample_walks_resumable(path, self.dict_probs, self.graph, walks_per_node,
+                                                             walk_length, unit_nodes=3),
+        }
+        with tempfile.TemporaryDirectory() as folder:
+            for extension in ["txt", "npy"]:
+                for engine, sample in engines.items():
+                    path = os.path.join(folder, f"{engine}.{extension}")
+                    sample(path)
+                    # Same counts as a pass over the corpus
+                    counts = load_counts(path)
+                    walks = list(load_sentences(path))
+                    self.assertEqual(counts.counts, dict(Counter(node for walk in walks for node in walk)))
+                    self.assertEqual(counts.walks, len(walks))
+                    self.assertEqual(counts.words, len(walks) * walk_length)
+
+            # Counts of another version of the corpus are ignored, even one of the same size
+            self.assertNotEqual(counts_path(path), counts_path(os.path.join(folder, "resumable.txt")))
+            with open(counts_path(path)) as f:
+                saved = f.read()
+            time.sleep(0.01)
+            engines["batch"](path)
+            with open(counts_path(path), 'w') as f:
+                f.write(saved)
+            self.assertIsNone(load_counts(path))
+            engines["batch"](path)
+            with open(path, 'ab') as f:
+                f.write(b"0")
+            self.assertIsNone(load_counts(path))
+
+    def test_binary_corpus(self):
+        path_txt = os.path.join(RelationsData.FOLDER, "test_corpus.txt")
+        path_npy = os.path.join(RelationsData.FOLDER, "test_corpus.npy")
+        for workers in [1, 2]:
+            sample_walks(path_txt, self.dict_probs, self.graph, 3, 10, workers=workers, seed=0)
+            sample_walks(path_npy, self.dict_probs, self.graph, 3, 10, workers=workers, seed=0)
+            with open(path_txt, encoding='utf-8') as f:
+                walks_txt = [line.split() for line in f]
+            corpus = WalkCorpus(path_npy)
+            self.assertEqual(corpus.walks.dtype, np.uint32)
+            self.assertEqual(corpus.walks.shape, (3 * self.graph.num_nodes, 10))
+            # Same walks, the binary corpus is ordered by round then start node
+            self.assertEqual(sorted(walks_txt), sorted(corpus))
+            if workers == 1:
+                self.assertEqual(walks_txt, list(corpus))
+                # LineSentence version of the binary corpus, for gensim's corpus_file, next to the text corpus
+                path_converted = corpus_to_text(path_npy)
+                self.assertEqual(path_converted, path_npy + ".txt")
+                with open(path_converted, encoding='utf-8') as f:
+                    self.assertEqual(walks_txt, [line.split() for line in f])
+                # Reused until the binary corpus changes
+                converted_at = os.stat(path_converted).st_mtime_ns
+                self.assertEqual(corpus_to_text(path_npy), path_converted)
+                self.assertEqual(os.stat(path_converted).st_mtime_ns, converted_at)
+                os.utime(path_npy, (time.time() + 10, time.time() + 10))
+                corpus_to_text(path_npy)
+                self.assertNotEqual(os.stat(path_converted).st_mtime_ns, converted_at)
+                os.remove(path_converted)
+
+        sample_walks_batch(path_npy, self.graph, 1., 1., 3, 10, batch_size=4)
+        corpus = WalkCorpus(path_npy)
+        self.assertEqual(len(corpus), 3 * self.graph.num_nodes)
+        self.assertEqual([walk[0] for walk in corpus], self.graph.nodes.tolist() * 3)
+        for path in [path_txt, path_npy, vocab_path(path_npy)]:
+            os.remove(path)
+            remove_counts(path)
+
+    def test_walk_stream(self):
+        stream = WalkStream(self.graph, 1., 1., walks_per_node=5, walk_length=10, batch_size=3, seed=0,
+                            bipartite=True, queue_size=2)
+        first_pass, second_pass = list(stream), list(stream)
+        self.assertEqual(len(first_pass), len(stream))
+        self.assertEqual(len(stream), 5 * self.graph.num_nodes)
+        self.assertTrue(all(len(walk) == 10 for walk in first_pass))
+        self.assertEqual([walk[0] for walk in first_pass], self.graph.nodes.tolist() * 5)
+        # Each pass samples new walks, reproducible with the same seed
+        self.assertNotEqual(first_pass, second_pass)
+        self.assertEqual(first_pass, list(WalkStream(self.graph, 1., 1., 5, 10, batch_size=3, seed=0, bipartite=True)))
+
+        # Stopping in the middle of a pass must not block the producer
+        for i, _ in enumerate(stream):
+            if i == 2:
+                break
+
+    def test_batch_walks(self):
+        # Small graph with a triangle (a, b, c) so that all three weights 1/p, 1 and 1/q are used
+        df = pd.DataFrame({"col1": ["a", "a", "b", "c", "c"], "col2": ["b", "c", "c", "d", "e"]})
+        dataloader = DataLoader(df, "col1", "col2")
+        p, q = 0.5, 2.
+        dict_probs, graph = dataloader.get_transition_probabilites(p, q, strategy=FULL)
+        rng = np.random.default_rng(0)
+        for bipartite, graph_probs, start in [(False, dict_probs, "a"), (True, self.dict_probs, "page1")]:
+            if bipartite:
+                graph = self.graph
+                p, q = self.PARAMETERS["p"], self.PARAMETERS["q"]
+            starts = np.full(20000, graph.index[start], dtype=np.int32)
+            walks = batch_random_walks(graph, starts, p, q, 3, rng, bipartite)
+            self.assertEqual(walks.shape, (20000, 3))
+            self.assertEqual(walks.dtype, np.int32)
+
+            for current in set(walks[:, 1].tolist()):
+                neighbors = graph_probs[graph.index[start]][current]
+                counts = {key: 0 for key in neighbors.keys()}
+                for key in walks[walks[:, 1] == current, 2].tolist():
+                    counts[key] += 1
+                mc_estimate = prob_distribution_from_dict(counts)
+                real_prob_distribution = prob_distribution_from_dict({key: neighbors[key] for key in counts})
+                for key in counts:
+                    self.assertAlmostEqual(mc_estimate[key], real_prob_distribution[key], places=1)
+
+    def test_benchmark_batch_walks(self):
+        path_save_sentences = os.path.join(RelationsData.FOLDER, "test.txt")
+        dataloader = RelationsDataLoader(self.path_big_csv, min_like=1)
+        matrix_prob, graph = dataloader.get_transition_probabilites(0.5, 2)
+        steps = graph.num_nodes * 80
+
+        start = time.time()
+        sample_walks(path_save_sentences, matrix_prob, graph, 1, 80)
+        logging.info(f"Python loop: {steps / (time.time() - start):.0f} steps/s")
+        for bipartite in [False, True]:
+            start = time.time()
+            sample_walks_batch(path_save_sentences, graph, 0.5, 2, 1, 80, bipartite=bipartite)
+            logging.info(f"Batch engine (bipartite={bipartite}): {steps / (time.time() - start):.0f} steps/s")
+        os.remove(path_save_sentences)
+        remove_counts(path_save_sentences)
+
+    def test_transition_cache(self):
+        p, q = self.PARAMETERS["p"], self.PARAMETERS["q"]
+        with tempfile.TemporaryDirectory() as folder:
+            cache = TransitionCache(folder)
+            alias_probs, graph = RelationsDataLoader(RelationsData.CSV_FILE).get_transition_probabilites(
+                p, q, ALIAS, cache
+            )
+            self.assertEqual(len(cache.entries()), 2)
+            # Hit: same graph and tables, without precomputing
+            cached_probs, cached_graph = RelationsDataLoader(RelationsData.CSV_FILE).get_transition_probabilites(
+                p, q, ALIAS, cache
+            )
+            self.assertEqual(cached_graph.decode(range(cached_graph.num_nodes)), graph.decode(range(graph.num_nodes)))
+            np.testing.assert_array_equal(cached_graph.indices, graph.indices)
+            for previous, possible_starts in alias_probs.items():
+                for start, sampler in possible_starts.items():
+                    np.testing.assert_array_equal(cached_probs[previous][start].probabilities(),
+                                                  sampler.probabilities())
+
+            # Other parameters only share the graph
+            RelationsDataLoader(RelationsData.CSV_FILE).get_transition_probabilites(1., 1., ALIAS, cache)
+            self.assertEqual(len(cache.entries()), 3)
+
+            # A hit doesn't read the edge file, and the bipartite check comes with the graph
+            dataloader = RelationsDataLoader(RelationsData.CSV_FILE)
+            dataloader.get_graph(cache)
+            self.assertEqual(dataloader.is_bipartite(), RelationsDataLoader(RelationsData.CSV_FILE).is_bipartite())
+            self.assertIsNone(dataloader._df)
+
+            # Only the entries and the leftovers of interrupted saves are cleared
+            os.makedirs(os.path.join(folder, "0" * 64 + ".tmp123"))
+            with open(os.path.join(folder, "notes.txt"), 'w') as f:
+                f.write("not an entry")
+            os.makedirs(os.path.join(folder, "data"))
+            cache.clear()
+            self.assertEqual(sorted(os.listdir(folder)), ["data", "notes.txt"])
+
+            # Only the complete entries are evicted
+            cache = TransitionCache(folder)
+            RelationsDataLoader(RelationsData.CSV_FILE).get_graph(cache)
+            os.makedirs(os.path.join(folder, "1" * 64 + ".tmp123"))
+            self.assertEqual(len(cache.entries()), 1)
+            cache.max_bytes = 0
+            cache.evict()
+            self.assertEqual(cache.entries(), [])
+            self.assertEqual(sorted(os.listdir(folder)), ["1" * 64 + ".tmp123", "data", "notes.txt"])
+
+    def test_incremental_update(self):
+        p, q = self.PARAMETERS["p"], self.PARAMETERS["q"]
+        # A new user likes an existing page, an existing user likes a new page
+        graph, affected = add_edges(self.graph, ["user_new", "user1"], ["page1", "page_new"])
+        self.assertEqual(graph.decode(range(self.graph.num_nodes)), self.graph.decode(range(self.graph.num_nodes)))
+        self.assertTrue(graph.has_edges(graph.encode(["user_new"]), graph.encode(["page1"]))[0])
+        self.assertTrue(graph.is_like[graph.index["page_new"]])
+        for node in ["user_new", "page_new", "user1", "page1", "user2", "user6"]:
+            self.assertTrue(affected[graph.index[node]])
+
+        updated = update_transitions(self.dict_probs, graph, affected, FULL, p, q)
+        expected = DataLoader._neighbors_neighbors(graph, p, q)
+        self.assertEqual(set(updated.keys()), set(expected.keys()))
+        for previous, possible_starts in expected.items():
+            for start, neighbors in possible_starts.items():
+                row = updated[previous][start]
+                self.assertEqual({key: row[key] for key in row.keys()},
+                                 {key: neighbors[key] for key in neighbors.keys()})
+
+        # Capped tables: the untouched hubs keep their sample, the rows of the affected nodes use the new ones
+        for strategy in [FULL, ALIAS]:
+            old_hubs, hubs = hub_neighbors(self.graph, 1, seed=0), hub_neighbors(graph, 1, seed=0)
+            if strategy == FULL:
+                capped = DataLoader._neighbors_neighbors(self.graph, p, q, old_hubs)
+                expected = DataLoader._neighbors_neighbors(graph, p, q, hubs)
+            else:
+                capped = {previous: alias_row(self.graph, previous, p, q, old_hubs)
+                          for previous in range(self.graph.num_nodes)}
+                expected = {previous: alias_row(graph, previous, p, q, hubs) for previous in range(graph.num_nodes)}
+            updated = update_transitions(capped, graph, affected, strategy, p, q, hubs)
+            for previous, possible_starts in expected.items():
+                for start, neighbors in possible_starts.items():
+                    row = updated[previous][start]
+                    self.assertEqual(list(row.keys()), list(neighbors.keys()))
+                    if strategy == FULL:
+                        self.assertEqual([row[key] for key in row.keys()], [neighbors[key] for key in row.keys()])
+                    else:
+                        np.testing.assert_array_equal(row.probabilities(), neighbors.probabilities())
+
+            # The same rows, built only when a walk comes from their node
+            for hubs_of_update in [None, hubs]:
+                on_demand = walk_transitions(graph, strategy, p, q, hubs_of_update)
+                self.assertEqual(len(on_demand._rows), 0)
+                resample_walks(graph, np.array([graph.index["user_new"]], dtype=np.int32), 1, 3, on_demand)
+                self.assertLessEqual(len(on_demand._rows), 2)
+                rows = (DataLoader._neighbors_row if strategy == FULL else alias_row)
+                for previous in range(graph.num_nodes):
+                    expected_row = rows(graph, previous, p, q, hubs_of_update)
+                    self.assertEqual(on_demand[previous].keys(), expected_row.keys())
+                    for start, neighbors in expected_row.items():
+                        self.assertEqual(list(on_demand[previous][start].keys()), list(neighbors.keys()))
+
+        with tempfile.TemporaryDirectory() as folder:
+            path_corpus = os.path.join(folder, "walks.txt")
+            sample_walks(path_corpus, self.dict_probs, self.graph, walks_per_node=2, walk_length=6)
+            with open(path_corpus) as f:
+                kept = [line for line in f if not affected[graph.index[line.split()[0]]]]
+
+            walks = resample_walks(graph, np.flatnonzero(affected).astype(np.int32), 2, 6, updated)
+            update_corpus(path_corpus, graph, affected, walks)
+            self.assertFalse(os.path.exists(counts_path(path_corpus)))
+            with open(path_corpus) as f:
+                lines = f.readlines()
+            self.assertEqual(lines[:len(kept)], kept)
+            self.assertEqual(len(lines), len(kept) + 2 * affected.sum())
+
+            # Binary corpus: the kept walks are copied by chunks, then the new walks are appended
+            path_corpus = os.path.join(folder, "walks.npy")
+            sample_walks(path_corpus, self.dict_probs, self.graph, walks_per_node=2, walk_length=6)
+            corpus = WalkCorpus(path_corpus)
+            kept_walks = [walk for walk in corpus if not affected[graph.index[walk[0]]]]
+            del corpus
+            update_corpus(path_corpus, graph, affected, walks)
+            corpus = WalkCorpus(path_corpus)
+            self.assertEqual(len(corpus), len(kept_walks) + 2 * affected.sum())
+            self.assertEqual(list(corpus)[:len(kept_walks)], kept_walks)
+            self.assertEqual(list(corpus)[len(kept_walks):], [graph.decode(walk) for walk in walks])
+            del corpus
+
+            # Codes of a corpus sampled on another build of the graph are mapped through its vocabulary
+            sample_walks(path_corpus, self.dict_probs, self.graph, walks_per_node=2, walk_length=6)
+            old_walks = list(WalkCorpus(path_corpus))
+            order = np.arange(self.graph.num_nodes)[::-1]
+            codes = np.load(path_corpus)
+            np.save(path_corpus, order[codes].astype(np.uint32))
+            write_vocab(path_corpus, self.graph.nodes[order].astype(object))
+            self.assertEqual(list(WalkCorpus(path_corpus)), old_walks)
+            update_corpus(path_corpus, graph, affected, walks)
+            self.assertEqual(list(WalkCorpus(path_corpus))[:len(kept_walks)],
+                             [walk for walk in old_walks if not affected[graph.index[walk[0]]]])
+
+            write_vocab(path_corpus, np.array(["unknown"] + graph.nodes.tolist()[1:], dtype=object))
+            with self.assertRaises(ValueError):
+                update_corpus(path_corpus, graph, affected, walks)
+
+            # A second delta is added to the graph of the first one, not to the edge file
+            for extension in ["txt", "npy"]:
+                path_corpus = os.path.join(folder, f"updated.{extension}")
+                preparing_samples(self.dataloader, p, q, 6, 2, 2, path_corpus, FULL, seed=0)
+                self.assertIsNone(load_graph(path_corpus))
+                for users, likes in [(["user_new"], ["page1"]), (["user_new"], ["page_new"])]:
+                    path_delta = os.path.join(folder, "delta.csv")
+                    pd.DataFrame({RelationsData.USER_ID: users, RelationsData.LIKE_ID: likes}).to_csv(path_delta)
+                    like_nodes = updating_samples(self.dataloader, RelationsDataLoader(path_delta), p, q, 6, 2,
+                                                  path_corpus, FULL, seed=0)
+                updated_graph = load_graph(path_corpus)
+                self.assertTrue(updated_graph.has_edges(updated_graph.encode(["user_new", "user_new"]),
+                                                        updated_graph.encode(["page1", "page_new"])).all())
+                self.assertIn("page_new", like_nodes)
+                self.assertEqual({node for walk in load_sentences(path_corpus) for node in walk} - {"page_new"},
+                                 set(self.graph.nodes.tolist()) | {"user_new"})
+                # Sampled again: the saved graph is stale
+                preparing_samples(self.dataloader, p, q, 6, 2, 2, path_corpus, FULL, seed=0)
+                self.assertIsNone(load_graph(path_corpus))
+
+    def test_embeddings_export(self):
+        ids = ["3", "1", "2"]
+        vectors = np.random.rand(3, 4).astype(np.float32)
+        with tempfile.TemporaryDirectory() as folder:
+            matrices = []
+            for extension in EMBEDDING_FORMATS:
+                path = os.path.join(folder, "features." + extension)
+                save_embeddings(path, ids, vectors)
+                loaded_ids, loaded_vectors = load_embeddings(path)
+                self.assertEqual(loaded_ids.tolist(), ids)
+                np.testing.assert_array_equal(loaded_vectors, vectors)
+                matrices.append(create_features(path))
+            self.assertIsInstance(load_embeddings(os.path.join(folder, "features.npy"))[1], np.memmap)
+            np.testing.assert_array_equal(matrices[0], matrices[1])
+            np.testing.assert_array_equal(matrices[0][0], vectors[1])
+
+            # Sparse ids: one row up to the largest id, the embeddings after num_nodes are dropped
+            path = os.path.join(folder, "sparse.npy")
+            save_embeddings(path, ["5", "2"], vectors[:2])
+            features = create_features(path)
+            self.assertEqual(features.shape, (5, 4))
+            np.testing.assert_array_equal(features[[4, 1]], vectors[:2])
+            with self.assertLogs(level="WARNING"):
+                features = create_features(path, 3)
+            self.assertEqual(features.shape, (3, 4))
+            np.testing.assert_array_equal(features[1], vectors[1])
+            self.assertFalse(features[[0, 2]].any())
+
+    def test_multilabel_evaluation(self):
+        rng = np.random.default_rng(0)
+        num_nodes, num_groups = 200, 4
+        groups = rng.integers(0, num_groups, num_nodes)
+        with tempfile.TemporaryDirectory() as folder:
+            path_labels = os.path.join(folder, "group-edges.csv")
+            pd.DataFrame({"node": np.arange(1, num_nodes + 1), "group": groups + 1}).to_csv(
+                path_labels, header=False, index=False)
+            labels = create_labels(path_labels)
+        self.assertEqual(labels.shape, (num_nodes, num_groups))
+        np.testing.assert_array_equal(labels.toarray().argmax(axis=1), groups)
+
+        predictions = top_labels(np.array([[0.1, 0.5, 0.4], [0.3, 0.2, 0.5]]), np.array([2, 1]))
+        np.testing.assert_array_equal(predictions.toarray(), [[0, 1, 1], [0, 0, 1]])
+
+        features = np.eye(num_groups)[groups] + 0.1 * rng.standard_normal((num_nodes, num_groups))
+        clf = OneVsRestClassifier(LogisticRegression(solver='lbfgs'))
+        with self.assertLogs(level="INFO") as logs:
+            macro_f1 = k_fold_average(features, labels, clf, k=4, workers=1, seed=0)
+        # Every fold is evaluated
+        self.assertEqual(sum("Fold" in line and "Macro F1" in line for line in logs.output), 4)
+        self.assertGreater(macro_f1, 0.9)
+        self.assertEqual(k_fold_average(features, labels, clf, k=4, workers=2, seed=0), macro_f1)
+
+    def test_sweep_walks(self):
+        configs = grid([0.5, 2.], [1.], [16, 32], [5])
+        self.assertEqual(len(configs), 4)
+        self.assertEqual(parallelism(len(configs), 8), {"tasks": 4, "threads": 2})
+        self.assertEqual(parallelism(len(configs), 2), {"tasks": 2, "threads": 1})
+        with tempfile.TemporaryDirectory() as folder:
+            results = sweep(self.graph, configs, folder, walk_length=6, walks_per_node=2, cores=2, seed=0,
+                            train=False)
+            # One corpus per (p, q) pair, shared by the dimensions and windows
+            self.assertEqual(results[["p", "q"]].values.tolist(), [[0.5, 1.], [2., 1.]])
+            for p in [0.5, 2.]:
+                corpus = np.load(walks_path(folder, p, 1.))
+                self.assertEqual(corpus.shape, (2 * self.graph.num_nodes, 6))
+            serial = os.path.join(folder, "serial")
+            os.mkdir(serial)
+            sweep(self.graph, configs, serial, walk_length=6, walks_per_node=2, cores=1, seed=0, train=False)
+            np.testing.assert_array_equal(np.load(walks_path(serial, 2., 1.)), np.load(walks_path(folder, 2., 1.)))
+
+    def test_nearest_neighbors(self):
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((500, 16)).astype(np.float32)
+        ids = np.array([str(i) for i in range(500)], dtype=object)
+        is_like = np.arange(500) % 2 == 0
+        neighbors = NearestNeighbors(ids, vectors, is_like, block_size=64)
+
+        # Blocked search is the brute force search
+        normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        expected = np.argsort(-(normalized[:20] @ normalized.T), axis=1)[:, :5]
+        rows, scores = neighbors.search(vectors[:20], 5)
+        np.testing.assert_array_equal(rows, expected)
+        np.testing.assert_allclose(scores[:, 0], 1., rtol=1e-5)
+
+        rows, _ = neighbors.search(vectors[:20], 5, kind=USERS)
+        self.assertFalse(is_like[rows].any())
+        similar = neighbors.most_similar(["0", "1"], 3, kind=LIKES)
+        self.assertEqual([len(result) for result in similar], [3, 3])
+        self.assertNotIn("0", [node for node, _ in similar[0]])
+
+        # Probing every list is exact
+        index = IVFIndex(neighbors, n_lists=8, seed=0)
+        approximate, _ = index.search(vectors[:20], 5, nprobe=8)
+        np.testing.assert_array_equal(approximate, expected)
+        approximate, _ = index.search(vectors[:20], 5, nprobe=2)
+        self.assertGreater(recall(expected, approximate), 0.)
+        # Clusters with fewer candidates than k: only real nodes are returned
+        sparse = IVFIndex(neighbors, n_lists=250, seed=0)
+        similar = neighbors.most_similar(ids[:20].tolist(), 5, kind=LIKES, index=sparse, nprobe=1)
+        self.assertTrue(any(len(result) < 5 for result in similar))
+        for result in similar:
+            self.assertTrue(all(np.isfinite(score) and is_like[int(node)] for node, score in result))
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "features.npy")
+            save_embeddings(path, ids, vectors, is_like)
+            from_file = NearestNeighbors.from_file(path)
+            np.testing.assert_array_equal(from_file.is_like, is_like)
+            np.testing.assert_array_equal(from_file.search(vectors[:20], 5)[0], expected)
+            results = benchmark_queries(path, k=5, n_queries=50, n_lists=8, nprobes=[8], seed=0)
+            self.assertEqual(results["ivf_nprobe_8"]["recall"], 1.)
+
+    def test_chunked_ingestion(self):
+        chunked = RelationsDataLoader(RelationsData.CSV_FILE, min_like=2, chunksize=3)
+        df = pd.read_csv(RelationsData.CSV_FILE)
+        whole = DataLoader(df, RelationsData.USER_ID, RelationsData.LIKE_ID, min_like=2)
+        # Codes depend on the chunks, not the edges and the degrees of the ids
+        for chunked_ids, whole_ids in zip(chunked.get_edges(), whole.get_edges()):
+            self.assertEqual(chunked_ids.tolist(), whole_ids.tolist())
+        self.assertEqual(dict(zip(chunked.vocab, chunked.like_degrees)), dict(zip(whole.vocab, whole.like_degrees)))
+        self.assertEqual(chunked.like_degrees[chunked.vocab.tolist().index("page1")],
+                         (df[RelationsData.LIKE_ID] == "page1").sum())
+
+        graph = chunked.get_graph()
+        self.assertEqual(sorted(graph.like_nodes()), sorted(df[RelationsData.LIKE_ID].value_counts()
+                                                            .loc[lambda counts: counts >= 2].index))
+
+    def test_edge_file_formats(self):
+        with tempfile.TemporaryDirectory() as folder:
+            paths = write_edge_files(folder, 5000, seed=0)
+            self.assertEqual(set(paths), {CSV, NPY, PARQUET, FEATHER} if pyarrow_available() else {CSV, NPY})
+            csv = RelationsDataLoader(paths[CSV], min_like=2)
+            csv_edges = [ids.tolist() for ids in csv.get_edges()]
+            for fmt, path in paths.items():
+                if fmt == CSV:
+                    continue
+                # Small chunks, so the ids are interned across chunks
+                dataloader = EdgeFileDataLoader(path, min_like=2, chunksize=700)
+                self.assertIsInstance(create_dataloader(RelationsData.FOLDER, path, 2, 700, None), EdgeFileDataLoader)
+                # Same edges and degrees as the csv, the int64 ids are only converted to strings once
+                self.assertEqual([ids.tolist() for ids in dataloader.get_edges()], csv_edges)
+                self.assertEqual(dict(zip(dataloader.vocab, dataloader.like_degrees)),
+                                 dict(zip(csv.vocab, csv.like_degrees)))
+                self.assertEqual(dataloader.get_graph().num_edges, csv.get_graph().num_edges)
+
+            path_wrong = os.path.join(folder, "wrong.npy")
+            np.save(path_wrong, np.arange(6))
+            with self.assertRaises(ValueError):
+                EdgeFileDataLoader(path_wrong)
+            with self.assertRaises(ValueError):
+                EdgeFileDataLoader(paths[CSV])
+
+            if pyarrow_available():
+                # Nullable int columns (likes first): the rows with a missing id are dropped before they
+                # reach pandas, so the ids of every chunk stay ints
+                nullable = pd.DataFrame({RelationsData.LIKE_ID: [2, 1, None, 11, 10, 1],
+                                         RelationsData.USER_ID: [1, None, 2, 10, 11, 3]}).astype("Int64")
+                for fmt in [PARQUET, FEATHER]:
+                    path = os.path.join(folder, "nullable." + fmt)
+                    nullable.to_parquet(path) if fmt == PARQUET else nullable.to_feather(path)
+                    dataloader = EdgeFileDataLoader(path, chunksize=3)
+                    self.assertEqual(sorted(dataloader.vocab.tolist()), ["1", "10", "11", "2", "3"])
+                    self.assertEqual([ids.tolist() for ids in dataloader.get_edges()],
+                                     [["1", "10", "11", "3"], ["2", "11", "10", "1"]])
+
+    def test_vectorized_adjacency(self):
+        dataloader = RelationsDataLoader(self.path_big_csv, min_like=3)
+        df = dataloader.df
+        pd.testing.assert_series_equal(dataloader.get_df_likes(),
+                                       df.groupby(dataloader.LIKE_ID)[dataloader.USER_ID].apply(list))
+        pd.testing.assert_series_equal(dataloader.get_df_users(),
+                                       df.groupby(dataloader.USER_ID)[dataloader.LIKE_ID].apply(list))
+
+        # Previous filter: loop over the connections of each like
+        likes = df.groupby(dataloader.LIKE_ID)[dataloader.USER_ID].apply(list)
+        ids_to_drop = [like for like, users in likes.items() if len(users) < dataloader.min_like]
+        expected = df[~df[dataloader.LIKE_ID].isin(ids_to_drop)]
+        graph = dataloader.get_graph()
+        pd.testing.assert_frame_equal(dataloader.df, expected)
+
+        # Previous adjacency: sum of the lists of the users and of the likes
+        df_users = expected.groupby(dataloader.USER_ID)[dataloader.LIKE_ID].apply(list)
+        df_likes = expected.groupby(dataloader.LIKE_ID)[dataloader.USER_ID].apply(list)
+        neighbors = pd.concat([df_users, df_likes]).groupby(level=0).apply(sum)
+        self.assertEqual(graph.num_nodes, len(neighbors))
+        for code, node_neighbors in neighbors.items():
+            self.assertEqual(graph.decode(graph.neighbors(graph.index[dataloader.vocab[code]])),
+                             sorted(set(dataloader.vocab[node_neighbors].tolist()), key=graph.index.get))
+
+    def test_benchmark_alias_sampler(self):
+        n_keys, n_samples = 100, 10 ** 5
+        weights = np.random.rand(n_keys) + 0.1
+
+        tracemalloc.start()
+        weighted_dict = WeightedDict()
+        for key, weight in enumerate(weights):
+            weighted_dict[key] = weight
+        memory_weighted_dict = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        tracemalloc.start()
+        sampler = AliasSampler.from_weights(np.arange(n_keys, dtype=np.int32), weights)
+        memory_alias = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        start = time.time()
+        for _ in range(n_samples):
+            weighted_dict.sample()
+        time_weighted_dict = time.time() - start
+
+        start = time.time()
+        for _ in range(n_samples):
+            sampler.sample()
+        time_alias = time.time() - start
+
+        logging.info(f"WeightedDict: {n_samples / time_weighted_dict:.0f} samples/s, {memory_weighted_dict} bytes")
+        logging.info(f"AliasSampler: {n_samples / time_alias:.0f} samples/s, {memory_alias} bytes")
+
     def test_node_list(self):
         self.assertEqual(len(self.dataloader.list_all_nodes()), 10)
 
+    def test_graph(self):
+        self.assertEqual(self.graph.num_nodes, 10)
+        self.assertEqual(self.graph.num_edges, 2 * 10)
+        self.assertEqual(set(self.graph.like_nodes()), {"page1", "page2", "page3", "page4"})
+        neighbors = self.graph.decode(self.graph.neighbors(self.index["page1"]))
+        self.assertEqual(set(neighbors), {"user1", "user2", "user6"})
+
+    def test_generate_graph(self):
+        df = generate_graph(1000, 100, 10000, exponent=2.5, seed=0)
+        self.assertEqual(len(df), 10000)
+        users, likes = df[RelationsData.USER_ID], df[RelationsData.LIKE_ID]
+        self.assertEqual(len(np.intersect1d(users, likes)), 0)
+        # Heavy tail: the most active user has many times the mean degree, unlike with uniform endpoints
+        self.assertGreater(users.value_counts().max(), 10 * users.value_counts().mean())
+        uniform = generate_graph(1000, 100, 10000, exponent=None, seed=0)[RelationsData.USER_ID].value_counts()
+        self.assertLess(uniform.max(), 5 * uniform.mean())
+
+        df = generate_graph(1000, 100, 10000, bipartite=False, seed=0)
+        self.assertGreater(len(np.intersect1d(df[RelationsData.USER_ID], df[RelationsData.LIKE_ID])), 0)
+        self.assertFalse((df[RelationsData.USER_ID] == df[RelationsData.LIKE_ID]).any())
+
+    def test_memory_planner(self):
+        df = generate_graph(300, 300, 3000, bipartite=False, seed=0)
+        dataloader = DataLoader(df, RelationsData.USER_ID, RelationsData.LIKE_ID)
+        graph = dataloader.get_graph()
+        estimates = estimate_memory(graph, bipartite=False, max_degree=5)
+        self.assertEqual([estimate.name for estimate in estimates],
+                         ["alias", "full", "alias (max_degree=5)", "full (max_degree=5)", "lazy"])
+        self.assertEqual(estimates[0].entries, int(np.square(graph.degrees().astype(np.int64)).sum()))
+        self.assertLess(estimates[2].entries, estimates[0].entries)
+
+        # The estimates are close to the memory of the tables actually built
+        for estimate, strategy in zip(estimates[:2], [ALIAS, FULL]):
+            tracemalloc.start()
+            transitions, _ = dataloader.get_transition_probabilites(2., 0.5, strategy)
+            allocated = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            del transitions
+            self.assertLess(abs(estimate.bytes - graph_bytes(graph) - allocated), 0.5 * allocated)
+
+        self.assertEqual(plan_strategy(estimates, 10 ** 12).name, "alias")
+        self.assertEqual(plan_strategy(estimates, 1).strategy, LAZY)
+        # Fastest first, the capped strategies only if allowed
+        plan = [Estimate(ALIAS, None, 100, 1000), Estimate(ALIAS, 5, 10, 100), Estimate(LAZY, None, 0, 10)]
+        self.assertEqual(plan_strategy(plan, 500).name, "lazy")
+        self.assertEqual(plan_strategy(plan, 500, capped=True).name, "alias (max_degree=5)")
+        self.assertEqual(plan_strategy(plan, 1000, capped=True).name, "alias")
+        self.assertEqual(estimate_memory(graph, bipartite=True)[0].strategy, BIPARTITE)
+        self.assertIn("fits", format_plan(graph, estimates, 10 ** 9))
+
+    def test_benchmark_suite(self):
+        results = run_suite([2000], train=False)
+        stages = {(record["name"], record["bipartite"]) for record in results["results"]}
+        self.assertEqual(stages, {(name, bipartite) for name in ["load", "filter", "precompute", "walk"]
+                                  for bipartite in [True, False]})
+        for record in results["results"]:
+            self.assertGreater(record["peak_rss"], 0)
+        self.assertEqual(compare_results(results, results), [])
+
+        slower = json.loads(json.dumps(results))
+        for record in slower["results"]:
+            record["wall"] = 10 * record["wall"] + 1
+        self.assertEqual(len(compare_results(results, slower)), len(results["results"]))
+
+    def test_metrics_report(self):
+        metrics.reset()
+        with tempfile.TemporaryDirectory() as folder:
+            path_walks = os.path.join(folder, "walks.txt")
+            with metrics.profiling(CPROFILE, os.path.join(folder, "run.prof")):
+                preparing_samples(self.dataloader, 1., 1., 10, 2, 5, path_walks, strategy=ALIAS)
+            self.assertEqual([record["name"] for record in metrics.spans], ["precompute", "walk"])
+            walk = metrics.spans[1]
+            for field in ["wall", "cpu", "peak_rss", "steps_per_sec"]:
+                self.assertGreater(walk[field], 0)
+            self.assertEqual(metrics.counters["walks"], 2 * self.graph.num_nodes)
+            self.assertEqual(metrics.counters["steps"], 2 * self.graph.num_nodes * 9)
+            self.assertEqual(metrics.counters["transition_entries"], np.square(self.graph.degrees()).sum())
+            self.assertTrue(metrics.profile[CPROFILE])
+            self.assertTrue(os.path.exists(os.path.join(folder, "run.prof")))
+
+            with metrics.profiling(TRACEMALLOC):
+                sample_walks(path_walks, self.dict_probs, self.graph, 1, 10)
+            self.assertGreater(metrics.profile[TRACEMALLOC]["peak_traced"], 0)
+
+            path_report = os.path.join(folder, "run.metrics.json")
+            metrics.write_report(path_report, p=1.)
+            with open(path_report) as f:
+                report = json.load(f)
+            self.assertEqual(report["run"]["p"], 1.)
+            self.assertEqual(len(report["spans"]), 2)
+            self.assertEqual(report["counters"]["walks"], 3 * self.graph.num_nodes)
+        metrics.reset()
+
     def test_benchmark_performance(self):
         start = time.time()
         path_save_sentences = os.path.join(RelationsData.FOLDER, "test.txt")
@@ -78,5 +1019,16 @@ class UtilsTest(unittest.TestCase):
         # Delete file when done
         if os.path.exists(path_save_sentences):
             os.remove(path_save_sentences)
+            remove_counts(path_save_sentences)
+
+        logging.info(f"{(time.time() - start):.2f} seconds elapsed")
 
-        logging.info(f"{(time.time() - start):.2f} seconds elapsed")
\ No newline at end of file
+    def test_benchmark_parallel_walks(self):
+        path_save_sentences = os.path.join(RelationsData.FOLDER, "test.txt")
+        matrix_prob, graph = RelationsDataLoader(self.path_big_csv, min_like=1).get_transition_probabilites(0.5, 2)
+        for workers in sorted({1, 2, multiprocessing.cpu_count()}):
+            start = time.time()
+            sample_walks(path_save_sentences, matrix_prob, graph, 1, 80, workers=workers, seed=0)
+            logging.info(f"{workers} workers: {graph.num_nodes * 80 / (time.time() - start):.0f} steps/s")
+        os.remove(path_save_sentences)
+        remove_counts(path_save_sentences)
\ No newline at end of file